@@ -1,10 +1,20 @@
 
-from . import read_lut, apply_lut
+from . import read_lut, apply_lut, bake_lut, apply_baked_lut
+from .bake_lut import FULL_TABLE_BYTES
 import numpy as np
 
 class LUT:
-	def __init__(self, path):
+	def __init__(self, path, interpolation:str="trilinear"):
+		"""interpolation: trilinear | tetrahedral"""
 		self.data:np.ndarray = read_lut(path)
+		self.interpolation = interpolation
+		self.table:np.ndarray = None # baked for 8 bit pixels
 
-	def apply(self, pixels:np.ndarray)->np.ndarray:
-		return apply_lut(pixels)
+	def bake(self, max_bytes:int=FULL_TABLE_BYTES, num_threads:int=1)->None:
+		"""bake a lookup table for 8 bit pixels, apply uses it for uint8 pixels"""
+		self.table = bake_lut(self.data, max_bytes, self.interpolation, num_threads)
+
+	def apply(self, pixels:np.ndarray, cancel:np.ndarray=None, num_threads:int=1)->np.ndarray:
+		if self.table is not None and pixels.dtype == np.uint8:
+			return apply_baked_lut(pixels, self.table, cancel, num_threads)
+		return apply_lut(pixels, self.data, cancel, num_threads, self.interpolation)
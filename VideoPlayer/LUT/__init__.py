@@ -1,4 +1,6 @@
 from .read_lut import read_lut
 from .apply_lut_cython import apply_lut_cython as apply_lut
+from .apply_lut_cython import apply_baked_lut_cython as apply_baked_lut
+from .bake_lut import bake_lut
 
 from .LUT import LUT
\ No newline at end of file
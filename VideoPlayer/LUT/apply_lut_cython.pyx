@@ -2,8 +2,10 @@ import numpy as np
 cimport numpy as np
 from cython cimport boundscheck, wraparound, nonecheck, cdivision
 from libc.math cimport floor, ceil, round
+from cython.parallel cimport prange
 
 DTYPE = np.float32
+INTERPOLATIONS = ("trilinear", "tetrahedral")
 ctypedef np.float32_t DTYPE_t
 
 
@@ -11,12 +13,38 @@ ctypedef np.float32_t DTYPE_t
 @wraparound(False)
 @nonecheck(False)
 @cdivision(True)
-def apply_lut_cython(DTYPE_t[:,:,::1] pixels, DTYPE_t[:,:,:,::1] lut):
+cdef inline DTYPE_t clamp(DTYPE_t value, DTYPE_t upper) nogil:
+    """clamp to [0, upper], NaN to 0"""
+    if not value >= 0:
+        return 0
+    if value > upper:
+        return upper
+    return value
+
+
+@boundscheck(False)
+@wraparound(False)
+@nonecheck(False)
+@cdivision(True)
+def apply_lut_cython(const DTYPE_t[:,:,::1] pixels, const DTYPE_t[:,:,:,::1] lut, cancel=None, int num_threads=1, interpolation="trilinear"):
+    """interpolation: 'trilinear' blends the 8 corners of the lattice cell,
+    'tetrahedral' the 4 corners of a tetrahedron in the cell, like grading tools.
+    cancel: optional one element flag, checked on every row.
+    When it is set, the pass is abandoned and None is returned.
+    num_threads: rows are processed in parallel with OpenMP, when the extension
+    was built with it. Runs without the GIL."""
     # pixels variables
     cdef int height = pixels.shape[0]
     cdef int width = pixels.shape[1]
     cdef int channels = pixels.shape[2]
-    cdef int i, u, v, count
+    cdef int u, v, c
+
+    if interpolation not in INTERPOLATIONS:
+        raise ValueError("unknown interpolation: {}, use one of {}".format(interpolation, INTERPOLATIONS))
+    cdef bint tetrahedral = interpolation == "tetrahedral"
+
+    # cancellation flag
+    cdef const unsigned char[::1] flag = cancel if cancel is not None else np.zeros(1, dtype=np.uint8)
 
     # lut variables
     cdef int X = lut.shape[0]
@@ -30,70 +58,204 @@ def apply_lut_cython(DTYPE_t[:,:,::1] pixels, DTYPE_t[:,:,:,::1] lut):
     cdef DTYPE_t x,y,z
     cdef int x0, y0, z0, x1, y1, z1
     cdef DTYPE_t xd, yd, zd, c00, c01, c10, c11, c0, c1, c_blue, c_green, c_red
+    cdef int ax, ay, az, bx, by, bz
+    cdef DTYPE_t w0, w1, w2, w3
 
     dst = np.empty( (height, width, channels), dtype=DTYPE )
     cdef DTYPE_t[:,:,::1] result_view = dst
 
-    for i in range(width * height):
-        u = i%width
-        v = i//width
-
-        # get src color
-        x = pixels[v,u,0] * X
-        y = pixels[v,u,1] * Y
-        z = pixels[v,u,2] * Z
-
-        # lookup cube coordinates
-        x0 = <int>floor( x )
-        x1 = x0+1
-        y0 = <int>floor( y )
-        y1 = y0+1
-        z0 = <int>floor( z )
-        z1 = z0+1
-
-        xd = (x-x0)/(x1-x0)
-        yd = (y-y0)/(y1-y0)
-        zd = (z-z0)/(z1-z0)
+    for v in prange(height, nogil=True, schedule='static', num_threads=max(num_threads, 1)):
+        if flag[0]:
+            continue # no early exit from a parallel loop, skip the remaining rows
+        for u in range(width):
+            # get src color, the cube spans 0-1 with X points
+            x = clamp(pixels[v,u,0], 1) * (X-1)
+            y = clamp(pixels[v,u,1], 1) * (Y-1)
+            z = clamp(pixels[v,u,2], 1) * (Z-1)
+
+            # lookup cube coordinates, 1.0 interpolates the last cell at its end
+            x0 = min(<int>floor( x ), X-2)
+            x1 = x0+1
+            y0 = min(<int>floor( y ), Y-2)
+            y1 = y0+1
+            z0 = min(<int>floor( z ), Z-2)
+            z1 = z0+1
+
+            xd = x-x0
+            yd = y-y0
+            zd = z-z0
         
-        # Trilinear Interpolation
-        #  blue
-        c00 = lut[z0, y0, x0, 0]*(1-xd) + lut[z0, y0, x1, 0]*xd
-        c01 = lut[z1, y0, x0, 0]*(1-xd) + lut[z1, y0, x1, 0]*xd
-        c10 = lut[z0, y1, x0, 0]*(1-xd) + lut[z0, y1, x1, 0]*xd
-        c11 = lut[z1, y1, x0, 0]*(1-xd) + lut[z1, y1, x1, 0]*xd
+            if tetrahedral:
+                # Tetrahedral Interpolation
+                # the cell splits into 6 tetrahedra around its diagonal, the order
+                # of the fractions picks the one of the pixel. Each tetrahedron
+                # has the diagonal corners and two more, a and b.
+                if xd > yd:
+                    if yd > zd:
+                        ax, ay, az, bx, by, bz = x1, y0, z0, x1, y1, z0
+                        w0, w1, w2, w3 = 1-xd, xd-yd, yd-zd, zd
+                    elif xd > zd:
+                        ax, ay, az, bx, by, bz = x1, y0, z0, x1, y0, z1
+                        w0, w1, w2, w3 = 1-xd, xd-zd, zd-yd, yd
+                    else:
+                        ax, ay, az, bx, by, bz = x0, y0, z1, x1, y0, z1
+                        w0, w1, w2, w3 = 1-zd, zd-xd, xd-yd, yd
+                else:
+                    if zd > yd:
+                        ax, ay, az, bx, by, bz = x0, y0, z1, x0, y1, z1
+                        w0, w1, w2, w3 = 1-zd, zd-yd, yd-xd, xd
+                    elif zd > xd:
+                        ax, ay, az, bx, by, bz = x0, y1, z0, x0, y1, z1
+                        w0, w1, w2, w3 = 1-yd, yd-zd, zd-xd, xd
+                    else:
+                        ax, ay, az, bx, by, bz = x0, y1, z0, x1, y1, z0
+                        w0, w1, w2, w3 = 1-yd, yd-xd, xd-zd, zd
+
+                for c in range(3):
+                    result_view[v,u,c] = (w0*lut[z0, y0, x0, c] + w1*lut[az, ay, ax, c] + 
+                        w2*lut[bz, by, bx, c] + w3*lut[z1, y1, x1, c])
+                continue
+
+            # Trilinear Interpolation
+            #  blue
+            c00 = lut[z0, y0, x0, 0]*(1-xd) + lut[z0, y0, x1, 0]*xd
+            c01 = lut[z1, y0, x0, 0]*(1-xd) + lut[z1, y0, x1, 0]*xd
+            c10 = lut[z0, y1, x0, 0]*(1-xd) + lut[z0, y1, x1, 0]*xd
+            c11 = lut[z1, y1, x0, 0]*(1-xd) + lut[z1, y1, x1, 0]*xd
 
-        c0 = c00*(1-yd) + c10*yd
-        c1 = c01*(1-yd) + c11*yd
+            c0 = c00*(1-yd) + c10*yd
+            c1 = c01*(1-yd) + c11*yd
 
-        c_blue = c0*(1-zd) + c1*zd
+            c_blue = c0*(1-zd) + c1*zd
 
-        #  green
-        c00 = lut[z0, y0, x0, 1]*(1-xd) + lut[z0, y0, x1, 1]*xd
-        c01 = lut[z1, y0, x0, 1]*(1-xd) + lut[z1, y0, x1, 1]*xd
-        c10 = lut[z0, y1, x0, 1]*(1-xd) + lut[z0, y1, x1, 1]*xd
-        c11 = lut[z1, y1, x0, 1]*(1-xd) + lut[z1, y1, x1, 1]*xd
+            #  green
+            c00 = lut[z0, y0, x0, 1]*(1-xd) + lut[z0, y0, x1, 1]*xd
+            c01 = lut[z1, y0, x0, 1]*(1-xd) + lut[z1, y0, x1, 1]*xd
+            c10 = lut[z0, y1, x0, 1]*(1-xd) + lut[z0, y1, x1, 1]*xd
+            c11 = lut[z1, y1, x0, 1]*(1-xd) + lut[z1, y1, x1, 1]*xd
 
-        c0 = c00*(1-yd) + c10*yd
-        c1 = c01*(1-yd) + c11*yd
+            c0 = c00*(1-yd) + c10*yd
+            c1 = c01*(1-yd) + c11*yd
 
-        c_green = c0*(1-zd) + c1*zd
+            c_green = c0*(1-zd) + c1*zd
 
-        #  red
-        c00 = lut[z0, y0, x0, 2]*(1-xd) + lut[z0, y0, x1, 2]*xd
-        c01 = lut[z1, y0, x0, 2]*(1-xd) + lut[z1, y0, x1, 2]*xd
-        c10 = lut[z0, y1, x0, 2]*(1-xd) + lut[z0, y1, x1, 2]*xd
-        c11 = lut[z1, y1, x0, 2]*(1-xd) + lut[z1, y1, x1, 2]*xd
+            #  red
+            c00 = lut[z0, y0, x0, 2]*(1-xd) + lut[z0, y0, x1, 2]*xd
+            c01 = lut[z1, y0, x0, 2]*(1-xd) + lut[z1, y0, x1, 2]*xd
+            c10 = lut[z0, y1, x0, 2]*(1-xd) + lut[z0, y1, x1, 2]*xd
+            c11 = lut[z1, y1, x0, 2]*(1-xd) + lut[z1, y1, x1, 2]*xd
 
-        c0 = c00*(1-yd) + c10*yd
-        c1 = c01*(1-yd) + c11*yd
+            c0 = c00*(1-yd) + c10*yd
+            c1 = c01*(1-yd) + c11*yd
 
-        c_red = c0*(1-zd) + c1*zd
+            c_red = c0*(1-zd) + c1*zd
 
-        # set destination color
-        result_view[v,u,0] = c_blue
-        result_view[v,u,1] = c_green
-        result_view[v,u,2] = c_red
+            # set destination color
+            result_view[v,u,0] = c_blue
+            result_view[v,u,1] = c_green
+            result_view[v,u,2] = c_red
 
+    if flag[0]:
+        return # cancelled
     return dst
 
-    
\ No newline at end of file
+    
+
+@boundscheck(False)
+@wraparound(False)
+@nonecheck(False)
+@cdivision(True)
+def apply_baked_lut_cython(const unsigned char[:,:,::1] pixels, const unsigned char[:,:,:,::1] table, cancel=None, int num_threads=1):
+    """apply a table baked by bake_lut to 8 bit pixels.
+    A 256 point table is a single lookup per pixel. A coarser table has its
+    points evenly spaced over 0-255, and is interpolated between them
+    tetrahedrally, in integers.
+    cancel and num_threads like apply_lut_cython."""
+    cdef int height = pixels.shape[0]
+    cdef int width = pixels.shape[1]
+    cdef int size = table.shape[0]
+    cdef int u, v, c
+
+    if size < 2:
+        raise ValueError("not a baked table: {} points".format(size))
+    # the position of a value on the lattice is value*(size-1)/255,
+    # in fixed point with 255 units per cell
+    cdef int step = 255
+    cdef int last_cell = size-2
+
+    # cancellation flag
+    cdef const unsigned char[::1] flag = cancel if cancel is not None else np.zeros(1, dtype=np.uint8)
+
+    # interpolation definitions
+    cdef int r, g, b, x0, y0, z0, x1, y1, z1, xd, yd, zd
+    cdef int ax, ay, az, bx, by, bz, w0, w1, w2, w3
+
+    dst = np.empty( (height, width, 3), dtype=np.uint8 )
+    cdef unsigned char[:,:,::1] result_view = dst
+
+    if size == 256:
+        # gather
+        for v in prange(height, nogil=True, schedule='static', num_threads=max(num_threads, 1)):
+            if flag[0]:
+                continue
+            for u in range(width):
+                r = pixels[v,u,0]
+                g = pixels[v,u,1]
+                b = pixels[v,u,2]
+                result_view[v,u,0] = table[b, g, r, 0]
+                result_view[v,u,1] = table[b, g, r, 1]
+                result_view[v,u,2] = table[b, g, r, 2]
+    else:
+        for v in prange(height, nogil=True, schedule='static', num_threads=max(num_threads, 1)):
+            if flag[0]:
+                continue
+            for u in range(width):
+                r = pixels[v,u,0]
+                g = pixels[v,u,1]
+                b = pixels[v,u,2]
+
+                # the lattice cell, and the position in it in 1/step units.
+                # 255 is the far end of the last cell
+                r = r*(size-1)
+                g = g*(size-1)
+                b = b*(size-1)
+                x0 = min(r//step, last_cell)
+                y0 = min(g//step, last_cell)
+                z0 = min(b//step, last_cell)
+                x1 = x0+1
+                y1 = y0+1
+                z1 = z0+1
+                xd = r-x0*step
+                yd = g-y0*step
+                zd = b-z0*step
+
+                # Tetrahedral Interpolation, see apply_lut_cython
+                if xd > yd:
+                    if yd > zd:
+                        ax, ay, az, bx, by, bz = x1, y0, z0, x1, y1, z0
+                        w0, w1, w2, w3 = step-xd, xd-yd, yd-zd, zd
+                    elif xd > zd:
+                        ax, ay, az, bx, by, bz = x1, y0, z0, x1, y0, z1
+                        w0, w1, w2, w3 = step-xd, xd-zd, zd-yd, yd
+                    else:
+                        ax, ay, az, bx, by, bz = x0, y0, z1, x1, y0, z1
+                        w0, w1, w2, w3 = step-zd, zd-xd, xd-yd, yd
+                else:
+                    if zd > yd:
+                        ax, ay, az, bx, by, bz = x0, y0, z1, x0, y1, z1
+                        w0, w1, w2, w3 = step-zd, zd-yd, yd-xd, xd
+                    elif zd > xd:
+                        ax, ay, az, bx, by, bz = x0, y1, z0, x0, y1, z1
+                        w0, w1, w2, w3 = step-yd, yd-zd, zd-xd, xd
+                    else:
+                        ax, ay, az, bx, by, bz = x0, y1, z0, x1, y1, z0
+                        w0, w1, w2, w3 = step-yd, yd-xd, xd-zd, zd
+
+                # the weights sum to step, round and divide
+                for c in range(3):
+                    result_view[v,u,c] = (w0*table[z0, y0, x0, c] + w1*table[az, ay, ax, c] + 
+                        w2*table[bz, by, bx, c] + w3*table[z1, y1, x1, c] + (step >> 1)) // step
+
+    if flag[0]:
+        return # cancelled
+    return dst
@@ -0,0 +1,46 @@
+from typing import *
+import numpy as np
+
+from .apply_lut_cython import apply_lut_cython as apply_lut
+
+""" baked LUT
+8 bit pixels have 256 values per channel, so a LUT on 8 bit media can be
+evaluated once for each possible input, and applied as a direct lookup.
+A full table is 256^3 RGB bytes, 48MB. Under a smaller memory ceiling the
+table keeps 129, 65, ... points evenly spaced over 0-255, and is
+interpolated between them.
+"""
+
+FULL_TABLE_BYTES = 256**3*3
+
+def baked_size(max_bytes:int=FULL_TABLE_BYTES)->Optional[int]:
+	"""points per axis of the largest table within max_bytes:
+	256 for the full table, or 129, 65, 33, 17 points over 0-255.
+	None when not even 17 points fit."""
+	if FULL_TABLE_BYTES <= max_bytes:
+		return 256
+	for step in [2, 4, 8, 16]:
+		if (256//step+1)**3*3 <= max_bytes:
+			return 256//step+1
+	return None
+
+def bake_lut(lut:np.ndarray, max_bytes:int=FULL_TABLE_BYTES, interpolation:str="trilinear", num_threads:int=1)->Optional[np.ndarray]:
+	"""evaluate the float cube for 8 bit inputs, into a uint8 table indexed
+	[blue, green, red] like the cube. Apply it with apply_baked_lut.
+	Returns None when no table fits max_bytes."""
+	size = baked_size(max_bytes)
+	if size is None:
+		return None
+	# the input values of the points, the first is 0 and the last is 255
+	values = np.linspace(0, 1, size, dtype=np.float32)
+
+	table = np.empty((size, size, size, 3), dtype=np.uint8)
+	green, red = np.meshgrid(values, values, indexing="ij")
+	plane = np.empty((size, size, 3), dtype=np.float32)
+	plane[...,0] = red
+	plane[...,1] = green
+	for b in range(size): # a plane at a time, to keep the float temporaries small
+		plane[...,2] = values[b]
+		graded = apply_lut(plane, lut, None, num_threads, interpolation)
+		np.rint(np.clip(graded*255, 0, 255), out=table[b], casting='unsafe')
+	return table
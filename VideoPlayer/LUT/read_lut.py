@@ -1,27 +1,136 @@
+""" read .cube LUTs
+The header is parsed line by line, the table in a single np.loadtxt pass.
+1D LUTs, shaper + 3D LUTs and DOMAIN_MIN/MAX are folded into a single 3D
+cube over 0-1, the input of apply_lut. The folded cube can be cached in a
+folder, keyed by the hash of the file, and memory mapped on the next read.
+"""
+import os
+import io
+import hashlib
+import warnings
 from pathlib import Path
+from typing import *
 import numpy as np
 
-def read_lut(path):
+from .apply_lut_cython import apply_lut_cython as apply_lut
+
+MAX_FOLDED_SIZE = 65 # points per axis of a cube folded from a 1D LUT
+
+def parse_cube(text:str)->dict:
+	"""parse a .cube file into its header keywords and tables.
+	Returns a dict with the optional keys '1D' (size, 3) and '3D' (size, size, size, 3)
+	tables, indexed [blue, green, red] like the file, and their input ranges as
+	(min rgb, max rgb) in 'domain 1D' and 'domain 3D'."""
+	size_1d, size_3d = None, None
+	domain_min, domain_max = [0.0, 0.0, 0.0], [1.0, 1.0, 1.0]
+	range_1d, range_3d = None, None
+
+	# header, a line at a time up to the first line of the table
+	offset = 0
+	while offset < len(text):
+		end = text.find("\n", offset)
+		end = len(text) if end < 0 else end+1
+		words = text[offset:end].split()
+		if not words or words[0].startswith("#"):
+			offset = end
+			continue
+		keyword = words[0]
+		if keyword == "TITLE":
+			pass
+		elif keyword == "LUT_1D_SIZE":
+			size_1d = int(words[1])
+		elif keyword == "LUT_3D_SIZE":
+			size_3d = int(words[1])
+		elif keyword == "DOMAIN_MIN":
+			domain_min = [float(word) for word in words[1:4]]
+		elif keyword == "DOMAIN_MAX":
+			domain_max = [float(word) for word in words[1:4]]
+		elif keyword == "LUT_1D_INPUT_RANGE": # Resolve
+			range_1d = [float(words[1])]*3, [float(words[2])]*3
+		elif keyword == "LUT_3D_INPUT_RANGE": # Resolve
+			range_3d = [float(words[1])]*3, [float(words[2])]*3
+		elif keyword[0].isalpha():
+			pass # unknown keyword
+		else:
+			break # the table
+		offset = end
+
+	if size_1d is None and size_3d is None:
+		raise ValueError("not a .cube LUT, no LUT_1D_SIZE or LUT_3D_SIZE")
+
+	# table
+	with warnings.catch_warnings():
+		warnings.simplefilter("ignore") # an empty table is reported below
+		values = np.loadtxt(io.StringIO(text[offset:]), dtype=np.float32, comments="#", ndmin=2)
+	count = (size_1d or 0) + (size_3d or 0)**3
+	if values.shape != (count, 3):
+		raise ValueError("expected {} table entries, found {} values".format(count, values.size))
+
+	lut = dict()
+	if size_1d is not None:
+		lut['1D'] = values[:size_1d]
+		lut['domain 1D'] = range_1d or (domain_min, domain_max)
+	if size_3d is not None:
+		lut['3D'] = values[size_1d or 0:].reshape(size_3d, size_3d, size_3d, 3)
+		lut['domain 3D'] = range_3d or (domain_min, domain_max)
+	return lut
+
+
+def fold_cube(lut:dict)->np.ndarray:
+	"""a single 3D cube over 0-1 of the parsed LUT, see parse_cube"""
+	if '3D' in lut and '1D' not in lut and lut['domain 3D'] == ([0.0, 0.0, 0.0], [1.0, 1.0, 1.0]):
+		return np.ascontiguousarray(lut['3D']) # nothing to fold
+
+	# the lattice of the folded cube
+	size = lut['3D'].shape[0] if '3D' in lut else min(lut['1D'].shape[0], MAX_FOLDED_SIZE)
+	b, g, r = np.meshgrid(*[np.linspace(0, 1, size, dtype=np.float32)]*3, indexing="ij")
+	rgb = np.stack([r, g, b], axis=-1)
+
+	if '1D' in lut:
+		table = lut['1D']
+		low, high = np.array(lut['domain 1D'], dtype=np.float32)
+		for channel in range(3):
+			positions = np.linspace(low[channel], high[channel], table.shape[0], dtype=np.float32)
+			rgb[...,channel] = np.interp(rgb[...,channel], positions, table[:,channel])
+
+	if '3D' in lut:
+		low, high = np.array(lut['domain 3D'], dtype=np.float32)
+		rgb = (rgb-low)/(high-low) # apply_lut clamps to the domain
+		rgb = apply_lut(np.ascontiguousarray(rgb.reshape(size*size, size, 3), dtype=np.float32), np.ascontiguousarray(lut['3D']))
+		rgb = rgb.reshape(size, size, size, 3)
+
+	return np.ascontiguousarray(rgb, dtype=np.float32)
+
+
+def read_lut(path, cache_dir:Optional[str]=None)->np.ndarray:
+	"""read a .cube file as a 3D cube over 0-1 of shape (size, size, size, 3).
+	cache_dir: read and write the folded cube there, eg. the luts folder of
+	read.user_cache.user_cache_dir(). Not cached when None."""
 	assert Path(path).exists()
+	data = Path(path).read_bytes()
+
+	cache_path = None
+	if cache_dir:
+		name = hashlib.sha1(data).hexdigest()
+		cache_path = Path(cache_dir)/(name+".npy")
+		try:
+			return np.load(cache_path, mmap_mode='r')
+		except (OSError, ValueError):
+			pass
+
+	cube = fold_cube(parse_cube(data.decode("utf-8-sig", errors="replace"))) # without a byte order mark
 
-	data = []
-	size = -1
-	for line in Path(path).read_text().split("\n"):
-	    if line.strip() == "":
-	        continue
-	    elif line[0] == "#":
-	        continue
-	    elif line.split()[0] == "LUT_1D_SIZE":
-	        size = int( line.split()[1] )
-	        kind = "1D"
-	    elif line.split()[0] == "LUT_3D_SIZE":
-	        size = int( line.split()[1] )
-	        kind = "3D"
-	    else:
-	        data.append( [float(part) for part in line.split()] )
-
-	return np.array(data).reshape(size, size, size, 3).astype(np.float32)
+	if cache_path:
+		try:
+			cache_path.parent.mkdir(parents=True, exist_ok=True)
+			temp_path = cache_path.with_suffix(".{}.tmp".format(os.getpid()))
+			with open(temp_path, "wb") as f:
+				np.save(f, cube, allow_pickle=False)
+			os.replace(temp_path, cache_path) # readers never see a partial file
+		except OSError as err:
+			print("cant cache lut", err)
+	return cube
 
 if __name__ == "__main__":
 	lut = read_lut("../../tests/resources/AlexaV3_K1S1_LogC2Video_Rec709_EE_aftereffects3d.cube")
-	print(lut.shape)
\ No newline at end of file
+	print(lut.shape)
@@ -0,0 +1,127 @@
+""" headless batch render and transcode, without Qt
+run from the VideoPlayer folder:
+> python batch.py jobs.json [--workers 8] [--summary summary.json]
+
+jobs.json is a list of jobs:
+[
+    {
+        "source": "clip.mp4",         # a movie, or a frame of an image sequence
+        "output": "renders/clip.mov", # the extension picks the format, see export.py
+        "range": [0, 99],             # first and last frame, default the whole source
+        "lut": "grade.cube",
+        "interpolation": "tetrahedral",
+        "corners": [[0, 0], [1920, 0], [1920, 1080], [0, 1080]],
+        "downsample": "full",         # full | half | quarter
+        "fps": 25,                    # default the fps of the source, or 24
+        "codec": "prores", "preset": "hq", "pix_fmt": "yuv422p10le",
+        "dtype": "uint16",            # uint8 | uint16 | half | float, default by format
+        "bits": 10                    # bits per sample of image files, eg. .dpx
+    }
+]
+source and output are required. The jobs run concurrently, their frames are
+evaluated by one pool of workers. Prints a JSON summary of the jobs to stdout,
+the log goes to stderr. Exits with 1 when a job failed.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import contextlib
+from pathlib import Path
+from typing import *
+
+from frame_server_core import FrameServerCore, ProcessDesc, DTYPES, create_reader_cached
+from export import run, default_dtype
+
+JOB_FIELDS = {'source', 'output', 'range', 'lut', 'interpolation', 'corners', 'downsample', 'fps',
+    'codec', 'preset', 'pix_fmt', 'dtype', 'bits'}
+
+
+def job_keys(job:dict)->List[ProcessDesc]:
+    """the frames of the job"""
+    unknown = set(job)-JOB_FIELDS
+    if unknown:
+        raise ValueError("unknown job fields: {}".format(", ".join(sorted(unknown))))
+    if not Path(job['source']).exists():
+        raise FileNotFoundError(job['source'])
+
+    reader = create_reader_cached(job['source'])
+    first_frame, last_frame = job.get('range') or (reader.first_frame, reader.last_frame)
+    lut = job.get('lut')
+    corners = tuple(tuple(corner) for corner in job['corners']) if job.get('corners') else None
+    dtype = job.get('dtype') or default_dtype(job['output'], job.get('codec'), job.get('pix_fmt'))
+    if dtype not in DTYPES:
+        raise ValueError("unknown dtype {}, one of {}".format(dtype, list(DTYPES)))
+    return [ProcessDesc(frame=frame, path=job['source'], downsample=job.get('downsample', "full"),
+        lut=lut, corners=corners, interpolation=job.get('interpolation', "trilinear") if lut else "trilinear", dtype=dtype)
+        for frame in range(first_frame, last_frame+1)]
+
+
+def run_job(frame_server:FrameServerCore, job:dict)->dict:
+    """export a job with the workers of frame_server, and summarize it"""
+    summary = {'source': job.get('source'), 'output': job.get('output'), 'status': "done"}
+    begin = time.perf_counter()
+    try:
+        keys = job_keys(job)
+        fps = job.get('fps') or create_reader_cached(job['source']).fps or 24
+        stats = run(None, keys, job['output'], fps=fps, submit=frame_server.submit, workers=frame_server.workers,
+            codec=job.get('codec'), preset=job.get('preset'), pix_fmt=job.get('pix_fmt'), bits=job.get('bits'))
+        summary.update(frames=stats['frames'], fps=round(stats['fps'], 2), **{'MB/s': round(stats['MB/s'], 2)})
+    except Exception as err:
+        summary.update(status="failed", error="{}: {}".format(type(err).__name__, err))
+    summary['seconds'] = round(time.perf_counter()-begin, 3)
+    return summary
+
+
+def run_jobs(jobs:List[dict], workers:Optional[int]=None, threads:Optional[int]=None, memory_limit:float=1000)->dict:
+    """run the jobs concurrently on one FrameServerCore.
+    Returns the summary: the jobs, and the frames and fps of all of them."""
+    workers = workers or os.cpu_count() or 1
+    frame_server = FrameServerCore(workers=workers, threads=threads)
+    frame_server.memory_limit = memory_limit
+    begin = time.perf_counter()
+
+    summaries = [None]*len(jobs)
+    def run_at(index):
+        summaries[index] = run_job(frame_server, jobs[index])
+    job_threads = [threading.Thread(target=run_at, args=(index,)) for index in range(len(jobs))]
+    for thread in job_threads:
+        thread.start()
+    for thread in job_threads:
+        thread.join()
+    frame_server.stop()
+
+    seconds = time.perf_counter()-begin
+    frames = sum(summary.get('frames', 0) for summary in summaries)
+    return {
+        'jobs': summaries,
+        'frames': frames,
+        'seconds': round(seconds, 3),
+        'fps': round(frames/seconds, 2) if seconds else 0.0,
+        'failed': sum(summary['status'] != "done" for summary in summaries)
+    }
+
+
+def main(argv:Optional[List[str]]=None)->int:
+    parser = argparse.ArgumentParser(description="render and transcode jobs without a display")
+    parser.add_argument("jobs", help="json file with a list of jobs")
+    parser.add_argument("--workers", type=int, default=None, help="evaluation threads shared by the jobs, default one per core")
+    parser.add_argument("--threads", type=int, default=None, help="threads of the lut kernel, default one per core")
+    parser.add_argument("--memory", type=float, default=1000, help="frame cache limit in MB")
+    parser.add_argument("--summary", default=None, help="also write the summary to this file")
+    args = parser.parse_args(argv)
+
+    jobs = json.loads(Path(args.jobs).read_text())
+    with contextlib.redirect_stdout(sys.stderr): # keep stdout for the summary
+        summary = run_jobs(jobs, workers=args.workers, threads=args.threads, memory_limit=args.memory)
+
+    text = json.dumps(summary, indent=2)
+    print(text)
+    if args.summary:
+        Path(args.summary).write_text(text)
+    return 1 if summary['failed'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
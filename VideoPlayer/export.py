@@ -0,0 +1,528 @@
+""" export processed frames to an image sequence or a movie
+A streaming pipeline: a pool of workers evaluates the frames, or the workers
+of the FrameServer do, and a writer thread writes them in frame order. The
+futures are handed to the writer in frame order. Each frame holds one of
+`buffer` slots from its submit until it is written, so the workers run at
+most `buffer` frames ahead of the last frame written, and memory stays flat
+however long the range is. Image sequences are written by a pool of writer
+threads, a file per frame, and the frames being written hold their slots too.
+Frames are written in their own sample type: 16 bit TIFF and PNG, half EXR,
+10 bit DPX, and 8 or 16 bit frames piped to ffmpeg. default_dtype picks it
+by format.
+Movies are encoded by ffmpeg, when it is installed, with cv2.VideoWriter otherwise.
+run_segments splits the range into segments, exported in worker processes,
+and joins the movie segments with the ffmpeg concat demuxer.
+"""
+import os
+import time
+import shutil
+import tempfile
+import subprocess
+import queue
+import collections
+import threading
+import multiprocessing
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import *
+
+import numpy as np
+import cv2
+import OpenImageIO as oiio
+
+MOVIE_EXTENSIONS = {'.mp4': "h264", '.mov': "prores", '.mkv': "h265", '.mxf': "dnxhr"} # -> default codec
+# image formats -> default sample type of the frames, see default_dtype
+SEQUENCE_EXTENSIONS = {'.jpg': "uint8", '.png': "uint8", '.tif': "uint8", '.exr': "half", '.dpx': "uint16"}
+DPX_BITS = 10 # bits per sample of 16 bit frames written to .dpx, unless given
+
+# numpy dtype of the frames -> OpenImageIO type of the files
+OIIO_TYPES = {
+    np.dtype(np.uint8): oiio.TypeUInt8,
+    np.dtype(np.uint16): oiio.TypeUInt16,
+    np.dtype(np.float16): oiio.TypeHalf,
+    np.dtype(np.float32): oiio.TypeFloat
+}
+
+# numpy dtype of the frames -> raw pixel format piped to ffmpeg
+RAW_PIX_FMTS = {
+    np.dtype(np.uint8): "rgb24",
+    np.dtype('<u2'): "rgb48le"
+}
+PROGRESS_INTERVAL = 0.1 # seconds between progress calls
+
+# the ffmpeg encoders. The preset is passed as `preset_option`, the first
+# preset and pixel format are the defaults. `quicktime_args` are added for
+# .mp4 and .mov outputs only.
+CODECS = {
+    "h264": {
+        'encoder': "libx264",
+        'preset_option': "-preset",
+        'presets': ["medium", "ultrafast", "superfast", "veryfast", "faster", "fast", "slow", "slower", "veryslow"],
+        'pix_fmts': ["yuv420p", "yuv422p", "yuv444p"],
+        'args': ["-crf", "18"]
+    },
+    "h265": {
+        'encoder': "libx265",
+        'preset_option': "-preset",
+        'presets': ["medium", "ultrafast", "superfast", "veryfast", "faster", "fast", "slow", "slower", "veryslow"],
+        'pix_fmts': ["yuv420p", "yuv420p10le", "yuv422p10le"],
+        'args': ["-crf", "20"],
+        'quicktime_args': ["-tag:v", "hvc1"] # the sample entry of .mp4 and .mov, QuickTime plays hvc1 only
+    },
+    "prores": {
+        'encoder': "prores_ks",
+        'preset_option': "-profile:v",
+        'presets': ["hq", "proxy", "lt", "standard", "4444", "4444xq"],
+        'pix_fmts': ["yuv422p10le", "yuv444p10le"],
+        'args': ["-vendor", "apl0"],
+        'intra': True # every frame is a keyframe
+    },
+    "dnxhr": {
+        'encoder': "dnxhd",
+        'preset_option': "-profile:v",
+        'presets': ["dnxhr_hq", "dnxhr_lb", "dnxhr_sq", "dnxhr_hqx", "dnxhr_444"],
+        'pix_fmts': ["yuv422p", "yuv422p10le", "yuv444p10le"],
+        'args': [],
+        'intra': True
+    }
+}
+
+def find_ffmpeg()->Optional[str]:
+    """the ffmpeg executable, FFMPEG_BINARY or ffmpeg on the PATH"""
+    return shutil.which(os.environ.get("FFMPEG_BINARY", "ffmpeg"))
+
+
+def default_dtype(filename:str, codec:Optional[str]=None, pix_fmt:Optional[str]=None)->str:
+    """the sample type to evaluate the frames in for filename, see frame_server_core.DTYPES.
+    Movies encoded to more than 8 bits get 16 bit frames, when ffmpeg is installed."""
+    ext = Path(filename).suffix
+    if ext in SEQUENCE_EXTENSIONS:
+        return SEQUENCE_EXTENSIONS[ext]
+    if ext in MOVIE_EXTENSIONS:
+        if not find_ffmpeg():
+            return "uint8" # cv2.VideoWriter writes 8 bit
+        options = CODECS.get(codec or MOVIE_EXTENSIONS[ext], CODECS[MOVIE_EXTENSIONS[ext]])
+        pix_fmt = pix_fmt or options['pix_fmts'][0]
+        return "uint16" if pix_fmt.endswith(("10le", "12le", "16le")) else "uint8"
+    raise ValueError("cant export to {}".format(ext))
+
+
+class SequenceWriter:
+    """one image per frame, named <stem><frame 00000><ext> next to filename.
+    The files get the sample type of the frames, formats that cant store it
+    are converted by OpenImageIO, eg. 16 bit frames to .jpg.
+    bits: bits per sample of integer files, eg. 10 or 12 for .dpx"""
+    parallel = True # a file per frame, the frames can be written concurrently
+
+    def __init__(self, filename:str, bits:Optional[int]=None):
+        self._stem = str(Path(Path(filename).parent, Path(filename).stem))
+        self._ext = Path(filename).suffix
+        self._bits = bits
+
+    def write(self, frame:int, rgb:np.ndarray)->None:
+        height, width, channels = rgb.shape
+        frame_filename = self._stem+("%05d" % frame)+self._ext
+        out = oiio.ImageOutput.create(frame_filename)
+        if not out:
+            raise ValueError("{} format is not supported".format(self._ext))
+        if rgb.dtype not in OIIO_TYPES:
+            raise ValueError("cant write {} frames".format(rgb.dtype))
+        spec = oiio.ImageSpec(width, height, channels, OIIO_TYPES[rgb.dtype])
+        bits = self._bits or (DPX_BITS if self._ext == ".dpx" and rgb.dtype == np.uint16 else None)
+        if bits:
+            spec.attribute("oiio:BitsPerSample", bits)
+        if not out.open(frame_filename, spec) or not out.write_image(rgb):
+            raise RuntimeError("cant write {}: {}".format(frame_filename, out.geterror()))
+        out.close()
+
+    def close(self)->None:
+        pass
+
+
+class MovieWriter:
+    """a cv2.VideoWriter, fed from a reused BGR buffer. 16 bit frames are written as 8 bit."""
+    parallel = False
+
+    def __init__(self, filename:str, fps:float, width:int, height:int):
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        self._writer = cv2.VideoWriter(filename, fourcc, fps or 24, (width, height))
+        if not self._writer.isOpened():
+            raise ValueError("cv2.VideoWriter cant write {}".format(filename))
+        self._bgr = np.empty((height, width, 3), dtype=np.uint8)
+
+    def write(self, frame:int, rgb:np.ndarray)->None:
+        if rgb.dtype == np.uint16:
+            rgb = cv2.convertScaleAbs(rgb, alpha=255/65535) # rounds and clips
+        elif rgb.dtype != np.uint8:
+            raise ValueError("cant write {} frames to a movie".format(rgb.dtype))
+        cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR, dst=self._bgr)
+        self._writer.write(self._bgr)
+
+    def close(self)->None:
+        self._writer.release()
+
+
+def ffmpeg_command(ffmpeg:str, filename:str, fps:float, width:int, height:int,
+        codec:str="h264", preset:Optional[str]=None, pix_fmt:Optional[str]=None, gop:Optional[int]=None,
+        input_pix_fmt:str="rgb24")->List[str]:
+    """ffmpeg arguments to encode raw frames from stdin to filename.
+    gop: frames between keyframes, the encoder default when None
+    input_pix_fmt: of the raw frames, rgb24 or rgb48le, see RAW_PIX_FMTS"""
+    if codec not in CODECS:
+        raise ValueError("unknown codec {}, one of {}".format(codec, list(CODECS)))
+    options = CODECS[codec]
+    return [ffmpeg, "-y", "-loglevel", "error",
+        "-f", "rawvideo", "-pix_fmt", input_pix_fmt, "-s", "{}x{}".format(width, height), "-r", str(fps or 24),
+        "-i", "-", "-an",
+        "-c:v", options['encoder'], options['preset_option'], preset or options['presets'][0],
+        "-pix_fmt", pix_fmt or options['pix_fmts'][0], *options['args'],
+        *(options.get('quicktime_args', []) if Path(filename).suffix.lower() in {'.mp4', '.mov'} else []),
+        *(["-g", str(gop)] if gop and not options.get('intra') else []),
+        filename]
+
+
+class FFmpegWriter:
+    """raw frames piped to an ffmpeg process. Contiguous frames are written as
+    they are, others are gathered into a preallocated buffer first. ffmpeg
+    encodes on its own threads.
+    dtype: of the frames, uint8 or uint16. 16 bit frames keep their precision
+    for 10 bit pixel formats."""
+    parallel = False
+
+    def __init__(self, filename:str, fps:float, width:int, height:int, ffmpeg:str,
+            codec:str="h264", preset:Optional[str]=None, pix_fmt:Optional[str]=None, gop:Optional[int]=None,
+            dtype=np.uint8):
+        dtype = np.dtype('<u2') if np.dtype(dtype) == np.uint16 else np.dtype(dtype)
+        if dtype not in RAW_PIX_FMTS:
+            raise ValueError("cant pipe {} frames to ffmpeg, export uint8 or uint16".format(dtype))
+        command = ffmpeg_command(ffmpeg, filename, fps, width, height, codec, preset, pix_fmt, gop, RAW_PIX_FMTS[dtype])
+        self._log = tempfile.TemporaryFile() # a pipe could fill up and block ffmpeg
+        try:
+            self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self._log)
+        except OSError:
+            self._log.close()
+            raise
+        self._buffer = np.empty((height, width, 3), dtype=dtype)
+
+    def _error(self)->RuntimeError:
+        self._process.wait()
+        self._log.seek(0)
+        return RuntimeError("ffmpeg failed: {}".format(self._log.read().decode(errors="replace").strip()))
+
+    def write(self, frame:int, rgb:np.ndarray)->None:
+        if not rgb.flags.c_contiguous or rgb.dtype != self._buffer.dtype:
+            np.copyto(self._buffer, rgb, casting="unsafe")
+            rgb = self._buffer
+        try:
+            self._process.stdin.write(memoryview(rgb).cast("B"))
+        except BrokenPipeError:
+            raise self._error() from None
+
+    def close(self)->None:
+        try:
+            try:
+                self._process.stdin.close()
+            except BrokenPipeError:
+                pass
+            if self._process.wait() != 0:
+                raise self._error()
+        finally:
+            self._log.close()
+
+
+def open_writer(filename:str, fps:float, width:int, height:int,
+        codec:Optional[str]=None, preset:Optional[str]=None, pix_fmt:Optional[str]=None, gop:Optional[int]=None,
+        bits:Optional[int]=None, dtype=np.uint8):
+    """a writer for the extension of filename, of dtype frames.
+    codec, preset, pix_fmt and gop of movies, see CODECS. The codec defaults by extension.
+    bits: bits per sample of image files, see SequenceWriter"""
+    ext = Path(filename).suffix
+    if ext in MOVIE_EXTENSIONS:
+        ffmpeg = find_ffmpeg()
+        if ffmpeg:
+            return FFmpegWriter(filename, fps, width, height, ffmpeg, codec or MOVIE_EXTENSIONS[ext], preset, pix_fmt, gop, dtype)
+        print("ffmpeg not found, export with cv2.VideoWriter")
+        return MovieWriter(filename, fps, width, height)
+    if ext in SEQUENCE_EXTENSIONS:
+        return SequenceWriter(filename, bits)
+    raise ValueError("cant export to {}".format(ext))
+
+
+def run(evaluate:Optional[Callable], keys:List, filename:str, fps:float=24,
+        workers:Optional[int]=None, buffer:Optional[int]=None,
+        progress:Optional[Callable]=None, cancel:Optional[threading.Event]=None,
+        submit:Optional[Callable]=None, writer_threads:Optional[int]=None, **writer_options)->dict:
+    """evaluate the keys with evaluate(key)->rgb on `workers` threads,
+    and write the results in order to filename, in the dtype of the rgb.
+    submit: submit(key)->Future of the rgb, to evaluate the keys elsewhere
+        instead, eg. FrameServer.submit. evaluate is not used then.
+    buffer: frames submitted and not yet written, default two per worker and
+        per writer thread
+    writer_threads: write image sequences on this many threads, default the workers.
+        Movies are written by the writer thread.
+    writer_options: codec, preset, pix_fmt and gop of movies, bits of images, see open_writer
+    progress: called from the writer thread with the stats, every PROGRESS_INTERVAL and after the last frame
+    cancel: stops the export when set, the frames written so far are kept
+    Returns the stats: frames written, seconds, fps and MB/s of pixels written."""
+    workers = workers or os.cpu_count() or 1
+    writer_threads = writer_threads or workers
+    buffer = buffer or 2*(workers+writer_threads)
+    cancel = cancel or threading.Event()
+
+    pending = queue.Queue() # (key, future) in frame order, None at the end
+    slots = threading.Semaphore(buffer) # released as the frames are written
+    stats = {'frame': None, 'frames': 0, 'total': len(keys), 'seconds': 0.0, 'fps': 0.0, 'MB/s': 0.0, 'cancelled': False}
+    errors = []
+    begin = time.perf_counter()
+
+    def write():
+        writer = None
+        write_pool = None
+        writes = collections.deque() # (key, bytes, Future) of the frames being written, in frame order
+        written_bytes = 0
+        reported = 0.0
+
+        def written(key, nbytes):
+            nonlocal written_bytes, reported
+            written_bytes+=nbytes
+            now = time.perf_counter()
+            stats['frame'] = key.frame
+            stats['frames']+=1
+            stats['seconds'] = now-begin
+            stats['fps'] = stats['frames']/stats['seconds']
+            stats['MB/s'] = written_bytes/1024/1024/stats['seconds']
+            if progress and (now-reported >= PROGRESS_INTERVAL or stats['frames'] == stats['total']):
+                reported = now
+                progress(dict(stats))
+
+        def finish(limit):
+            # wait for the oldest writes, until at most limit are in flight.
+            # The frames count as written in order.
+            while len(writes) > limit:
+                key, nbytes, write_future = writes.popleft()
+                try:
+                    write_future.result()
+                    written(key, nbytes)
+                finally:
+                    slots.release()
+
+        while True:
+            item = pending.get()
+            if item is None:
+                break
+            key, future = item
+            if cancel.is_set():
+                future.cancel() # keep draining, so the producer never blocks
+                slots.release()
+                continue
+            IsWriting = False # in writes, finish releases its slot
+            try:
+                rgb = future.result()
+                if rgb is None:
+                    raise ValueError("cant evaluate {}".format(key))
+                if writer is None:
+                    height, width, channels = rgb.shape
+                    writer = open_writer(filename, fps, width, height, dtype=rgb.dtype, **writer_options)
+                    if writer.parallel and writer_threads > 1:
+                        write_pool = ThreadPoolExecutor(max_workers=writer_threads)
+                if write_pool:
+                    writes.append((key, rgb.nbytes, write_pool.submit(writer.write, key.frame, rgb)))
+                    IsWriting = True
+                    # a write queued behind each running one, and a slot left to evaluate the next frame
+                    finish(min(2*writer_threads, buffer-1))
+                else:
+                    writer.write(key.frame, rgb)
+                    written(key, rgb.nbytes)
+            except Exception as err:
+                errors.append(err)
+                cancel.set()
+            finally:
+                if not IsWriting:
+                    slots.release()
+
+        try:
+            finish(0)
+        except Exception as err:
+            errors.append(err)
+        if write_pool:
+            write_pool.shutdown()
+        if writer is not None:
+            try:
+                writer.close()
+            except Exception as err:
+                errors.append(err)
+
+    writer_thread = threading.Thread(target=write, daemon=True)
+    writer_thread.start()
+    pool = None
+    if submit is None:
+        pool = ThreadPoolExecutor(max_workers=workers)
+        submit = lambda key: pool.submit(evaluate, key)
+    try:
+        for key in keys:
+            if cancel.is_set():
+                break
+            slots.acquire() # blocks while the buffer is full
+            pending.put((key, submit(key)))
+    finally:
+        pending.put(None)
+        writer_thread.join()
+        if pool:
+            pool.shutdown()
+
+    if errors:
+        raise errors[0]
+    stats['cancelled'] = stats['frames'] < stats['total']
+    return stats
+
+
+def split_segments(count:int, segments:int, gop:int=1)->List[Tuple[int, int]]:
+    """split range(count) into at most `segments` (start, stop) ranges of about
+    the same length. Every range starts on a multiple of gop."""
+    gops = -(-count//gop)
+    segments = max(1, min(segments, gops))
+    bounds = [min(gops*i//segments*gop, count) for i in range(segments)]+[count]
+    return [(bounds[i], bounds[i+1]) for i in range(segments)]
+
+
+def concat_movies(ffmpeg:str, paths:List[str], filename:str)->None:
+    """join movies of the same encoding with the concat demuxer, without re-encoding"""
+    list_path = Path(paths[0]).with_name("concat.txt")
+    list_path.write_text("".join("file '{}'\n".format(Path(path).resolve().as_posix().replace("'", "'\\''")) for path in paths))
+    result = subprocess.run([ffmpeg, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0",
+        "-i", str(list_path), "-c", "copy", filename], capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError("ffmpeg concat failed: {}".format(result.stderr.decode(errors="replace").strip()))
+
+
+def export_segment(evaluate:Callable, keys:List, filename:str, fps:float, workers:int,
+        segment:tuple, progress_queue, cancel, writer_options:dict)->dict:
+    """runs in a worker process of run_segments: export keys with run, and
+    report (segment, frames, MB) written to progress_queue.
+    segment: (index, attempt)"""
+    segment_cancel = threading.Event() # an error cancels this segment only
+    def progress(stats):
+        progress_queue.put((segment, stats['frames'], stats['MB/s']*stats['seconds']))
+        if cancel.is_set():
+            segment_cancel.set()
+    return run(evaluate, keys, filename, fps, workers=workers, progress=progress, cancel=segment_cancel, **writer_options)
+
+
+def run_segments(evaluate:Callable, keys:List, filename:str, fps:float=24,
+        segments:Optional[int]=None, workers:int=1, retries:int=2, gop:Optional[int]=None,
+        progress:Optional[Callable]=None, cancel:Optional[threading.Event]=None, **writer_options)->dict:
+    """export the keys in `segments` worker processes, default one per core.
+    evaluate: evaluate(key)->rgb, picklable, it runs in the worker processes
+    workers: evaluation threads per process
+    retries: times a failed segment is exported again
+    gop: frames between keyframes of movies, default two seconds. The segments
+        start on multiples of it, the joined movie keeps a regular keyframe cadence.
+    progress, cancel and writer_options like run. A cancelled movie export leaves no file.
+    Movie segments are joined with ffmpeg, without it the movie is exported as one segment."""
+    segments = segments or os.cpu_count() or 1
+    cancel = cancel or threading.Event()
+    ext = Path(filename).suffix
+    IsMovie = ext in MOVIE_EXTENSIONS
+    ffmpeg = find_ffmpeg()
+    if IsMovie and not ffmpeg:
+        print("ffmpeg not found, export as a single segment")
+        segments = 1
+    if IsMovie:
+        codec = writer_options.get('codec') or MOVIE_EXTENSIONS[ext]
+        gop = gop or (1 if CODECS[codec].get('intra') else max(1, round((fps or 24)*2)))
+        writer_options = {**writer_options, 'gop': gop}
+
+    ranges = split_segments(len(keys), segments, gop or 1)
+    if IsMovie and len(ranges) > 1:
+        folder = Path(filename).with_name(Path(filename).stem+".segments")
+        folder.mkdir(exist_ok=True)
+        paths = [str(Path(folder, "{:04d}{}".format(index, ext))) for index in range(len(ranges))]
+    else:
+        folder = None
+        paths = [filename]*len(ranges) # one movie, or image files per frame
+
+    stats = {'frame': None, 'frames': 0, 'total': len(keys), 'seconds': 0.0, 'fps': 0.0, 'MB/s': 0.0, 'cancelled': False}
+    begin = time.perf_counter()
+    frames = [0]*len(ranges) # written per segment
+    megabytes = [0.0]*len(ranges) # written per segment
+    attempts = [0]*len(ranges)
+    context = multiprocessing.get_context("spawn") # dont fork the threads of the parent
+    with context.Manager() as manager:
+        progress_queue = manager.Queue()
+        shared_cancel = manager.Event()
+        pool = ProcessPoolExecutor(max_workers=len(ranges), mp_context=context)
+        futures = dict() # Future -> segment index
+
+        def submit(index):
+            nonlocal pool
+            attempts[index]+=1
+            frames[index], megabytes[index] = 0, 0.0
+            start, stop = ranges[index]
+            arguments = (export_segment, evaluate, keys[start:stop], paths[index], fps, workers,
+                (index, attempts[index]), progress_queue, shared_cancel, writer_options)
+            try:
+                future = pool.submit(*arguments)
+            except BrokenProcessPool: # a worker process died, start a new pool
+                pool.shutdown(wait=False)
+                pool = ProcessPoolExecutor(max_workers=len(ranges), mp_context=context)
+                future = pool.submit(*arguments)
+            futures[future] = index
+
+        try:
+            for index in range(len(ranges)):
+                submit(index)
+            reported = 0.0
+            while futures:
+                finished, _ = concurrent.futures.wait(futures, timeout=PROGRESS_INTERVAL,
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                if cancel.is_set():
+                    shared_cancel.set()
+                running = set(futures.values())
+                while True:
+                    try:
+                        (index, attempt), count, written = progress_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if index in running and attempt == attempts[index]: # not of a failed attempt
+                        frames[index], megabytes[index] = count, written
+                for future in finished:
+                    index = futures.pop(future)
+                    try:
+                        segment_stats = future.result()
+                    except Exception as err:
+                        print("segment", index, "failed:", err)
+                        if attempts[index] > retries or cancel.is_set():
+                            raise
+                        submit(index)
+                        continue
+                    frames[index] = segment_stats['frames']
+                    megabytes[index] = segment_stats['MB/s']*segment_stats['seconds']
+                    stats['cancelled'] = stats['cancelled'] or segment_stats['cancelled']
+
+                now = time.perf_counter()
+                stats['frames'] = sum(frames)
+                stats['frame'] = keys[min(stats['frames'], len(keys))-1].frame if stats['frames'] else None
+                stats['seconds'] = now-begin
+                stats['fps'] = stats['frames']/stats['seconds']
+                stats['MB/s'] = sum(megabytes)/stats['seconds']
+                if progress and stats['frames'] and (now-reported >= PROGRESS_INTERVAL or not futures):
+                    reported = now
+                    progress(dict(stats))
+        except BaseException:
+            shared_cancel.set() # the running segments stop at their next frame
+            pool.shutdown(wait=True, cancel_futures=True)
+            if folder is not None:
+                shutil.rmtree(folder, ignore_errors=True)
+            raise
+        pool.shutdown(wait=True)
+
+    stats['cancelled'] = stats['cancelled'] or cancel.is_set()
+    if folder is not None:
+        try:
+            if not stats['cancelled']:
+                concat_movies(ffmpeg, paths, filename)
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+    return stats
@@ -0,0 +1,110 @@
+import threading
+from collections import OrderedDict
+from typing import *
+
+import numpy as np
+
+
+def group_by_source(key)->tuple:
+    return (key.path, key.downsample, key.lut)
+
+
+class FrameCache:
+    """LRU cache of frames keyed by ProcessDesc, with a running byte total.
+    Insert, touch and evict are O(1). Cached frame numbers are indexed by
+    (path, downsample, lut), to query them without iterating every key.
+    Thread safe."""
+    def __init__(self, group:Callable=group_by_source):
+        self._items:OrderedDict = OrderedDict() # key -> pixels, least recently used first
+        self._group = group
+        self._frames:Dict[tuple, Dict[int, int]] = dict() # group -> {frame: count of keys}
+        self.nbytes = 0
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None)->Optional[np.ndarray]:
+        """return the frame, and mark it as the most recently used"""
+        with self._lock:
+            try:
+                self._items.move_to_end(key)
+            except KeyError:
+                return default
+            return self._items[key]
+
+    def peek(self, key, default=None)->Optional[np.ndarray]:
+        """return the frame, without changing its eviction order"""
+        with self._lock:
+            return self._items.get(key, default)
+
+    def __getitem__(self, key)->np.ndarray:
+        pixels = self.get(key)
+        if pixels is None:
+            raise KeyError(key)
+        return pixels
+
+    def __setitem__(self, key, pixels:np.ndarray)->None:
+        self.put(key, pixels)
+
+    def __contains__(self, key)->bool:
+        return key in self._items
+
+    def __len__(self)->int:
+        return len(self._items)
+
+    def __iter__(self)->Iterator:
+        with self._lock:
+            keys = list(self._items)
+        return iter(keys)
+
+    def put(self, key, pixels:np.ndarray)->None:
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+            self._items[key] = pixels
+            self.nbytes+=pixels.nbytes
+            frames = self._frames.setdefault(self._group(key), dict())
+            frames[key.frame] = frames.get(key.frame, 0)+1
+
+    def _remove(self, key)->np.ndarray:
+        pixels = self._items.pop(key)
+        self.nbytes-=pixels.nbytes
+        group = self._group(key)
+        frames = self._frames[group]
+        frames[key.frame]-=1
+        if frames[key.frame] == 0:
+            del frames[key.frame]
+            if not frames:
+                del self._frames[group]
+        return pixels
+
+    def pop(self, key, default=None)->Optional[np.ndarray]:
+        with self._lock:
+            if key not in self._items:
+                return default
+            return self._remove(key)
+
+    def pop_oldest(self)->Tuple[Any, np.ndarray]:
+        """remove and return the least recently used (key, pixels)"""
+        with self._lock:
+            key = next(iter(self._items))
+            return key, self._remove(key)
+
+    def evict(self, max_bytes:int, max_frames:Optional[int]=None)->List:
+        """remove the least recently used frames until the cache fits max_bytes,
+        and max_frames when given. Return the evicted keys."""
+        evicted = []
+        with self._lock:
+            while self._items and (self.nbytes > max_bytes or (max_frames is not None and len(self._items) > max_frames)):
+                key, pixels = self.pop_oldest()
+                evicted.append(key)
+        return evicted
+
+    def frames(self, *group)->List[int]:
+        """the cached frame numbers of a group, eg. (path, downsample, lut), in order"""
+        with self._lock:
+            return sorted(self._frames.get(group, ()))
+
+    def clear(self)->None:
+        with self._lock:
+            self._items.clear()
+            self._frames.clear()
+            self.nbytes = 0
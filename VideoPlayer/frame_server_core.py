@@ -0,0 +1,723 @@
+""" the frame server, without Qt
+Evaluates ProcessDesc keys on a pool of worker threads, caches the processed
+frames and prefetches around the playhead. frame_server.FrameServer adapts it
+to Qt signals, batch.py runs it headless.
+"""
+from dataclasses import dataclass, replace
+from functools import cache
+import numpy as np
+import os
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import Future, InvalidStateError
+from read import Reader
+from read.reader import convert_pixels, shrink
+from read.user_cache import user_cache_dir
+from LUT import read_lut, apply_lut, bake_lut, apply_baked_lut
+from LUT.bake_lut import FULL_TABLE_BYTES
+from scheduler import PrefetchScheduler
+from frame_cache import FrameCache
+from request_queue import RequestQueue, VISIBLE, LOOKAHEAD, BACKGROUND, EXPORT
+import cv2
+
+from pathlib import Path
+
+from typing import Iterable, List, Optional, Tuple
+
+STRIP_HEIGHT = 64 # rows per cancellation check
+
+# downsample level -> factor
+DOWNSAMPLE_FACTORS = {'full': 1, 'half': 2, 'quarter': 4}
+
+# sample type of the processed frames -> numpy dtype
+DTYPES = {'uint8': np.uint8, 'uint16': np.uint16, 'half': np.float16, 'float': np.float32}
+
+@dataclass(frozen=True)
+class ProcessDesc:
+    frame: int
+    path: str
+    downsample: str = None
+    lut: str = None
+    corners: tuple = None
+    interpolation: str = "trilinear" # of the lut: trilinear | tetrahedral
+    dtype: str = "uint8" # of the processed frame: uint8 | uint16 | half | float, see DTYPES
+
+    def is_valid(self):
+        return (isinstance(self.path, str) and Path(self.path).exists() and 
+            isinstance(self.frame, int) and 
+            isinstance(self.downsample, str))
+
+
+class CancelToken:
+    """cooperative cancellation of an evaluation.
+    The flag is a one element array, so the reader and the LUT kernel can
+    poll it per strip or row without calling back into python."""
+    def __init__(self):
+        self.flag = np.zeros(1, dtype=np.uint8)
+
+    def cancel(self)->None:
+        self.flag[0] = 1
+
+    @property
+    def cancelled(self)->bool:
+        return bool(self.flag[0])
+
+
+@cache
+def read_lut_cached(lut_path):
+    print("read lut", lut_path)
+    return read_lut(lut_path, cache_dir=user_cache_dir()/"luts")
+
+_reader_lock = threading.Lock()
+
+@cache
+def _create_reader(path, decoders):
+    return Reader(path, decoders=decoders)
+
+def create_reader_cached(path, decoders=1)->Reader:
+    """the shared reader of path. Opened under a lock, functools.cache alone
+    lets the workers and the frame range thread open the same path at once"""
+    with _reader_lock:
+        return _create_reader(path, decoders)
+
+class FrameServerCore:
+    """Notifies through on_frame_done and on_cache_changed, override them.
+    They are called from the worker threads."""
+    def __init__(self, decoders=4, workers=4, threads=None):
+        self.decoders = decoders # capture handles per video source
+        self.workers = workers # concurrent evaluations
+        self.threads = threads or os.cpu_count() or 1 # cores shared by the parallel kernels
+
+        self.times = dict() # profile
+
+        self._memory_limit = 1000 #MB
+
+        self._cache = FrameCache(group=lambda key: (key.path, key.downsample, key.lut, key.interpolation, key.dtype))
+
+        # cache the results of individual stages across frames, so toggling the lut
+        # or moving a corner reuses the upstream stages of the frames around the
+        # playhead. Each stage keeps a number of frames, together they take at most
+        # stage_share of the memory limit. The processed frames get the rest.
+        self.stage_budget = {'read': 8, 'lut': 8, 'cornerpin': 4} # frames
+        self.stage_share = 0.5
+        self._stage_cache = {stage: FrameCache() for stage in self.stage_budget}
+        self._requested_frame = None
+
+        # requests shared by the workers, served by priority. Completed frames of
+        # the prefetch window are notified in request order, the visible frame and
+        # background frames as soon as they are done.
+        self._requests = RequestQueue()
+        self._tickets = dict() # ProcessDesc -> request order, of the window requests
+        self._next_ticket = 0
+        self._completed = dict() # ticket -> ProcessDesc, None when skipped
+        self._next_delivery = 0
+        self._delivery_lock = threading.Lock()
+        self._in_flight = dict() # ProcessDesc -> (priority, CancelToken)
+        self._futures = dict() # ProcessDesc -> [Future], of the submitted jobs, see submit
+
+        # luts baked to lookup tables for 8 bit sources, see baked_lut. The tables
+        # share lut_share of the memory limit, the processed frames get the rest.
+        self.lut_table_bytes = FULL_TABLE_BYTES # memory ceiling of a table, 0 to not bake
+        self.lut_share = 0.1
+        self._baked_luts = OrderedDict() # (lut path, interpolation) -> table, None while baking
+        self._baked_bytes = 0 # of the tables
+        self.max_baked_luts = 2
+        self.bake_in_background = True # False: the first evaluation bakes the table, for batch processes
+
+        # profile: seconds spent on evaluations that were delivered vs. cancelled
+        self.stats = {'useful': 0.0, 'wasted': 0.0}
+
+        self.running = True
+        self.lock = threading.Lock()
+        self._wakeup = threading.Condition(self.lock) # workers wait for requests
+        self._parked = set() # background requests dropped while the cache was full
+        self._threads = [threading.Thread(target=self.preload, daemon=True) for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+        self.scrub_event = threading.Event()
+
+        # playback hints for prefetching, see set_hints
+        self.hints = {
+            'playback': "paused", # forward | reverse | paused (scrubbing)
+            'fps': None,
+            'inpoint': None,
+            'outpoint': None
+        }
+        self.scheduler = PrefetchScheduler()
+        self._window = dict() # the wanted prefetch keys around the playhead -> priority
+        self._range_readers = dict() # path -> its reader, None while it opens
+
+        # self._current_frame = None
+        # self._current_image = None
+
+    def on_frame_done(self, key:ProcessDesc)->None:
+        """a requested frame is cached"""
+        pass
+
+    def on_cache_changed(self)->None:
+        """frames were cached or evicted"""
+        pass
+
+    def evaluate(self, key:ProcessDesc, rect=None, cancel:CancelToken=None, store:bool=True)->np.ndarray:
+        """runs on the worker threads.
+        Returns None as soon as cancel is set, the reader and the kernels poll it.
+        store: cache the stage results, export jobs only read them"""
+        # print("evaluate", key)
+        if key.path is None:
+            return None
+            # raise Exception("invalid process description")
+
+        # a capture handle for each worker, the reader locks them
+        reader = create_reader_cached(key.path, max(self.decoders, self.workers))
+
+        lut = None
+        if key.lut is not None:
+            lut = read_lut_cached(key.lut)
+
+        # Read, at the reduced resolution.
+        # 8 bit sources stay 8 bit until a stage needs float, the lut.
+        # Deeper sources are read as float.
+        factor = DOWNSAMPLE_FACTORS[key.downsample]
+        dtype = np.uint8 if reader.dtype == np.uint8 else np.float32
+
+        stage_key = ProcessDesc(frame=key.frame, path=key.path, downsample=key.downsample)
+        data = self._stage_cache['read'].get(stage_key)
+        if data is None and reader.reduces_by_shrink:
+            data = self._reduce_cached('read', stage_key, store)
+        if data is None:
+            print("Read", key)
+            begin = time.time()
+            data = reader.read(key.frame, dtype=dtype, downsample=factor, 
+                cancel=cancel.flag if cancel else None)
+            if data is None:
+                return None
+            if store:
+                self._stage_cache['read'].put(stage_key, data)
+            self.times['read'] = time.time()-begin
+
+        if cancel and cancel.cancelled:
+            print("cancel eval")
+            return None
+
+        # Resize, the reader already returns the reduced size
+        begin = time.time()
+        height, width = reader.height//factor, reader.width//factor
+        if data.shape[:2] != (height, width):
+            print("Resize", key)
+            data = cv2.resize(data, 
+                dsize=(width, height), 
+                interpolation=cv2.INTER_NEAREST)
+        self.times['resize'] = time.time()-begin
+
+        # 8 bit frames may use the 8 bit lut table, deeper frames keep the float results
+        # of the lut and later stages apart from them
+        stage_dtype = "uint8" if key.dtype == "uint8" else "float"
+
+        # Apply Lut
+        if lut is not None:
+            stage_key = ProcessDesc(frame=key.frame, path=key.path, downsample=key.downsample, lut=key.lut, interpolation=key.interpolation, dtype=stage_dtype)
+            cached = self._stage_cache['lut'].get(stage_key)
+            if cached is None and reader.reduces_by_shrink:
+                cached = self._reduce_cached('lut', stage_key, store)
+            if cached is not None:
+                data = cached
+            else:
+                begin = time.time()
+                print("ApplyLut", key)
+                # split the cores between the evaluations in flight
+                num_threads = max(1, self.threads // max(1, len(self._in_flight)))
+                table = None
+                if data.dtype == np.uint8 and stage_dtype == "uint8" and self.lut_table_bytes:
+                    table = self.baked_lut(key.lut, key.interpolation)
+                if table is not None:
+                    # 8 bit in, 8 bit out, a lookup per pixel
+                    data = apply_baked_lut(data, table, cancel.flag if cancel else None, num_threads)
+                else:
+                    if data.dtype == np.uint8:
+                        data = convert_pixels(data, np.float32)
+                    data = apply_lut(data, lut, cancel.flag if cancel else None, num_threads, key.interpolation)
+                if data is None:
+                    print("cancel eval")
+                    return None
+                if store:
+                    self._stage_cache['lut'].put(stage_key, data)
+                self.times['lut'] = time.time()-begin
+
+        if cancel and cancel.cancelled:
+            print("cancel eval")
+            return None
+
+        # Corner Pin
+        if key.corners is not None:
+            stage_key = ProcessDesc(frame=key.frame, path=key.path, downsample=key.downsample, lut=key.lut, corners=key.corners, interpolation=key.interpolation, dtype=stage_dtype)
+            cached = self._stage_cache['cornerpin'].get(stage_key)
+            if cached is not None:
+                data = cached
+            else:
+                print("CornerPin", key)
+                begin = time.time()
+                h,w,c = data.shape
+                src_pts = np.array([(0,0),(w,0),(w,h),(0,h)], dtype=np.float32)
+                dst_pts = np.array(key.corners, dtype=np.float32)
+                M = cv2.getPerspectiveTransform(src_pts, dst_pts)
+                # warp in strips of rows, to check for cancellation in between
+                warped = np.empty_like(data)
+                for y in range(0, h, STRIP_HEIGHT):
+                    if cancel and cancel.cancelled:
+                        print("cancel eval")
+                        return None
+                    yend = min(y+STRIP_HEIGHT, h)
+                    T = np.array([[1,0,0],[0,1,-y],[0,0,1]], dtype=M.dtype)
+                    cv2.warpPerspective(data, T@M, (w, yend-y), dst=warped[y:yend])
+                data = warped
+                if store:
+                    self._stage_cache['cornerpin'].put(stage_key, data)
+                self.times['cornerpin'] = time.time()-begin
+
+        if cancel and cancel.cancelled:
+            print("cancel eval")
+            return None
+
+        # to the sample type of the frame, in a single pass
+        return convert_pixels(data, DTYPES[key.dtype])
+
+    def _reduce_cached(self, stage:str, stage_key:ProcessDesc, store:bool=True)->Optional[np.ndarray]:
+        """derive the stage result from a higher resolution one in the stage cache,
+        eg. 'quarter' from a cached 'half' or 'full'. Only for readers that
+        reduce by shrinking, see Reader.reduces_by_shrink: the read and lut
+        stages are per pixel, so the nearest neighbour shrink of a larger level
+        gives the same pixels as reading the level.
+        The derived result is cached too, when store is set."""
+        factor = DOWNSAMPLE_FACTORS[stage_key.downsample]
+        # the closest larger level first, it is the least work
+        for downsample, larger_factor in sorted(DOWNSAMPLE_FACTORS.items(), key=lambda item: -item[1]):
+            if larger_factor >= factor:
+                continue
+            larger = self._stage_cache[stage].get(replace(stage_key, downsample=downsample))
+            if larger is not None:
+                print("Reduce", stage, downsample, "->", stage_key.downsample, stage_key.frame)
+                data = shrink(larger, factor//larger_factor)
+                data.flags.writeable = False
+                if store:
+                    self._stage_cache[stage].put(stage_key, data)
+                return data
+        return None
+
+    def baked_lut(self, lut_path:str, interpolation:str="trilinear")->Optional[np.ndarray]:
+        """the lookup table of the lut for 8 bit pixels. The first call starts
+        baking it in the background and returns None, evaluations use the
+        float kernel until the table is ready. The last few tables are kept.
+        Without bake_in_background the first call bakes it and returns it."""
+        key = (lut_path, interpolation)
+        with self.lock:
+            if key in self._baked_luts:
+                self._baked_luts.move_to_end(key)
+                return self._baked_luts[key]
+            self._baked_luts[key] = None
+            while len(self._baked_luts) > self.max_baked_luts:
+                evicted_key, table = self._baked_luts.popitem(last=False)
+                if table is not None:
+                    self._baked_bytes-=table.nbytes
+
+        # each table gets its part of the share, smaller tables keep fewer points
+        max_bytes = min(self.lut_table_bytes, int(self._memory_limit*self.lut_share*1024*1024/self.max_baked_luts))
+
+        def bake():
+            print("bake lut", lut_path, interpolation)
+            try:
+                table = bake_lut(read_lut_cached(lut_path), max_bytes, interpolation, self.threads)
+            except Exception:
+                traceback.print_exc()
+                return # keeps using the float kernel
+            if table is None:
+                return # no table fits, keeps using the float kernel
+            with self.lock:
+                if key in self._baked_luts:
+                    self._baked_luts[key] = table
+                    self._baked_bytes+=table.nbytes
+        if not self.bake_in_background:
+            bake()
+            with self.lock:
+                return self._baked_luts.get(key)
+        # not a daemon: exiting waits for it instead of killing it inside the kernel
+        threading.Thread(target=bake, daemon=False).start()
+        return None
+
+    def used_memory(self):
+        """processed frames, stage results and baked luts"""
+        nbytes = self._cache.nbytes + self._reserved_bytes()
+        return nbytes / 1024 / 1024 # in MB
+
+    def _reserved_bytes(self)->int:
+        """bytes of the stage caches and baked luts"""
+        return self._baked_bytes + sum(cache.nbytes for cache in self._stage_cache.values())
+
+    def _frame_limit(self)->int:
+        """bytes for the processed frames, what the stage caches and baked luts leave"""
+        return int(self._memory_limit*1024*1024) - self._reserved_bytes()
+
+    def _has_room(self)->bool:
+        """the cache can take another frame without evicting one"""
+        return self._cache.nbytes+(self._frame_bytes() or 0) <= self._frame_limit()
+
+    def _frame_bytes(self)->Optional[float]:
+        """the average size of a processed frame, None while the cache is empty"""
+        if not len(self._cache):
+            return None
+        return self._cache.nbytes/len(self._cache)
+
+    def _submit(self, key:ProcessDesc, priority:int)->None:
+        """queue a request for the workers, or raise its priority.
+        A request in flight, eg. an export job of the visible frame, takes the
+        higher priority, so it is stored and notified when it is done.
+        Call with the lock held."""
+        if key in self._in_flight:
+            running_priority, token = self._in_flight[key]
+            if priority < running_priority:
+                self._in_flight[key] = (priority, token)
+                if priority <= LOOKAHEAD and key not in self._tickets:
+                    self._tickets[key] = self._next_ticket
+                    self._next_ticket+=1
+            return
+        if key in self._requests and self._requests.priority(key) <= priority:
+            return
+        if priority <= LOOKAHEAD and key not in self._tickets:
+            self._tickets[key] = self._next_ticket
+            self._next_ticket+=1
+        self._requests.push(key, priority)
+        self._wakeup.notify()
+
+    def _complete(self, key:ProcessDesc, done:bool)->None:
+        """complete the request of key, and call on_frame_done for the completed
+        frames of the window in request order. Skipped requests are not notified.
+        The visible frame does not wait for the frames requested before it."""
+        with self.lock:
+            ticket = self._tickets.pop(key, None)
+            IsVisible = key == self._requested_frame
+        if ticket is None or (done and IsVisible):
+            if done:
+                self.on_frame_done(key)
+            if ticket is None:
+                return
+            done = False # notified, only release the ticket
+        with self._delivery_lock:
+            self._completed[ticket] = key if done else None
+            while self._next_delivery in self._completed:
+                completed_key = self._completed.pop(self._next_delivery)
+                self._next_delivery+=1
+                if completed_key is not None:
+                    # print("frame done", "frame is loaded")
+                    self.on_frame_done(completed_key)
+
+    @property
+    def memory_limit(self)->float:
+        return self._memory_limit
+
+    @memory_limit.setter
+    def memory_limit(self, megabytes:float)->None:
+        IsRaised = megabytes > self._memory_limit
+        self._memory_limit = megabytes
+        self._evict()
+        if IsRaised:
+            # resume the background fill dropped at the old limit, and widen the prefetch window
+            with self.lock:
+                for key in self._parked:
+                    self._submit(key, BACKGROUND)
+                self._parked.clear()
+                self._wakeup.notify_all()
+            if self._requested_frame is not None:
+                self._schedule(self._requested_frame)
+
+    def _evict(self)->None:
+        """evict least recently used frames and stage results over their budget"""
+        # the stages split their share by frames
+        share = self._memory_limit*self.stage_share*1024*1024/sum(self.stage_budget.values())
+        for stage, cache in self._stage_cache.items():
+            cache.evict(int(share*self.stage_budget[stage]), max_frames=self.stage_budget[stage])
+
+        evicted = self._cache.evict(self._frame_limit())
+        if evicted:
+            print("del", [key.frame for key in evicted])
+            self.on_cache_changed()
+
+    def stop(self)->None:
+        """wake and stop the workers, and cancel the submitted jobs"""
+        with self.lock:
+            self.running = False
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join()
+        with self.lock:
+            futures = [future for futures in self._futures.values() for future in futures]
+            self._futures.clear()
+        for future in futures:
+            future.cancel()
+
+    def _resolve(self, key:ProcessDesc, pixels:Optional[np.ndarray], error:Exception=None)->None:
+        """resolve the futures submitted for key, with pixels or the error"""
+        with self.lock:
+            futures = self._futures.pop(key, [])
+        for future in futures:
+            try:
+                if pixels is not None:
+                    future.set_result(pixels)
+                else:
+                    future.set_exception(error or ValueError("cant evaluate {}".format(key)))
+            except InvalidStateError:
+                pass # cancelled by the submitter
+
+    def preload(self)->None:
+        """worker loop, runs on each of the worker threads.
+        Blocks until a request is submitted or the server stops."""
+        while True:
+            with self.lock:
+                while self.running and not self._requests:
+                    self._wakeup.wait()
+                if not self.running:
+                    return
+                key, priority = self._requests.pop()
+                futures = self._futures.get(key)
+                if futures is not None and all(future.cancelled() for future in futures):
+                    del self._futures[key]
+                    futures = None
+                    if priority == EXPORT:
+                        continue # dropped by the submitter
+                if futures is None and priority == BACKGROUND and not self._has_room():
+                    # fill the cache only while it has room, dont evict the working set.
+                    # Resumed when the memory limit is raised
+                    self._parked.add(key)
+                    continue
+                IsCached = key in self._cache # done by an earlier request
+                if not IsCached:
+                    token = CancelToken()
+                    self._in_flight[key] = (priority, token)
+
+            if IsCached:
+                self._resolve(key, self._cache.peek(key))
+                continue
+
+            # print("preload frame", frame, threading.current_thread())
+            begin = time.time()
+            error = None
+            try:
+                # export jobs dont cache stage results, to keep the interactive ones
+                img = self.evaluate(key, cancel=token, store=priority < EXPORT)
+            except Exception as err:
+                # keep the worker alive, and release the request
+                traceback.print_exc()
+                img, error = None, err
+            with self.lock:
+                priority = self._in_flight.pop(key)[0] # raised by a request while in flight
+                self.stats['useful' if img is not None else 'wasted']+=time.time()-begin
+                # export frames are cached only while the cache has room, or when the viewer wants them
+                IsStored = img is not None and (priority < EXPORT or key in self._window or self._has_room())
+            if IsStored:
+                # print("read frame: ", frame)
+                self._cache.put(key, img)
+            self._evict() # cancelled evaluations cache stage results too
+            if IsStored:
+                self.on_cache_changed()
+            self._complete(key, IsStored)
+
+            # requeue cancelled requests, preempted or left the window, behind the window
+            with self.lock:
+                IsRequeued = self.running and token.cancelled and key not in self._cache
+                if IsRequeued:
+                    self._submit(key, self._window.get(key, max(priority, BACKGROUND)))
+            if not IsRequeued:
+                self._resolve(key, img if img is not None else self._cache.peek(key), error)
+
+    def is_wanted(self, key:ProcessDesc)->bool:
+        """the requested frame, or a frame in the prefetch window"""
+        return key in self._window
+
+    def set_hints(self, **hints)->None:
+        """playback, fps, inpoint and outpoint of the player. Reschedules prefetching."""
+        self.hints.update(hints)
+        if self._requested_frame is not None:
+            self._schedule(self._requested_frame)
+
+    def _frame_range(self, path:str)->Optional[Tuple[int, int]]:
+        """the first and last frame of path. None while its reader opens on a
+        background thread, opening a video or scanning a folder would block the
+        caller, the GUI. The window of the requested frame is scheduled when it is open.
+        The range is the reader's, it follows a sequence that is still being rendered."""
+        with self.lock:
+            IsOpening = path not in self._range_readers
+            if IsOpening:
+                self._range_readers[path] = None
+            reader = self._range_readers[path]
+        if reader is not None:
+            return reader.first_frame, reader.last_frame
+        if not IsOpening:
+            return None
+
+        def open_reader():
+            try:
+                reader = create_reader_cached(path, max(self.decoders, self.workers))
+            except Exception as err:
+                print("cant open", path, err)
+                with self.lock:
+                    del self._range_readers[path] # the next request tries again
+                return
+            with self.lock:
+                self._range_readers[path] = reader
+                requested = self._requested_frame
+            if self.running and requested is not None and requested.path == path:
+                self._schedule(requested)
+        threading.Thread(target=open_reader, daemon=True).start()
+        return None
+
+    def _schedule(self, key:ProcessDesc)->None:
+        """request the prefetch window around key. Pending requests that left
+        the window are moved to the background, and the ones in flight are
+        cancelled. The visible frame preempts background work.
+        Until the reader of a new path is open, only key is requested."""
+        frame_range = self._frame_range(key.path)
+
+        # dont prefetch more than fits in memory
+        max_frames = None
+        frame_bytes = self._frame_bytes()
+        if frame_bytes:
+            max_frames = int(self._frame_limit() / frame_bytes * 0.8)
+
+        if frame_range is None:
+            keys = [key]
+        else:
+            first_frame, last_frame = frame_range
+            frames = self.scheduler.window(key.frame, max_frames=max_frames, **self.hints)
+            keys = [replace(key, frame=frame) for frame in frames 
+                if first_frame <= frame <= last_frame]
+
+        with self.lock:
+            self._requested_frame = key
+            self._window = {window_key: VISIBLE if window_key == key else LOOKAHEAD for window_key in keys}
+
+            # demote the requests that left the window
+            demoted = [pending_key for pending_key in self._requests.keys(VISIBLE)+self._requests.keys(LOOKAHEAD) 
+                if pending_key not in self._window]
+            for pending_key in demoted:
+                self._requests.push(pending_key, BACKGROUND)
+
+            # requeue in window order, the playhead first
+            for window_key, priority in self._window.items():
+                if window_key in self._cache:
+                    continue
+                if window_key in self._requests:
+                    self._requests.remove(window_key)
+                self._submit(window_key, priority)
+
+            # abandon the evaluations that left the window
+            for running_key, (priority, token) in self._in_flight.items():
+                if priority <= LOOKAHEAD and running_key not in self._window:
+                    token.cancel()
+
+            # free a worker for the visible frame
+            if key not in self._cache and key not in self._in_flight and len(self._in_flight) >= self.workers:
+                background = [(priority, running_key) for running_key, (priority, token) in self._in_flight.items() 
+                    if priority >= BACKGROUND and not token.cancelled]
+                if background:
+                    priority, running_key = max(background, key=lambda item: item[0])
+                    self._in_flight[running_key][1].cancel()
+
+        # release the tickets of the demoted requests
+        for pending_key in demoted:
+            self._complete(pending_key, False)
+
+        if frame_range is None:
+            with self.lock:
+                IsOpened = self._range_readers.get(key.path) is not None
+            if IsOpened: # the reader opened before key was the requested frame
+                self._schedule(key)
+
+    def cached_ahead(self)->int:
+        """how many frames from the playhead are cached, in the playback direction"""
+        key = self._requested_frame
+        if key is None:
+            return 0
+        count = 0
+        for frame in self.scheduler.window(key.frame, **self.hints)[1:]:
+            if replace(key, frame=frame) not in self._cache:
+                break
+            count+=1
+        return count
+
+    def request(self, key:ProcessDesc, priority:int=BACKGROUND)->None:
+        """request a frame outside of the playback window, eg. to fill the cache,
+        for an export or a thumbnail. on_frame_done is called when it is done."""
+        if key in self._cache:
+            self.on_frame_done(key)
+            return
+        with self.lock:
+            self._submit(key, priority)
+
+    def submit(self, key:ProcessDesc, priority:int=EXPORT)->Future:
+        """evaluate key as a job of the workers, eg. for an export. Returns a
+        Future of the pixels, resolved at once when the frame is cached.
+        At EXPORT priority the frame is cached only while the cache has room,
+        and its stage results are not cached, the interactive frames stay.
+        Cancel the future to drop the job."""
+        future = Future()
+        pixels = self._cache.peek(key)
+        if pixels is not None:
+            future.set_result(pixels)
+            return future
+        with self.lock:
+            if not self.running:
+                future.cancel()
+                return future
+            self._futures.setdefault(key, []).append(future)
+            self._submit(key, priority)
+        return future
+
+    def request_frame(self, key:ProcessDesc)->None:
+        if key in self._cache:
+            # self._current_frame = key
+            # self.image_changed.emit()
+            # print("frame done", "frame is cached")
+            self.on_frame_done(key)
+        # prefetch around the requested frame
+        self._schedule(key)
+
+    def __getitem__(self, key:ProcessDesc)->np.ndarray:
+        return self._cache.get(key) # a hit marks the frame as recently used
+
+    def __contains__(self, key:ProcessDesc)->bool:
+        return key in self._cache
+
+    def __iter__(self)->Iterable[ProcessDesc]:
+        for key in self._cache:
+            yield key
+
+    def cached_frames(self, path:str, downsample:str, lut:str, interpolation:str="trilinear", dtype:str="uint8")->List[int]:
+        return self._cache.frames(path, downsample, lut, interpolation, dtype)
+
+    def clear_cache(self):
+        self._cache.clear()
+        for cache in self._stage_cache.values():
+            cache.clear()
+
+class ProcessEvaluator:
+    """FrameServerCore.evaluate for worker processes, eg. the segments of an export.
+    Picklable, each process creates its own FrameServerCore on first use.
+    The stage results are not cached, a process sees every frame once."""
+    def __init__(self, threads:int=1):
+        self.threads = threads # of the lut kernel
+        self._frame_server = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self)->dict:
+        return {'threads': self.threads}
+
+    def __setstate__(self, state:dict)->None:
+        self.__init__(**state)
+
+    def __call__(self, key:ProcessDesc)->np.ndarray:
+        with self._lock:
+            if self._frame_server is None:
+                self._frame_server = FrameServerCore(workers=0, threads=self.threads)
+                self._frame_server.bake_in_background = False # the process exits with the export
+        return self._frame_server.evaluate(key, store=False)
@@ -32,10 +32,11 @@ from read import Reader
 from invoke_in_main import inmain_later, inmain_decorator
 from LUT import read_lut, apply_lut
 
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 
 
-from frame_server import FrameServer, ProcessDesc
+from frame_server import FrameServer, ProcessDesc, ProcessEvaluator
+from export import run as run_export, run_segments, default_dtype, CODECS
 
 class HandleItem(QObject, QGraphicsItem):
     positionChanged = Signal()
@@ -210,11 +211,21 @@ class VideoPlayer(QWidget):
             'export': {
                 'visible': False,
                 'progress': 0,
-                'filename': None
+                'filename': None,
+                'fps': 0.0, # throughput of the running export
+                'MB/s': 0.0
+            },
+            'export_options': { # encoding, None for the default of the extension or codec
+                'codec': None,
+                'preset': None,
+                'pix_fmt': None,
+                'dtype': None, # sample type of the frames: uint8 | uint16 | half | float
+                'segments': 1 # exported in parallel processes, 1: by the frame server
             },
 
             'lut_path': None,
             'lut_enabled': False,
+            'lut_interpolation': "trilinear", # trilinear | tetrahedral
 
             'topleft': None,
             'topright': None,
@@ -225,6 +236,7 @@ class VideoPlayer(QWidget):
             'image': None,
             'downsample': 'full', # full half | quarter
             'used_memory': 0,
+            'cached_ahead': 0, # frames cached ahead of the playhead
         }
 
         self.setWindowTitle("PyVideoPlayer")
@@ -232,10 +244,21 @@ class VideoPlayer(QWidget):
         # Create and binf frameserver
         # ---------------------------
         self.frame_server = FrameServer()
+        self._export_cancel = threading.Event() # of the running export
+        # pass playback hints for prefetching, before requesting the frame
+        @self.state_changed.connect
+        def update_frame_server_hints(changes):
+            if any(key in changes for key in ['playback', 'fps', 'inpoint', 'outpoint']):
+                self.frame_server.set_hints(
+                    playback=self.state['playback'],
+                    fps=self.state['fps'],
+                    inpoint=self.state['inpoint'],
+                    outpoint=self.state['outpoint'])
+
         # watch changes to request frames
         @self.state_changed.connect
         def request_frame_on_change(changes):
-            if any(key in changes for key in ['topleft', 'topright', 'bottomright', 'bottomleft', 'frame', 'path', 'downsample', 'lut_enabled', 'lut_path']):
+            if any(key in changes for key in ['topleft', 'topright', 'bottomright', 'bottomleft', 'frame', 'path', 'downsample', 'lut_enabled', 'lut_path', 'lut_interpolation']):
                 key = self.make_key()
                 if key.is_valid():
                     self.frame_server.request_frame(self.make_key())
@@ -250,7 +273,7 @@ class VideoPlayer(QWidget):
 
         @self.frame_server.cache_changed.connect
         def update_used_memory():
-            self.set_state(used_memory=self.frame_server.used_memory())
+            self.set_state(used_memory=self.frame_server.used_memory(), cached_ahead=self.frame_server.cached_ahead())
 
         # init gui
         self.init_gui()
@@ -401,7 +424,9 @@ class VideoPlayer(QWidget):
                 self.state['bottomleft'],
                 )
 
-        desc = ProcessDesc(path=path, frame=frame, downsample=downsample, lut=lut, corners=corners)
+        interpolation = self.state['lut_interpolation'] if lut else "trilinear"
+
+        desc = ProcessDesc(path=path, frame=frame, downsample=downsample, lut=lut, corners=corners, interpolation=interpolation)
         return desc
         return desc if desc.is_valid() else None
 
@@ -540,6 +565,8 @@ class VideoPlayer(QWidget):
 
                 if self.export_dialog.isVisible():
                     self.export_progress.setValue(self.state['export']['progress'])
+                    self.export_progress.setFormat("{} %v %p% {:.1f}fps {:.0f}MB/s".format(
+                        self.state['export']['filename'], self.state['export']['fps'], self.state['export']['MB/s']))
 
         return menubar
 
@@ -616,6 +643,21 @@ class VideoPlayer(QWidget):
                 enable_lut_btn.blockSignals(False)
         image_toolbar.layout().addWidget(enable_lut_btn)
 
+        interpolation_combo = QComboBox()
+        interpolation_combo.addItems(["Trilinear", "Tetrahedral"])
+        interpolation_combo.setToolTip("lut interpolation")
+        image_toolbar.layout().addWidget(interpolation_combo)
+        @interpolation_combo.currentIndexChanged.connect
+        def _(idx):
+            self.set_state(lut_interpolation=["trilinear", "tetrahedral"][idx])
+
+        @self.state_changed.connect
+        def _(changes):
+            if 'lut_interpolation' in changes:
+                interpolation_combo.blockSignals(True)
+                interpolation_combo.setCurrentIndex(["trilinear", "tetrahedral"].index(changes['lut_interpolation']))
+                interpolation_combo.blockSignals(False)
+
         return image_toolbar
 
     def create_image_viewer(self):
@@ -906,12 +948,13 @@ class VideoPlayer(QWidget):
             if 'range' in changes:
                 cacheBar.setRange(*changes['range'])
                 
-            if any(['downsample', 'lut_path', 'lut_enabled'] for key in changes):
+            if any(['downsample', 'lut_path', 'lut_enabled', 'lut_interpolation'] for key in changes):
                 downsample = changes.get('downsample', self.state['downsample'])
                 lut_path = changes.get('lut_path', self.state['lut_path'])
                 lut_enabled = changes.get('lut_enabled', self.state['lut_enabled'])
                 lut = lut_path if lut_enabled else None
-                cached_frames = [key.frame for key in self.frame_server if key.downsample==downsample and key.lut==lut]
+                interpolation = changes.get('lut_interpolation', self.state['lut_interpolation']) if lut else "trilinear"
+                cached_frames = self.frame_server.cached_frames(self.state['path'], downsample, lut, interpolation)
                 cacheBar.setValues(cached_frames)
 
 
@@ -1138,6 +1181,17 @@ class VideoPlayer(QWidget):
 
         statusbar.addPermanentWidget(resolution_label)
 
+        # add cached ahead label to statusbar
+        cached_ahead_label = QLabel("ahead")
+        cached_ahead_label.setToolTip("frames cached ahead of the playhead")
+
+        @self.state_changed.connect
+        def sync_cached_ahead_label(changes):
+            if 'cached_ahead' in changes:
+                cached_ahead_label.setText("+{}f".format(changes['cached_ahead']))
+
+        statusbar.addPermanentWidget(cached_ahead_label)
+
         # add fps label to statusbar
         statusbar.addPermanentWidget(fps_label)
 
@@ -1285,8 +1339,72 @@ class VideoPlayer(QWidget):
         reveal_export_action = QAction("reveal", self)
         reveal_export_action.triggered.connect(lambda: print(self.state['export']['filename']))
         self.export_progress.addAction(reveal_export_action)
+        cancel_export_action = QAction("cancel", self)
+        cancel_export_action.triggered.connect(lambda: self._export_cancel.set())
+        self.export_progress.addAction(cancel_export_action)
         self.export_dialog.layout().addWidget(self.export_progress)
 
+        # movie encoding options
+        export_options = QWidget()
+        export_options.setLayout(QFormLayout())
+        export_options.layout().setContentsMargins(0,0,0,0)
+        codec_combo = QComboBox()
+        codec_combo.addItems(["auto", *CODECS])
+        codec_combo.setToolTip("auto: h264 for .mp4, prores for .mov, h265 for .mkv, dnxhr for .mxf")
+        preset_combo = QComboBox()
+        pix_fmt_combo = QComboBox()
+        export_options.layout().addRow("codec", codec_combo)
+        export_options.layout().addRow("preset", preset_combo)
+        export_options.layout().addRow("pixel format", pix_fmt_combo)
+        dtype_combo = QComboBox()
+        dtype_combo.addItems(["auto", "uint8", "uint16", "half", "float"])
+        dtype_combo.setToolTip("auto: half for .exr, 10 bit for .dpx, 16 bit for 10 bit movies, 8 bit otherwise")
+        export_options.layout().addRow("bit depth", dtype_combo)
+        dtype_combo.currentTextChanged.connect(lambda text: self.set_state(export_options={**self.state['export_options'], 'dtype': None if text == "auto" else text}))
+        segments_spinbox = QSpinBox()
+        segments_spinbox.setRange(1, 64)
+        segments_spinbox.setToolTip("export segments in parallel processes, for long ranges")
+        export_options.layout().addRow("segments", segments_spinbox)
+        segments_spinbox.valueChanged.connect(lambda value: self.set_state(export_options={**self.state['export_options'], 'segments': value}))
+        self.export_dialog.layout().addWidget(export_options)
+
+        @codec_combo.currentTextChanged.connect
+        def _(text):
+            codec = None if text == "auto" else text
+            self.set_state(export_options={**self.state['export_options'], 'codec': codec, 'preset': None, 'pix_fmt': None})
+
+        @preset_combo.currentTextChanged.connect
+        def _(text):
+            self.set_state(export_options={**self.state['export_options'], 'preset': None if text == "default" else text})
+
+        @pix_fmt_combo.currentTextChanged.connect
+        def _(text):
+            self.set_state(export_options={**self.state['export_options'], 'pix_fmt': None if text == "default" else text})
+
+        def update_export_options(changes):
+            if 'export_options' in changes:
+                options = changes['export_options']
+                codec = CODECS.get(options['codec'], {'presets': [], 'pix_fmts': []})
+                for combo, items, value in [
+                    (codec_combo, ["auto", *CODECS], options['codec'] or "auto"),
+                    (preset_combo, ["default", *codec['presets']], options['preset'] or "default"),
+                    (pix_fmt_combo, ["default", *codec['pix_fmts']], options['pix_fmt'] or "default")]:
+                    combo.blockSignals(True)
+                    if [combo.itemText(i) for i in range(combo.count())] != items:
+                        combo.clear()
+                        combo.addItems(items)
+                    combo.setCurrentText(value)
+                    combo.setEnabled(len(items) > 1)
+                    combo.blockSignals(False)
+                segments_spinbox.blockSignals(True)
+                segments_spinbox.setValue(options['segments'])
+                segments_spinbox.blockSignals(False)
+                dtype_combo.blockSignals(True)
+                dtype_combo.setCurrentText(options['dtype'] or "auto")
+                dtype_combo.blockSignals(False)
+        self.state_changed.connect(update_export_options)
+        update_export_options({'export_options': self.state['export_options']})
+
         # Handle drar and drop
         self.setAcceptDrops(True)
         image_viewer.setAcceptDrops(False)
@@ -1318,6 +1436,7 @@ class VideoPlayer(QWidget):
 
     def closeEvent(self, event):
         self.running = False
+        self.frame_server.stop()
         print("close")
 
     # COMMANDS
@@ -1346,7 +1465,7 @@ class VideoPlayer(QWidget):
 
     def export(self, filename=None):
         if not filename:
-            filename, filters = QFileDialog.getSaveFileName(self, "Export Video", "/", "*.mp4;; *.jpg")
+            filename, filters = QFileDialog.getSaveFileName(self, "Export Video", "/", "*.mp4;; *.mov;; *.mkv;; *.mxf;; *.jpg;; *.png;; *.tif;; *.exr;; *.dpx")
 
         if not filename:
             return
@@ -1354,7 +1473,9 @@ class VideoPlayer(QWidget):
         self.set_state(export = {
             'visible': True,
             'filename': filename,
-            'progress': 0
+            'progress': 0,
+            'fps': 0.0,
+            'MB/s': 0.0
         })
 
         # set widget
@@ -1363,70 +1484,44 @@ class VideoPlayer(QWidget):
         self.export_progress.setMaximum(last_frame)
         self.export_progress.setFormat(filename+" %v %p%")
 
+        fps = self.state['fps']
+        options = dict(self.state['export_options'])
+        segments = options.pop('segments')
+        dtype = options.pop('dtype') or default_dtype(filename, options['codec'], options['pix_fmt'])
+
+        # export what the viewer shows, at full resolution and the bit depth of the file
+        keys = [replace(self.make_key(), frame=frame, downsample="full", dtype=dtype) for frame in range(first_frame, last_frame+1)]
+        self._export_cancel = threading.Event()
+
+        def update_progress(stats):
+            def update():
+                self.set_state(export = {
+                    **self.state['export'],
+                    'progress': stats['frame'],
+                    'fps': stats['fps'],
+                    'MB/s': stats['MB/s']
+                })
+            inmain_later(update)
+
         def run():
-            ext = str(Path(filename).suffix)
-            path = str(Path(Path(filename).parent, Path(filename).stem))
-            assert ext in {'.mp4', '.jpg'}
-
-            first_frame, last_frame = self.state['range']
-            duration = last_frame-first_frame
-            fps = self.state['fps']
-            lut = self.state['lut_path'] if self.state['lut_enabled'] else None
-            process_desc = ProcessDesc(frame=first_frame, path=self.state['path'], downsample="full", lut=lut)
-            height, width, channels = self.evaluate(process_desc).shape
-
-            IsSequence = ext == ".jpg"
-            IsMovie = ext == ".mp4"
-
-            if IsSequence:
-                for frame in range(first_frame, last_frame+1):
-                    progress = int(100*(frame-first_frame)/(last_frame-first_frame))
-
-                    process_desc = ProcessDesc(frame=frame, path=self.state['path'], downsample="full", lut=lut)
-                    rgb = self.evaluate(process_desc).copy()
-                    assert rgb.shape == (height, width, channels)
-                    # bgr = rgb[...,::-1].copy()
-                    
-                    frame_filename = path+("%05d" % frame)+ext
-                    print("create output", frame_filename)
-                    out = oiio.ImageOutput.create(frame_filename)
-                    if not out:
-                        print(ext, "format is not supported")
-                        return
-                    spec = oiio.ImageSpec(width, height, channels, oiio.TypeUInt8)
-
-                    print("wrtie image")
-                    out.open(frame_filename, spec)
-                    out.write_image(rgb)
-                    out.close()
-
-                    # update state
-                    self.set_state(export= {
-                        'visible': self.state['export']['visible'],
-                        'filename': filename,
-                        'progress': frame
-                    })
-
-            if IsMovie:
-                fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-                writer = cv2.VideoWriter(filename,fourcc, fps or 24, (width, height))
-                for frame in range(first_frame, last_frame+1):
-                    progress = int(100*(frame-first_frame)/(last_frame-first_frame))
-                    process_desc = ProcessDesc(frame=frame, path=self.state['path'], downsample="full", lut=lut)
-                    rgb = self.evaluate(process_desc).copy()
-                    bgr = rgb[...,::-1].copy()
-
-                    writer.write(bgr)
-
-                    # update state
-                    self.set_state(export= {
-                        'visible': self.state['export']['visible'],
-                        'filename': filename,
-                        'progress': frame
-                    })
-                writer.release()
-
-        the_thread = threading.Thread(target=run, daemon=True).start()
+            try:
+                if segments > 1:
+                    # the worker processes load the keyframe index from the disk cache, instead of each demuxing the file
+                    self._reader.wait_for_index()
+                    # in worker processes, the cores are split between them
+                    evaluate = ProcessEvaluator(threads=max(1, self.frame_server.threads//segments))
+                    stats = run_segments(evaluate, keys, filename, fps=fps, segments=segments,
+                        progress=update_progress, cancel=self._export_cancel, **options)
+                else:
+                    # low priority jobs of the frame server, cached frames are used as they are
+                    stats = run_export(None, keys, filename, fps=fps, submit=self.frame_server.submit,
+                        workers=self.frame_server.workers, progress=update_progress, cancel=self._export_cancel,
+                        **options)
+                print("export done", stats)
+            except Exception as err:
+                print("export failed", err)
+
+        threading.Thread(target=run, daemon=True).start()
 
     def fit(self):
         # image in viewer
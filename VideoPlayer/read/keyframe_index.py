@@ -0,0 +1,143 @@
+import os
+import json
+import bisect
+import hashlib
+import threading
+from pathlib import Path
+from typing import *
+
+import cv2
+
+from .user_cache import user_cache_dir
+
+""" keyframe index
+CAP_PROP_FRAME_COUNT is only an estimate, and CAP_PROP_POS_FRAMES seeks are
+slow and sometimes inexact on long-GOP video. The index demuxes the file once
+without decoding (raw stream mode), to record the keyframe positions and the
+exact frame count. The result is cached on disk, keyed by the file size and
+modification time, so the next open of the same file is instant.
+The readers of a file share one index, see shared_keyframe_index, so it is
+demuxed once however many readers open it.
+"""
+
+class KeyframeIndex:
+    def __init__(self, path:str, cache_dir:Optional[str]=None):
+        self._path = str(Path(path).resolve())
+        self._cache_dir = Path(cache_dir) if cache_dir else user_cache_dir()/"keyframes"
+
+        self.keyframes:List[int] = []
+        self.frame_count:Optional[int] = None
+        self.ready = threading.Event()
+        self._worker = None
+        self._lock = threading.Lock() # of _worker
+        self._build_lock = threading.Lock()
+
+    @property
+    def cache_path(self)->Path:
+        name = hashlib.sha1(self._path.encode("utf-8")).hexdigest()
+        return self._cache_dir/(name+".json")
+
+    def _signature(self)->Tuple[int, int]:
+        stat = os.stat(self._path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def load(self)->bool:
+        """load the index from the disk cache, if it matches the file"""
+        try:
+            data = json.loads(self.cache_path.read_text())
+            if (data['size'], data['mtime']) != self._signature():
+                return False
+            keyframes = [int(frame) for frame in data['keyframes']]
+            frame_count = int(data['frame_count'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return False # missing or malformed, rebuilt like a miss
+
+        self.keyframes = keyframes
+        self.frame_count = frame_count
+        self.ready.set()
+        return True
+
+    def save(self)->None:
+        size, mtime = self._signature()
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            self.cache_path.write_text(json.dumps({
+                'path': self._path,
+                'size': size,
+                'mtime': mtime,
+                'frame_count': self.frame_count,
+                'keyframes': self.keyframes
+            }))
+        except OSError as err:
+            print("cant save keyframe index", err)
+
+    def build(self)->bool:
+        """demux the whole file and record keyframes, without decoding.
+        Concurrent calls demux once, the others wait for it."""
+        with self._build_lock:
+            if self.ready.is_set():
+                return True
+            cap = cv2.VideoCapture(self._path)
+            # raw mode: grab() returns encoded packets (FFmpeg backend only)
+            if not cap.set(cv2.CAP_PROP_FORMAT, -1):
+                cap.release()
+                return False
+
+            keyframes = []
+            frame = 0
+            while cap.grab():
+                if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                    keyframes.append(frame)
+                frame+=1
+            cap.release()
+
+            if not keyframes:
+                return False
+
+            self.keyframes = keyframes
+            self.frame_count = frame
+            self.save()
+            self.ready.set()
+            return True
+
+    def build_async(self)->None:
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self.build, daemon=True)
+                self._worker.start()
+
+    def load_or_build_async(self)->None:
+        """load the index from the disk cache, or build it in the background, once"""
+        with self._lock:
+            if self._worker is not None or self.ready.is_set() or self.load():
+                return
+        self.build_async()
+
+    def wait(self, timeout:Optional[float]=None)->bool:
+        """wait for a build in the background to finish. Returns whether the index is ready"""
+        with self._lock:
+            worker = self._worker
+        if worker is not None:
+            worker.join(timeout)
+        return self.ready.is_set()
+
+    def keyframe_before(self, frame:int)->Optional[int]:
+        """the nearest keyframe at or before frame, None while the index is not ready"""
+        if not self.ready.is_set():
+            return None
+        idx = bisect.bisect_right(self.keyframes, frame)
+        return self.keyframes[max(idx-1, 0)]
+
+
+_indexes:Dict[Tuple[str, int, int], KeyframeIndex] = dict()
+_indexes_lock = threading.Lock()
+
+def shared_keyframe_index(path:str)->KeyframeIndex:
+    """return the index of path shared by its readers, loaded from the disk
+    cache or built once in the background. A changed file gets a new index."""
+    index = KeyframeIndex(path)
+    key = (index._path,)+index._signature()
+    with _indexes_lock:
+        index = _indexes.setdefault(key, index)
+    index.load_or_build_async()
+    return index
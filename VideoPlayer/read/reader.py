@@ -11,6 +11,13 @@ import string
 
 import OpenImageIO as oiio
 
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .keyframe_index import KeyframeIndex, shared_keyframe_index
+from .video_decoder import VideoDecoder
+from .sequence_index import sequence_index
+
 """ sequence
 getFileNameList: return a list of filesin a folder.
 concatenating sequences like so:
@@ -40,31 +47,100 @@ def parse_sequence(path: str)->Tuple[str,int,int]:
       sequence_path in format: {folder}/{filename}d{5}.{ext}
       return (sequence_path, first_frame, last_frame)
     """
-    folder, name = os.path.split(path)
-    base, ext = os.path.splitext(name)
-    folder = os.path.dirname(path)
-    base_no_digits = base.rstrip(string.digits)
-    digits_length = len(base)-len(base_no_digits)
-    digits_match = "d{"+str(digits_length)+"}"
+    index = sequence_index(path)
+    return index.sequence_path, index.first_frame, index.last_frame
+
+
+# OpenImageIO pixel type names of the supported dtypes
+OIIO_TYPES = {
+    np.dtype(np.uint8): "uint8",
+    np.dtype(np.uint16): "uint16",
+    np.dtype(np.float16): "half",
+    np.dtype(np.float32): "float"
+}
+
+STRIP_HEIGHT = 64 # scanlines per read
+
+def read_scanlines(inputImage:oiio.ImageInput, miplevel:int, out:np.ndarray, cancel:Optional[np.ndarray]=None)->bool:
+    """read the data window of the image in strips of scanlines into out, in
+    the dtype of out. Tiled images, eg. MIP-mapped EXR or TIFF, are read in
+    strips of whole rows of tiles. Checks the cancel flag between strips.
+    Return False when the read failed or was cancelled."""
+    spec = inputImage.spec()
+    height = out.shape[0]
+    channels = min(spec.nchannels, out.shape[2])
+    pixel_type = OIIO_TYPES[out.dtype]
+    strip_height = STRIP_HEIGHT
+    if spec.tile_width:
+        strip_height = max(1, STRIP_HEIGHT//spec.tile_height)*spec.tile_height
+    for y in range(0, height, strip_height):
+        if cancel is not None and cancel[0]:
+            return False
+        yend = min(y+strip_height, height)
+        if spec.tile_width:
+            pixels = inputImage.read_tiles(0, miplevel, spec.x, spec.x+spec.width, spec.y+y, spec.y+yend,
+                spec.z, spec.z+max(spec.depth, 1), 0, channels, pixel_type)
+        else:
+            pixels = inputImage.read_scanlines(0, miplevel, spec.y+y, spec.y+yend, spec.z, 0, channels, pixel_type)
+        if pixels is None:
+            print("cant read", inputImage.geterror())
+            return False
+        out[y:yend, :, :channels] = pixels.reshape(yend-y, spec.width, channels)
+    return True
+
+# the value of white in each pixel type, floats are normalized to 0-1
+WHITE = {
+    np.dtype(np.uint8): 255,
+    np.dtype(np.uint16): 65535,
+    np.dtype(np.float16): 1.0,
+    np.dtype(np.float32): 1.0
+}
+
+def convert_pixels(rgb:np.ndarray, dtype, out:Optional[np.ndarray]=None)->np.ndarray:
+    """convert pixels between the supported types, in a single pass where possible.
+    Converting to fewer bits rounds and clips, like OpenImageIO does."""
+    dtype = np.dtype(dtype)
+    if out is None:
+        if rgb.dtype == dtype:
+            return rgb
+        out = np.empty(rgb.shape, dtype=dtype)
 
-    name_pattern = f"{base_no_digits}\{digits_match}\{ext}$"
+    scale = WHITE[dtype]/WHITE[rgb.dtype] # eg. 255*257 = 65535
+    if dtype.kind == 'u' and (rgb.dtype.kind == 'f' or scale < 1):
+        scaled = np.multiply(rgb, scale, dtype=np.float32)
+        np.clip(scaled, 0, WHITE[dtype], out=scaled)
+        np.rint(scaled, out=out, casting='unsafe')
+    else:
+        np.multiply(rgb, scale, out=out, casting='unsafe')
+    return out
 
-    files = sorted( [f for f in os.listdir(folder) if re.match(name_pattern, f)] )
-    first_file = os.path.splitext(files[0])[0]
-    last_file = os.path.splitext(files[-1])[0]
-    first_frame = int(first_file[-digits_length:])
-    last_frame = int(last_file[-digits_length:])
 
-    # compose sequence path eg: folder/filename_%5d.jpg
-    sequence_path = f"{folder}/{base_no_digits}%0{digits_length}d{ext}"
+# JPEG DCT scaling, decodes the reduced image directly
+JPEG_REDUCED_MODES = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
 
-    # return sequence metadata
-    return sequence_path, first_frame, last_frame
+def shrink(rgb:np.ndarray, factor:int)->np.ndarray:
+    """nearest neighbour downsample to (height//factor, width//factor), for any dtype"""
+    height, width = rgb.shape[0]//factor*factor, rgb.shape[1]//factor*factor
+    return np.ascontiguousarray(rgb[:height:factor, :width:factor])
 
 
 from pathlib import Path
 class Reader:
-    def __init__(self, path):
+    def __init__(self, path, max_skip:int=32, keyframe_index:bool=True, decoders:int=1):
+        """
+        max_skip: when the requested video frame is at most this many frames
+          ahead of the decoder, decode forward with grab() instead of seeking
+        keyframe_index: load or build (in the background) the keyframe index
+          of video files, to seek to keyframes and to know the exact frame count.
+          The readers of a file share it.
+        decoders: number of capture handles on a video file. Each read goes to
+          the handle closest to the frame, so handles stay parked in different
+          GOP regions, and reads from different threads decode in parallel.
+        """
         self._is_sequence = is_sequence(path)
         self._path = path
         assert Path(path).exists()
@@ -74,14 +150,18 @@ class Reader:
             self._image = oiio.ImageInput.open(path)
             self._is_sequence = True
 
-            # get metadata
-            sequence_path, first_frame, last_frame = parse_sequence(self._path)
-            self._sequence_path = sequence_path
-            self._first_frame = first_frame
-            self._last_frame = last_frame
+            # get metadata, the frame range is the index's
+            self._sequence = sequence_index(self._path)
             self._fps = None
             self._width = self._image.spec().width
             self._height = self._image.spec().height
+            native = {name: dtype for dtype, name in OIIO_TYPES.items()}
+            self._dtype = native.get(str(self._image.spec().format), np.dtype(np.float32))
+            # reduced reads decode JPEG DCT scaled, or read a MIP level
+            IsJpeg = os.path.splitext(path)[1].lower() in {'.jpg', '.jpeg'}
+            IsMipmapped = self._image.seek_subimage(0, 1)
+            self._image.seek_subimage(0, 0)
+            self._reduces_by_shrink = not IsJpeg and not IsMipmapped
         
         else:
             # VIDEO FILE
@@ -95,37 +175,163 @@ class Reader:
             self._fps = self._cap.get(cv2.CAP_PROP_FPS)
             self._width = int( self._cap.get(cv2.CAP_PROP_FRAME_WIDTH) )
             self._height = int( self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT) )
-            
-    def read(self, frame: int)->np.ndarray:
-        if frame < self._first_frame:
-            frame = self._first_frame
+            self._dtype = np.dtype(np.uint8)
+            self._reduces_by_shrink = True
+
+            # keyframe index, without it an empty one that is not built
+            self._index = shared_keyframe_index(path) if keyframe_index else KeyframeIndex(path)
+
+            # decoder pool, the first decoder reuses the metadata capture
+            self._decoders = [VideoDecoder(path, self._index, max_skip) for i in range(max(decoders, 1))]
+            self._decoders[0]._cap = self._cap
+            self._pool_lock = threading.Lock()
+
+    @property
+    def stats(self)->dict:
+        """profile: seeks vs. sequential decodes, and frames skipped with grab()"""
+        stats = {'seek': 0, 'sequential': 0, 'grab': 0}
+        if not self._is_sequence:
+            for decoder in self._decoders:
+                for key, value in decoder.stats.items():
+                    stats[key]+=value
+        return stats
 
-        if frame > self._last_frame:
-            frame = self._last_frame
+    def _acquire_decoder(self, frame:int)->VideoDecoder:
+        """lock and return the decoder that reaches frame the cheapest.
+        Prefer idle decoders, and when all of them have to seek, take the least
+        recently used one, to keep the others parked where they are"""
+        with self._pool_lock:
+            ranked = sorted(self._decoders, key=lambda decoder: (decoder.cost(frame), decoder.last_used))
+            for decoder in ranked:
+                if decoder.lock.acquire(blocking=False):
+                    return decoder
+        decoder = ranked[0]
+        decoder.lock.acquire()
+        return decoder
+
+    def _clamp(self, frame:int)->int:
+        if frame < self.first_frame:
+            frame = self.first_frame
+
+        if frame > self.last_frame:
+            frame = self.last_frame
+        return frame
+
+    def read(self, frame: int, dtype=np.uint8, downsample:int=1, cancel:Optional[np.ndarray]=None)->np.ndarray:
+        """read frame as RGB pixels of dtype. Floats are normalized to 0-1.
+        Sequences are decoded by OpenImageIO directly to dtype.
+        downsample: return (height//downsample, width//downsample) pixels.
+          Uses the reduced decoding of the format where it exists, JPEG DCT
+          scaling or a MIP level, and decodes then shrinks elsewhere.
+        cancel: optional one element flag, checked between scanline strips and
+          decoded video frames. When it is set the read is abandoned and None
+          is returned."""
+        frame = self._clamp(frame)
+        dtype = np.dtype(dtype)
+        size = (self._height//downsample, self._width//downsample)
 
         if self._is_sequence:
-            frame_path = self._sequence_path % frame
-            name, ext = os.path.splitext(frame_path)
+            frame_path = self._sequence.path(self._sequence.nearest(frame)) # hold over gaps
 
-            inputImage = oiio.ImageBuf( frame_path )
-            rgb = (inputImage.get_pixels()*255).astype(np.uint8)
-            # inputImage.close()
+            rgb = None
+            if downsample in JPEG_REDUCED_MODES and os.path.splitext(frame_path)[1].lower() in {'.jpg', '.jpeg'}:
+                bgr = cv2.imread(frame_path, JPEG_REDUCED_MODES[downsample])
+                if bgr is not None:
+                    rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+                    rgb = convert_pixels(rgb, dtype)
 
-            # 
-            rgb.flags.writeable = False
-            return rgb
+            if rgb is None:
+                inputImage = oiio.ImageInput.open(frame_path)
+                channels = min(inputImage.spec().nchannels, 3)
+                miplevel = 0
+                if downsample > 1:
+                    # find a MIP level of the reduced size, eg. tiled EXR or TIFF
+                    level = 1
+                    while inputImage.seek_subimage(0, level) and inputImage.spec().width >= size[1]:
+                        if (inputImage.spec().height, inputImage.spec().width) == size:
+                            miplevel = level
+                            break
+                        level+=1
+                inputImage.seek_subimage(0, miplevel)
+                spec = inputImage.spec()
+                # shrink in the source type, to convert fewer pixels
+                IsShrinking = miplevel == 0 and downsample > 1
+                rgb = np.empty((spec.height, spec.width, channels), dtype=self._dtype if IsShrinking else dtype)
+                IsComplete = read_scanlines(inputImage, miplevel, rgb, cancel)
+                inputImage.close()
+                if not IsComplete:
+                    return None
+                if IsShrinking:
+                    rgb = convert_pixels(shrink(rgb, downsample), dtype)
         else:
-            if self._cap.get(cv2.CAP_PROP_POS_FRAMES)!=frame:
-                self._cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
-            ret, bgr = self._cap.read()
-            
-            if ret:
-                rgb = bgr[...,::-1].copy()
-                rgb.flags.writeable = False
-                return rgb
-            else:
+            decoder = self._acquire_decoder(frame)
+            try:
+                rgb = decoder.read(frame, cancel=cancel)
+            finally:
+                decoder.lock.release()
+
+            if rgb is None:
                 return None
 
+            # shrink before converting, to convert fewer pixels
+            if downsample > 1:
+                rgb = shrink(rgb, downsample)
+            rgb = convert_pixels(rgb, dtype)
+
+        if rgb.shape[:2] != size:
+            # reduced decoders round the size up, crop to the exact size
+            rgb = np.ascontiguousarray(rgb[:size[0], :size[1]])
+        rgb.flags.writeable = False
+        return rgb
+
+    def read_into(self, frame: int, out:np.ndarray, cancel:Optional[np.ndarray]=None)->bool:
+        """decode frame into the caller supplied (height, width, 3) buffer.
+        The pixel type is taken from out. Sequences are read in strips of
+        scanlines, so no full frame temporary is allocated.
+        Return False when the read failed or was cancelled."""
+        frame = self._clamp(frame)
+        assert out.shape[:2] == (self._height, self._width)
+
+        if self._is_sequence:
+            frame_path = self._sequence.path(self._sequence.nearest(frame)) # hold over gaps
+
+            inputImage = oiio.ImageInput.open(frame_path)
+            if not inputImage:
+                return False
+            IsComplete = read_scanlines(inputImage, 0, out, cancel)
+            inputImage.close()
+            return IsComplete
+        else:
+            decoder = self._acquire_decoder(frame)
+            try:
+                if out.dtype == np.uint8:
+                    return decoder.read(frame, out=out, cancel=cancel) is not None
+                rgb = decoder.read(frame, cancel=cancel)
+            finally:
+                decoder.lock.release()
+
+            if rgb is None:
+                return False
+            convert_pixels(rgb, out.dtype, out=out)
+            return True
+
+    def read_many(self, frames:Iterable[int])->Iterator[Tuple[int, np.ndarray]]:
+        """read frames in order. Video frames are split into contiguous chunks,
+        one for each decoder, and the chunks are decoded on separate threads."""
+        frames = list(frames)
+        if self._is_sequence or len(self._decoders)==1:
+            for frame in frames:
+                yield frame, self.read(frame)
+            return
+
+        chunk_size = -(-len(frames)//len(self._decoders)) # ceil
+        chunks = [frames[i:i+chunk_size] for i in range(0, len(frames), chunk_size)]
+        with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+            futures = [executor.submit(lambda chunk: [self.read(frame) for frame in chunk], chunk) for chunk in chunks]
+            for chunk, future in zip(chunks, futures):
+                for frame, rgb in zip(chunk, future.result()):
+                    yield frame, rgb
+
     @property
     def width(self)->int:
         return self._width
@@ -134,17 +340,43 @@ class Reader:
     def height(self):
         return self._height
 
+    @property
+    def reduces_by_shrink(self)->bool:
+        """reduced reads are the nearest neighbour shrink of the full frame, so
+        a lower resolution can be derived from a higher one. Not for JPEG DCT
+        scaling and MIP levels, they filter."""
+        return self._reduces_by_shrink
+
+    @property
+    def dtype(self)->np.dtype:
+        """the pixel type of the source, eg. uint16 for 10 and 16 bit DPX"""
+        return self._dtype
+
     @property
     def first_frame(self)->int:
+        if self._is_sequence:
+            self._sequence.update_throttled() # frames rendered since it was opened
+            return self._sequence.first_frame
         return self._first_frame
 
     @property
     def last_frame(self)->int:
+        if self._is_sequence:
+            self._sequence.update_throttled() # frames rendered since it was opened
+            return self._sequence.last_frame
+        if self._index.ready.is_set():
+            return self._index.frame_count-1 # exact
         return self._last_frame
 
     @property
     def fps(self)->float:
         return self._fps
 
+    def wait_for_index(self, timeout:Optional[float]=None)->bool:
+        """wait for the keyframe index of a video to be built, eg. before other
+        processes open the file, they load it from the disk cache then.
+        Returns whether it is ready, always True for sequences."""
+        return self._is_sequence or self._index.wait(timeout)
+
     def __hash__(self):
         return hash(self.path)
@@ -0,0 +1,133 @@
+import os
+import re
+import time
+import bisect
+import string
+import threading
+from typing import *
+
+""" sequence index
+The frames of an image sequence, found by a single os.scandir pass over the
+folder. Indices are cached per folder and rescanned only when the folder's
+mtime changes. A rescan only matches the names it has not seen before.
+Readers check the folder again at most every UPDATE_INTERVAL, so a sequence
+that is still being rendered grows while it plays.
+"""
+
+UPDATE_INTERVAL = 1.0 # seconds between the folder checks of update_throttled
+
+class SequenceIndex:
+    def __init__(self, folder:str, prefix:str, digits:int, ext:str):
+        self.folder = folder
+        self.prefix = prefix
+        self.digits = digits
+        self.ext = ext
+        self._pattern = re.compile(re.escape(prefix)+r"(\d{"+str(digits)+"})"+re.escape(ext)+"$")
+
+        self._names:Dict[str, int] = dict() # file name -> frame
+        self.frames:List[int] = [] # sorted frame numbers
+        self._mtime = None
+        self._checked = None # time.monotonic() of the last check
+        self._lock = threading.Lock()
+
+    @property
+    def sequence_path(self)->str:
+        """in format: {folder}/{prefix}%0{digits}d{ext}"""
+        return f"{self.folder}/{self.prefix}%0{self.digits}d{self.ext}"
+
+    def update(self)->bool:
+        """rescan the folder if it changed since the last scan. Return True if it did."""
+        with self._lock:
+            self._checked = time.monotonic()
+            mtime = os.stat(self.folder).st_mtime_ns
+            if mtime == self._mtime:
+                return False
+
+            seen = set()
+            added = []
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    name = entry.name
+                    seen.add(name)
+                    if name in self._names:
+                        continue
+                    match = self._pattern.match(name)
+                    if match:
+                        self._names[name] = int(match.group(1))
+                        added.append(self._names[name])
+
+            removed = [name for name in self._names if name not in seen]
+            for name in removed:
+                del self._names[name]
+
+            if removed:
+                self.frames = sorted(self._names.values())
+            elif added:
+                added.sort()
+                if self.frames and added[0] < self.frames[-1]:
+                    self.frames = sorted(self.frames+added)
+                else:
+                    self.frames+=added # new frames rendered at the end
+
+            self._mtime = mtime
+            return bool(added or removed)
+
+    def update_throttled(self, interval:Optional[float]=None)->bool:
+        """update, unless the folder was checked less than interval seconds ago,
+        default UPDATE_INTERVAL. Cheap enough to call on every read."""
+        interval = UPDATE_INTERVAL if interval is None else interval
+        checked = self._checked
+        if checked is not None and time.monotonic()-checked < interval:
+            return False
+        try:
+            return self.update()
+        except OSError: # the folder is gone, keep the frames found so far
+            return False
+
+    @property
+    def first_frame(self)->int:
+        return self.frames[0]
+
+    @property
+    def last_frame(self)->int:
+        return self.frames[-1]
+
+    @property
+    def gaps(self)->List[Tuple[int, int]]:
+        """missing frame ranges as (first, last+1)"""
+        return [(a+1, b) for a, b in zip(self.frames, self.frames[1:]) if b-a > 1]
+
+    def __contains__(self, frame:int)->bool:
+        idx = bisect.bisect_left(self.frames, frame)
+        return idx < len(self.frames) and self.frames[idx] == frame
+
+    def __len__(self)->int:
+        return len(self.frames)
+
+    def nearest(self, frame:int)->int:
+        """the existing frame at or before frame, to hold the last frame over gaps"""
+        idx = bisect.bisect_right(self.frames, frame)
+        return self.frames[max(idx-1, 0)]
+
+    def path(self, frame:int)->str:
+        return self.sequence_path % frame
+
+
+_indices:Dict[Tuple[str, str, int, str], SequenceIndex] = dict()
+_indices_lock = threading.Lock()
+
+def sequence_index(path:str)->SequenceIndex:
+    """return the up to date, cached index of the sequence that path is a frame of"""
+    folder, name = os.path.split(path)
+    folder = folder or "."
+    base, ext = os.path.splitext(name)
+    prefix = base.rstrip(string.digits)
+    digits = len(base)-len(prefix)
+
+    key = (folder, prefix, digits, ext)
+    with _indices_lock:
+        if key not in _indices:
+            _indices[key] = SequenceIndex(folder, prefix, digits, ext)
+        index = _indices[key]
+    index.update()
+    return index
@@ -0,0 +1,8 @@
+import os
+from pathlib import Path
+
+
+def user_cache_dir()->Path:
+    """the cache folder of the player, shared by the keyframe indexes and the folded luts"""
+    root = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') or Path.home()/".cache"
+    return Path(root, "PyVideoPlayer")
@@ -0,0 +1,83 @@
+import time
+import threading
+from typing import *
+
+import cv2
+import numpy as np
+
+from .keyframe_index import KeyframeIndex
+
+
+class VideoDecoder:
+    """a single cv2.VideoCapture on a video file, that tracks its own position.
+    The capture is opened on first use. Hold `lock` while reading."""
+    def __init__(self, path:str, index:KeyframeIndex, max_skip:int=32):
+        self._path = path
+        self._index = index
+        self._max_skip = max_skip
+        self._cap = None
+        self._pos = 0 # the frame the next cap.read() returns, None if unknown
+
+        self.lock = threading.Lock()
+        self.last_used = 0.0
+
+        # profile: seeks vs. sequential decodes, and frames skipped with grab()
+        self.stats = {'seek': 0, 'sequential': 0, 'grab': 0}
+
+    @property
+    def cap(self)->cv2.VideoCapture:
+        if self._cap is None:
+            self._cap = cv2.VideoCapture(self._path)
+        return self._cap
+
+    def is_ahead(self, frame:int)->bool:
+        """can decode forward to frame without seeking.
+        With a keyframe index keep decoding forward unless there is a keyframe
+        between the decoder and the target"""
+        if self._pos is None or self._pos > frame:
+            return False
+        keyframe = self._index.keyframe_before(frame)
+        return self._pos+self._max_skip >= frame or (keyframe is not None and keyframe <= self._pos)
+
+    def cost(self, frame:int)->int:
+        """estimated number of frames to decode to reach frame,
+        a seek is counted as max_skip frames"""
+        if self.is_ahead(frame):
+            return frame-self._pos
+        keyframe = self._index.keyframe_before(frame)
+        return self._max_skip + (frame-keyframe if keyframe is not None else 0)
+
+    def read(self, frame:int, out:Optional[np.ndarray]=None, cancel:Optional[np.ndarray]=None)->Optional[np.ndarray]:
+        """decode frame as RGB uint8. Decode into out, when given.
+        Return None when the cancel flag is set while decoding forward."""
+        self.last_used = time.time()
+        if self.is_ahead(frame):
+            self.stats['sequential']+=1
+        else:
+            keyframe = self._index.keyframe_before(frame)
+            seek_frame = keyframe if keyframe is not None else frame
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, seek_frame)
+            self._pos = seek_frame
+            self.stats['seek']+=1
+
+        # decode forward to the requested frame
+        while self._pos < frame:
+            if cancel is not None and cancel[0]:
+                return None # the position is still known
+            if not self.cap.grab():
+                self._pos = None
+                return None
+            self._pos+=1
+            self.stats['grab']+=1
+
+        ret, bgr = self.cap.read(out)
+        self._pos = self._pos+1 if ret else None
+        if not ret:
+            return None
+
+        if out is not None:
+            return cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=out)
+
+        rgb = bgr[...,::-1].copy()
+        rgb.flags.writeable = False
+        return rgb
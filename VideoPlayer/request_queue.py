@@ -0,0 +1,65 @@
+import heapq
+import itertools
+from typing import *
+
+# request priorities, lower is served first
+VISIBLE = 0 # the frame on screen
+LOOKAHEAD = 1 # the prefetch window of playback or scrubbing
+BACKGROUND = 2 # cache fill while the workers are idle
+EXPORT = 3 # export and thumbnail frames
+
+
+class RequestQueue:
+    """Priority queue of unique requests. Requests of the same priority are
+    served first in, first out. Pushing a queued request again changes its
+    priority, in O(log n): the old heap entry is left in place and skipped
+    when popped. Not thread safe, guard it with the lock of the owner."""
+    def __init__(self):
+        self._heap:List[Tuple[int, int, Any]] = [] # (priority, order, key)
+        self._entries:Dict[Any, Tuple[int, int]] = dict() # key -> current (priority, order)
+        self._order = itertools.count()
+
+    def push(self, key, priority:int)->None:
+        """queue key, or move it to priority and to the back of that priority"""
+        entry = (priority, next(self._order))
+        self._entries[key] = entry
+        heapq.heappush(self._heap, (*entry, key))
+
+        # drop the stale entries, when they outnumber the live ones
+        if len(self._heap) > 2*len(self._entries)+64:
+            self._heap = [(*entry, key) for key, entry in self._entries.items()]
+            heapq.heapify(self._heap)
+
+    def pop(self)->Tuple[Any, int]:
+        """remove and return the (key, priority) served next"""
+        while self._heap:
+            priority, order, key = heapq.heappop(self._heap)
+            if self._entries.get(key) == (priority, order):
+                del self._entries[key]
+                return key, priority
+        raise IndexError("pop from an empty RequestQueue")
+
+    def remove(self, key)->None:
+        del self._entries[key]
+
+    def priority(self, key)->Optional[int]:
+        entry = self._entries.get(key)
+        return entry[0] if entry else None
+
+    def keys(self, priority:Optional[int]=None)->List:
+        """the queued keys in the order they are served, of priority or of all"""
+        entries = sorted((entry, key) for key, entry in self._entries.items() if priority is None or entry[0] == priority)
+        return [key for entry, key in entries]
+
+    def __contains__(self, key)->bool:
+        return key in self._entries
+
+    def __len__(self)->int:
+        return len(self._entries)
+
+    def __bool__(self)->bool:
+        return bool(self._entries)
+
+    def clear(self)->None:
+        self._heap.clear()
+        self._entries.clear()
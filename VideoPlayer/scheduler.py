@@ -0,0 +1,42 @@
+import math
+from typing import *
+
+
+class PrefetchScheduler:
+    """Which frames to keep cached around the playhead.
+    Playing forward or backward keeps a read-ahead window filled in the
+    playback direction, that wraps around at the in/out points like the
+    playback loop does. Paused or scrubbing keeps a small window on both sides.
+    """
+    def __init__(self, lookahead:float=2.0, scrub_radius:int=4):
+        self.lookahead = lookahead # seconds to read ahead while playing
+        self.scrub_radius = scrub_radius # frames on each side while paused or scrubbing
+
+    def window(self, frame:int, playback:str="paused", fps:Optional[float]=None,
+            inpoint:Optional[int]=None, outpoint:Optional[int]=None, max_frames:Optional[int]=None)->List[int]:
+        """the frames to prefetch in priority order, the playhead first"""
+        if playback == "forward":
+            count = math.ceil(self.lookahead*(fps or 24))
+            steps = range(0, count+1)
+        elif playback == "reverse":
+            count = math.ceil(self.lookahead*(fps or 24))
+            steps = range(0, -count-1, -1)
+        else:
+            steps = [0]
+            for i in range(1, self.scrub_radius+1):
+                steps+=[i, -i]
+
+        if max_frames is not None:
+            steps = steps[:max(max_frames, 1)]
+
+        IsLooping = inpoint is not None and outpoint is not None and inpoint <= frame <= outpoint
+        frames = []
+        for step in steps:
+            if IsLooping:
+                length = outpoint-inpoint+1
+                frames.append( inpoint+(frame-inpoint+step)%length )
+            else:
+                frames.append( frame+step )
+
+        # a short loop wraps onto itself
+        return list(dict.fromkeys(frames))
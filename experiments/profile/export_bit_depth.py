@@ -0,0 +1,40 @@
+""" high bit depth export benchmark
+export a graded range in each sample type, through the FrameServerCore, and
+time the image writes on one writer thread against a pool of them.
+run from the VideoPlayer folder:
+> python ../experiments/profile/export_bit_depth.py
+"""
+import os
+import sys
+import time
+import tempfile
+from pathlib import Path
+
+sys.path.append(".")
+from frame_server_core import FrameServerCore, ProcessDesc
+from export import run
+
+PATH = "../tests/resources/MASA_sequence/MASA_sequence_00196.jpg"
+LUT = "../tests/resources/AlexaV3_K1S1_LogC2Video_Rec709_EE_aftereffects3d.cube"
+FRAMES = range(196, 220)
+
+def main():
+    frame_server = FrameServerCore(workers=2)
+    frame_server.bake_in_background = False
+    writer_threads = max(4, os.cpu_count() or 1)
+
+    with tempfile.TemporaryDirectory() as folder:
+        for ext, dtype in [(".tif", "uint8"), (".tif", "uint16"), (".png", "uint16"), (".exr", "half"), (".dpx", "uint16")]:
+            keys = [ProcessDesc(frame=frame, path=PATH, downsample="full", lut=LUT, dtype=dtype) for frame in FRAMES]
+            for threads in [1, writer_threads]:
+                frame_server.clear_cache()
+                filename = str(Path(folder, dtype+ext))
+                stats = run(None, keys, filename, submit=frame_server.submit, workers=frame_server.workers, writer_threads=threads)
+                size = sum(path.stat().st_size for path in Path(folder).glob(dtype+"*"+ext))/len(keys)/1024/1024
+                print("{:<5} {:<7} {} writer threads: {:6.1f}fps {:6.1f}MB/s {:5.1f}MB per file".format(
+                    ext, dtype, threads, stats['fps'], stats['MB/s'], size))
+
+    frame_server.stop()
+
+if __name__ == "__main__":
+    main()
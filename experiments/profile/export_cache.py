@@ -0,0 +1,47 @@
+""" export through the FrameServer benchmark
+review a loop, so it is cached, then export it: the export uses the cached
+frames. Then export a range that is not cached, with a full cache, and check
+that the reviewed frames are still cached after it.
+run from the VideoPlayer folder:
+> python ../experiments/profile/export_cache.py
+"""
+import sys
+import time
+import tempfile
+from pathlib import Path
+
+sys.path.append(".")
+from PySide6.QtCore import QCoreApplication
+from frame_server import FrameServer, ProcessDesc
+from export import run
+
+PATH = "../tests/resources/MASA_sequence/MASA_sequence_00196.jpg"
+LUT = "../tests/resources/AlexaV3_K1S1_LogC2Video_Rec709_EE_aftereffects3d.cube"
+
+def main():
+    app = QCoreApplication.instance() or QCoreApplication()
+    frame_server = FrameServer(workers=2)
+    frame_server.memory_limit = 300 # MB, about 90 processed frames
+    loop = [ProcessDesc(frame=frame, path=PATH, downsample="full", lut=LUT) for frame in range(196, 236)]
+    other = [ProcessDesc(frame=frame, path=PATH, downsample="full", lut=LUT) for frame in range(236, 296)]
+
+    # review the loop
+    begin = time.perf_counter()
+    for key in loop:
+        frame_server.submit(key, priority=1).result()
+    print("review {} frames:      {:6.2f}s".format(len(loop), time.perf_counter()-begin))
+    reviewed = set(frame_server)
+
+    with tempfile.TemporaryDirectory() as folder:
+        filename = str(Path(folder, "export.jpg"))
+        for name, keys in [("export the loop", loop), ("export other frames", other)]:
+            begin = time.perf_counter()
+            stats = run(None, keys, filename, submit=frame_server.submit, workers=frame_server.workers)
+            print("{:<20} {:6.2f}s {:6.1f}fps".format(name, time.perf_counter()-begin, stats['fps']))
+
+    print("reviewed frames still cached: {}/{}".format(len(reviewed & set(frame_server)), len(reviewed)))
+    print("cache: {:.0f}MB of {}MB".format(frame_server.used_memory(), frame_server.memory_limit))
+    frame_server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+""" export benchmark
+the previous sequential export (evaluate, then write, one frame at a time)
+against the pipeline in export.run, to a jpg sequence with a lut applied.
+run from the VideoPlayer folder:
+> python ../experiments/profile/export_pipeline.py
+"""
+import os
+import sys
+import time
+import tempfile
+from pathlib import Path
+
+sys.path.append(".")
+from PySide6.QtCore import QCoreApplication
+from frame_server import FrameServer, ProcessDesc
+from export import run, open_writer
+
+PATH = "../tests/resources/MASA_sequence/MASA_sequence_00196.jpg"
+LUT = "../tests/resources/AlexaV3_K1S1_LogC2Video_Rec709_EE_aftereffects3d.cube"
+
+def sequential(evaluate, keys, filename):
+    writer = None
+    for key in keys:
+        rgb = evaluate(key)
+        if writer is None:
+            writer = open_writer(filename, 24, rgb.shape[1], rgb.shape[0])
+        writer.write(key.frame, rgb)
+    writer.close()
+
+def main():
+    app = QCoreApplication.instance() or QCoreApplication()
+    frame_server = FrameServer(workers=1)
+    frame_server.lut_table_bytes = 0 # the float lut path, the heavier one
+    def evaluate(key):
+        return frame_server.evaluate(key)
+
+    keys = [ProcessDesc(frame=frame, path=PATH, downsample="full", lut=LUT) for frame in range(196, 246)]
+    evaluate(keys[0]) # warm up
+    print("cores:", os.cpu_count())
+    with tempfile.TemporaryDirectory() as folder:
+        filename = str(Path(folder, "export.jpg"))
+        modes = {
+            "sequential": lambda: sequential(evaluate, keys, filename),
+            "pipeline 1 worker": lambda: run(evaluate, keys, filename, workers=1),
+            "pipeline {} workers".format(os.cpu_count()): lambda: run(evaluate, keys, filename),
+        }
+        for name, function in modes.items():
+            frame_server.clear_cache()
+            begin = time.perf_counter()
+            function()
+            seconds = time.perf_counter()-begin
+            print("{:<22} {:6.1f}fps".format(name, len(keys)/seconds))
+
+    frame_server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+""" segment parallel export benchmark
+one export pipeline against segments in worker processes, to a jpg sequence
+with a lut applied. Movies are joined with ffmpeg, when it is installed.
+run from the VideoPlayer folder:
+> python ../experiments/profile/export_segments.py [filename]
+"""
+import os
+import sys
+import time
+import tempfile
+from pathlib import Path
+
+sys.path.append(".")
+from frame_server_core import ProcessDesc, ProcessEvaluator
+from export import run, run_segments
+
+PATH = "../tests/resources/MASA_sequence/MASA_sequence_00196.jpg"
+LUT = "../tests/resources/AlexaV3_K1S1_LogC2Video_Rec709_EE_aftereffects3d.cube"
+
+def main():
+    keys = [ProcessDesc(frame=frame, path=PATH, downsample="full", lut=LUT) for frame in range(196, 296)]
+    cores = os.cpu_count()
+    print("cores:", cores)
+    with tempfile.TemporaryDirectory() as folder:
+        filename = sys.argv[1] if len(sys.argv) > 1 else str(Path(folder, "export.jpg"))
+        modes = {"pipeline": lambda: run(ProcessEvaluator(threads=cores), keys, filename, workers=cores)}
+        for segments in sorted({2, cores}):
+            modes["segments={}".format(segments)] = lambda segments=segments: run_segments(
+                ProcessEvaluator(threads=max(1, cores//segments)), keys, filename, segments=segments)
+        for name, function in modes.items():
+            begin = time.perf_counter()
+            function()
+            print("{:<12} {:6.1f}fps".format(name, len(keys)/(time.perf_counter()-begin)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+""" FrameServer benchmark
+request_frame to frame_done latency, and the CPU time the workers burn while idle.
+run from the VideoPlayer folder:
+> python ../experiments/profile/frame_server_latency.py
+"""
+import sys
+import time
+import random
+import threading
+import numpy as np
+
+sys.path.append(".")
+from PySide6.QtCore import QCoreApplication, Qt
+from frame_server import FrameServer, ProcessDesc
+
+PATH = "../tests/resources/MASA_sequence/MASA_sequence_00196.jpg"
+
+def idle_cpu(frame_server, seconds=2.0)->float:
+    """process CPU time per wall second, with nothing requested"""
+    time.sleep(0.5) # settle
+    begin_cpu, begin = time.process_time(), time.time()
+    time.sleep(seconds)
+    return (time.process_time()-begin_cpu) / (time.time()-begin)
+
+def latency(frame_server, frames)->np.ndarray:
+    done = threading.Event()
+    wanted = None
+    @frame_server.frame_done.connect
+    def _(key):
+        if key == wanted:
+            done.set()
+
+    times = []
+    for frame in frames:
+        wanted = ProcessDesc(frame=frame, path=PATH, downsample="full")
+        done.clear()
+        begin = time.time()
+        frame_server.request_frame(wanted)
+        while not done.wait(0.001):
+            QCoreApplication.processEvents()
+        times.append(time.time()-begin)
+    return np.array(times)
+
+def main():
+    app = QCoreApplication.instance() or QCoreApplication()
+    frame_server = FrameServer()
+    frame_server.memory_limit = 10000
+
+    print("idle cpu: {:.0%} of a core".format(idle_cpu(frame_server)))
+
+    random.seed(0)
+    frames = random.sample(range(196, 301), 40)
+    times = latency(frame_server, frames)
+    print("latency: median {:.1f}ms, p90 {:.1f}ms".format(np.median(times)*1000, np.percentile(times, 90)*1000))
+
+if __name__ == "__main__":
+    main()
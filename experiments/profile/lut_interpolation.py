@@ -0,0 +1,53 @@
+""" LUT interpolation benchmark
+speed and accuracy of trilinear vs. tetrahedral interpolation, on 17, 33 and
+65 point cubes sampled from a known transform. The error is measured against
+the transform itself, in 10 bit code values. The transform keeps grays neutral,
+the gray tint is the largest channel spread the interpolation adds to grays.
+run from the VideoPlayer folder:
+> python ../experiments/profile/lut_interpolation.py
+"""
+import sys
+import time
+import numpy as np
+
+sys.path.append(".")
+from LUT import apply_lut
+
+def transform(rgb:np.ndarray)->np.ndarray:
+    """a smooth grade: a cross talk matrix, and a contrast curve.
+    The matrix rows sum to one, grays stay gray."""
+    matrix = np.array([
+        [0.80, 0.15, 0.05],
+        [0.10, 0.75, 0.15],
+        [0.05, 0.25, 0.70]], dtype=np.float32)
+    rgb = rgb @ matrix.T
+    return rgb*1.25 / (rgb+0.25) # 0->0, 1->1
+
+def sample_cube(size:int)->np.ndarray:
+    """the transform at size^3 lattice points, indexed [blue, green, red] like .cube files"""
+    b, g, r = np.meshgrid(*[np.linspace(0, 1, size, dtype=np.float32)]*3, indexing="ij")
+    return np.ascontiguousarray(transform(np.stack([r, g, b], axis=-1)).astype(np.float32))
+
+def main():
+    rng = np.random.default_rng(0)
+    pixels = rng.random((1080, 1920, 3), dtype=np.float32)
+    grays = np.repeat(rng.random((1, 4096, 1), dtype=np.float32), 3, axis=2)
+    exact = transform(pixels)
+
+    print("{:>5} {:<12} {:>9} {:>9} {:>9} {:>10}".format("cube", "mode", "ms/HD", "mean", "max", "gray tint"))
+    for size in [17, 33, 65]:
+        lut = sample_cube(size)
+        for interpolation in ["trilinear", "tetrahedral"]:
+            apply_lut(pixels, lut, interpolation=interpolation) # warm up
+            begin = time.perf_counter()
+            result = apply_lut(pixels, lut, interpolation=interpolation)
+            seconds = time.perf_counter()-begin
+
+            error = np.abs(result-exact)*1023
+            graded_grays = apply_lut(grays, lut, interpolation=interpolation)
+            tint = (graded_grays.max(axis=2)-graded_grays.min(axis=2))*1023
+            print("{:>5} {:<12} {:>9.1f} {:>9.3f} {:>9.3f} {:>10.3f}".format(
+                size, interpolation, seconds*1000, error.mean(), error.max(), tint.max()))
+
+if __name__ == "__main__":
+    main()
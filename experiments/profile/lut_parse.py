@@ -0,0 +1,53 @@
+""" .cube parsing benchmark
+reading a 65 point cube with the previous line by line parser, the numpy parser,
+and from the on disk cache.
+run from the VideoPlayer folder:
+> python ../experiments/profile/lut_parse.py
+"""
+import sys
+import time
+import tempfile
+from pathlib import Path
+import numpy as np
+
+sys.path.append(".")
+from LUT import read_lut
+
+def read_lut_lines(path):
+    """the previous parser"""
+    data = []
+    for line in Path(path).read_text().split("\n"):
+        if line.strip() == "" or line[0] == "#":
+            continue
+        elif line.split()[0] == "LUT_3D_SIZE":
+            size = int(line.split()[1])
+        else:
+            data.append([float(part) for part in line.split()])
+    return np.array(data).reshape(size, size, size, 3).astype(np.float32)
+
+def main():
+    folder = tempfile.TemporaryDirectory()
+    size = 65
+    b, g, r = np.meshgrid(*[np.linspace(0, 1, size)]*3, indexing="ij")
+    table = np.stack([r, g, b], axis=-1).reshape(-1, 3)**(1/2.2)
+    path = Path(folder.name, "gamma65.cube")
+    path.write_text("LUT_3D_SIZE {}\n".format(size) + "\n".join("{:.6f} {:.6f} {:.6f}".format(*row) for row in table))
+    cache_dir = Path(folder.name, "cache")
+
+    modes = {
+        "line by line": lambda: read_lut_lines(path),
+        "numpy":        lambda: read_lut(path),
+        "cached":       lambda: read_lut(path, cache_dir=cache_dir),
+    }
+    read_lut(path, cache_dir=cache_dir) # fill the cache
+    for name, function in modes.items():
+        times = []
+        for i in range(5):
+            begin = time.perf_counter()
+            function()
+            times.append(time.perf_counter()-begin)
+        print("{:<14} {:8.1f}ms".format(name, np.median(times)*1000))
+    folder.cleanup()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+""" LUT kernel benchmark
+time of a 4K LUT pass by thread count. Scales with the cores when the
+extension was built with OpenMP, see setup.py.
+run from the VideoPlayer folder:
+> python ../experiments/profile/lut_threads.py
+"""
+import sys
+import os
+import time
+import numpy as np
+
+sys.path.append(".")
+from LUT import read_lut, apply_lut
+
+LUT = "../tests/resources/AlexaV3_K1S1_LogC2Video_Rec709_EE_aftereffects3d.cube"
+
+def main():
+    lut = read_lut(LUT)
+    pixels = np.random.default_rng(0).random((2160, 3840, 3), dtype=np.float32)
+    apply_lut(pixels, lut) # warm up
+
+    threads = [1]
+    while threads[-1]*2 <= os.cpu_count():
+        threads.append(threads[-1]*2)
+    if threads[-1] != os.cpu_count():
+        threads.append(os.cpu_count())
+
+    single = None
+    for num_threads in threads:
+        times = []
+        for i in range(3):
+            begin = time.perf_counter()
+            apply_lut(pixels, lut, None, num_threads)
+            times.append(time.perf_counter()-begin)
+        seconds = min(times)
+        single = single or seconds
+        print("{:>3} threads: {:6.1f}ms  {:4.1f}x".format(num_threads, seconds*1000, single/seconds))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+""" FrameServer.evaluate benchmark
+per frame time and peak memory of the 8 bit path (no lut) and the float path (lut),
+against the previous pipeline that was float all the way.
+run from the VideoPlayer folder:
+> python ../experiments/profile/pipeline_precision.py
+"""
+import sys
+import time
+import tracemalloc
+import numpy as np
+import cv2
+
+sys.path.append(".")
+from PySide6.QtCore import QCoreApplication
+from frame_server import FrameServer, ProcessDesc, create_reader_cached
+
+PATH = "../tests/resources/MASA_sequence/MASA_sequence_00196.jpg"
+LUT = "../tests/resources/AlexaV3_K1S1_LogC2Video_Rec709_EE_aftereffects3d.cube"
+CORNERS = ((20, 10), (1260, 0), (1280, 720), (0, 700))
+
+def float_reference(key:ProcessDesc)->np.ndarray:
+    """read, warp and convert in float32, like before the 8 bit path"""
+    reader = create_reader_cached(key.path)
+    data = reader.read(key.frame, dtype=np.float32)
+    if key.corners is not None:
+        h,w,c = data.shape
+        src_pts = np.array([(0,0),(w,0),(w,h),(0,h)], dtype=np.float32)
+        M = cv2.getPerspectiveTransform(src_pts, np.array(key.corners, dtype=np.float32))
+        data = cv2.warpPerspective(data, M, (w,h))
+    return (data*255).astype(np.uint8)
+
+def measure(evaluate, keys)->tuple:
+    """median seconds per frame, and peak traced memory in MB"""
+    times = []
+    tracemalloc.start()
+    for key in keys:
+        begin = time.perf_counter()
+        evaluate(key)
+        times.append(time.perf_counter()-begin)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return np.median(times), peak/1024/1024
+
+def main():
+    app = QCoreApplication.instance() or QCoreApplication()
+    frame_server = FrameServer(workers=1)
+    def evaluate(key):
+        pixels = frame_server.evaluate(key)
+        frame_server.clear_cache() # no stage results are reused, every frame is evaluated
+        return pixels
+
+    frames = range(196, 226)
+    modes = {
+        "float reference":      (float_reference, dict()),
+        "float reference+pin":  (float_reference, dict(corners=CORNERS)),
+        "uint8 (no lut)":       (evaluate, dict()),
+        "uint8 (no lut)+pin":   (evaluate, dict(corners=CORNERS)),
+        "float32 (lut)":        (evaluate, dict(lut=LUT)),
+        "float32 (lut)+pin":    (evaluate, dict(lut=LUT, corners=CORNERS)),
+    }
+    measure(evaluate, [ProcessDesc(frame=196, path=PATH, downsample="full", lut=LUT)]) # warm up
+
+    for name, (function, fields) in modes.items():
+        keys = [ProcessDesc(frame=frame, path=PATH, downsample="full", **fields) for frame in frames]
+        seconds, peak = measure(function, keys)
+        print("{:<22} {:6.1f}ms/frame  peak {:6.1f}MB".format(name, seconds*1000, peak))
+
+    frame_server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,40 @@
-from setuptools import setup
+from setuptools import setup, Extension
+from setuptools.command.build_ext import build_ext
+from setuptools.errors import CompileError, LinkError
 from Cython.Build import cythonize
 import numpy
 
-setup(
-    name='VideoPlayer',
-    ext_modules=cythonize("VideoPlayer/LUT/apply_lut_cython.pyx"),
-    include_dirs=[numpy.get_include()],
-    zip_safe=False,
-    language_level=3
-)
+# compiler and linker flags of OpenMP, per compiler type
+OPENMP_FLAGS = {
+    'unix': (["-fopenmp"], ["-fopenmp"]),
+    'mingw32': (["-fopenmp"], ["-fopenmp"]),
+    'msvc': (["/openmp"], [])
+}
 
-# from distutils.core import setup
-# from Cython.Build import cythonize
-# from distutils.extension import Extension
-# from Cython.Distutils import build_ext
+class build_ext_openmp(build_ext):
+    """build with OpenMP, and single threaded where the compiler has no OpenMP,
+    eg. Apple clang"""
+    def build_extension(self, ext):
+        compile_args, link_args = OPENMP_FLAGS.get(self.compiler.compiler_type, ([], []))
+        ext.extra_compile_args+=compile_args
+        ext.extra_link_args+=link_args
+        try:
+            super().build_extension(ext)
+        except (CompileError, LinkError):
+            print("OpenMP is not available, building {} single threaded".format(ext.name))
+            ext.extra_compile_args = [arg for arg in ext.extra_compile_args if arg not in compile_args]
+            ext.extra_link_args = [arg for arg in ext.extra_link_args if arg not in link_args]
+            super().build_extension(ext)
 
-# ext_modules=[
-#     Extension("VideoPlayer",
-#               ["./VideoPlayer/LUT/apply_lut_cython.pyx"],
-#               # libraries=["m"],
-#               extra_compile_args = ["-O2", "-ffast-math", "-march=native", "-fopenmp" ],
-#               extra_link_args=['-fopenmp']
-#               ) 
-# ]
+ext_modules = [
+    Extension("VideoPlayer.LUT.apply_lut_cython",
+        ["VideoPlayer/LUT/apply_lut_cython.pyx"],
+        include_dirs=[numpy.get_include()])
+]
 
-# setup( 
-# 	name = "VideoPlayer",
-# 	cmdclass = {"build_ext": build_ext},
-# 	ext_modules = ext_modules,
-# 	include_dirs=[numpy.get_include()],
-# 	# zip_safe=False,
-# 	# language_level=3
-# )
\ No newline at end of file
+setup(
+    name='VideoPlayer',
+    cmdclass={"build_ext": build_ext_openmp},
+    ext_modules=cythonize(ext_modules, compiler_directives={'language_level': 3}),
+    zip_safe=False
+)
@@ -0,0 +1,85 @@
+import unittest
+import sys
+import numpy as np
+sys.path.append('../')
+
+from VideoPlayer.LUT import read_lut, apply_lut, bake_lut, apply_baked_lut
+from VideoPlayer.LUT.bake_lut import baked_size, FULL_TABLE_BYTES
+
+def identity(size=17):
+	"""a 3D LUT that returns its input, red varies fastest like in .cube files"""
+	b, g, r = np.meshgrid(*[np.linspace(0, 1, size, dtype=np.float32)]*3, indexing="ij")
+	return np.ascontiguousarray(np.stack([r, g, b], axis=-1))
+
+class TestApplyLut(unittest.TestCase):
+	def test_identity(self):
+		pixels = np.random.default_rng(0).random((64, 48, 3), dtype=np.float32)
+		pixels[0, 0] = 1.0 # the last point of the cube
+		self.assertTrue(np.allclose(apply_lut(pixels, identity()), pixels, atol=1e-5))
+
+	def test_read_only_pixels(self):
+		# the reader returns read-only frames, shared with the caches
+		pixels = np.random.default_rng(0).random((16, 16, 3), dtype=np.float32)
+		pixels.flags.writeable = False
+		lut = identity()
+		lut.flags.writeable = False
+		self.assertTrue(np.allclose(apply_lut(pixels, lut), pixels, atol=1e-5))
+
+	def test_clamps_out_of_range(self):
+		pixels = np.array([[[1.5, -0.5, np.nan]]], dtype=np.float32)
+		self.assertTrue(np.allclose(apply_lut(pixels, identity()), [[[1, 0, 0]]]))
+
+	def test_threads_give_the_same_result(self):
+		lut = read_lut("./resources/AlexaV3_K1S1_LogC2Video_Rec709_EE_aftereffects3d.cube")
+		pixels = np.random.default_rng(0).random((101, 37, 3), dtype=np.float32)
+		self.assertTrue(np.array_equal(apply_lut(pixels, lut, None, 1), apply_lut(pixels, lut, None, 4)))
+
+	def test_tetrahedral(self):
+		pixels = np.random.default_rng(0).random((64, 48, 3), dtype=np.float32)
+		self.assertTrue(np.allclose(apply_lut(pixels, identity(), interpolation="tetrahedral"), pixels, atol=1e-5))
+
+		# like trilinear, exact on a linear transform
+		matrix = np.array([[0.8, 0.1, 0.1], [0.2, 0.6, 0.2], [0.0, 0.3, 0.7]], dtype=np.float32)
+		lut = np.ascontiguousarray(identity(9) @ matrix.T)
+		self.assertTrue(np.allclose(apply_lut(pixels, lut, interpolation="tetrahedral"), pixels @ matrix.T, atol=1e-5))
+
+		with self.assertRaises(ValueError):
+			apply_lut(pixels, lut, interpolation="cubic")
+
+	def test_baked_lut(self):
+		lut = read_lut("./resources/AlexaV3_K1S1_LogC2Video_Rec709_EE_aftereffects3d.cube")
+		pixels = np.random.default_rng(0).integers(0, 256, (64, 48, 3), dtype=np.uint8)
+		expected = np.rint(np.clip(apply_lut(pixels/np.float32(255), lut)*255, 0, 255))
+
+		table = bake_lut(lut)
+		self.assertEqual(table.shape, (256, 256, 256, 3))
+		self.assertTrue(np.array_equal(apply_baked_lut(pixels, table), expected))
+
+		# 65 points, under a memory ceiling
+		table = bake_lut(lut, max_bytes=1024*1024)
+		self.assertEqual(table.shape, (65, 65, 65, 3))
+		self.assertLessEqual(np.abs(apply_baked_lut(pixels, table)-expected).max(), 6)
+
+	def test_baked_identity_round_trips(self):
+		# every 8 bit code maps to itself, the last cells included
+		green, red = np.meshgrid(*[np.arange(256, dtype=np.uint8)]*2, indexing="ij")
+		pixels = np.stack([red, green, np.zeros_like(red)], axis=-1)
+		for max_bytes in [FULL_TABLE_BYTES, 10*1024*1024, 1024*1024, 200000, 20000]:
+			table = bake_lut(identity(), max_bytes=max_bytes)
+			for blue in [0, 127, 250, 255]:
+				pixels[..., 2] = blue
+				self.assertTrue(np.array_equal(apply_baked_lut(pixels, table), pixels), table.shape)
+
+	def test_baked_lut_within_max_bytes(self):
+		for max_bytes in [FULL_TABLE_BYTES, 10*1024*1024, 1024*1024, 20000]:
+			self.assertLessEqual(bake_lut(identity(), max_bytes=max_bytes).nbytes, max_bytes)
+		# not even 17 points fit
+		self.assertIsNone(baked_size(1000))
+		self.assertIsNone(bake_lut(identity(), max_bytes=1000))
+
+	def test_cancel(self):
+		pixels = np.zeros((16, 16, 3), dtype=np.float32)
+		self.assertIsNone(apply_lut(pixels, identity(), np.ones(1, dtype=np.uint8), 2))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+import os
+import sys
+import json
+import subprocess
+import tempfile
+from pathlib import Path
+import numpy as np
+import OpenImageIO as oiio
+sys.path.append('../')
+
+VIDEOPLAYER = str(Path("../VideoPlayer").resolve())
+SEQUENCE = str(Path("./resources/MASA_sequence/MASA_sequence_00196.jpg").resolve())
+LUT = str(Path("./resources/AlexaV3_K1S1_LogC2Video_Rec709_EE_aftereffects3d.cube").resolve())
+
+def run_batch(*args, env=None):
+	"""run batch.py like on a render node, from the VideoPlayer folder"""
+	return subprocess.run([sys.executable, "batch.py", *args], cwd=VIDEOPLAYER, env=env, capture_output=True, text=True, timeout=300)
+
+class TestBatch(unittest.TestCase):
+	def setUp(self):
+		self.folder = tempfile.TemporaryDirectory()
+		# keep the keyframe indexes and the folded luts out of the user cache
+		cache_dir = str(Path(self.folder.name, "cache"))
+		self.env = {**os.environ, "LOCALAPPDATA": cache_dir, "XDG_CACHE_HOME": cache_dir}
+
+	def tearDown(self):
+		self.folder.cleanup()
+
+	def test_jobs(self):
+		jobs = [
+			{'source': SEQUENCE, 'output': str(Path(self.folder.name, "graded.png")), 'range': [196, 201], 'lut': LUT, 'downsample': "half"},
+			{'source': SEQUENCE, 'output': str(Path(self.folder.name, "pinned.jpg")), 'range': [200, 203],
+				'corners': [[10, 0], [1280, 20], [1270, 720], [0, 700]]},
+		]
+		jobs_path = Path(self.folder.name, "jobs.json")
+		jobs_path.write_text(json.dumps(jobs))
+		summary_path = Path(self.folder.name, "summary.json")
+
+		result = run_batch(str(jobs_path), "--workers", "2", "--summary", str(summary_path), env=self.env)
+		self.assertEqual(result.returncode, 0, result.stderr)
+		summary = json.loads(result.stdout) # the log goes to stderr
+		self.assertEqual(summary, json.loads(summary_path.read_text()))
+		self.assertEqual([job['frames'] for job in summary['jobs']], [6, 4])
+		self.assertEqual(summary['frames'], 10)
+		self.assertTrue(all(job['fps'] > 0 for job in summary['jobs']))
+		self.assertEqual(len(list(Path(self.folder.name).glob("graded*.png"))), 6)
+		self.assertEqual(len(list(Path(self.folder.name).glob("pinned*.jpg"))), 4)
+
+	def test_high_bit_depth(self):
+		# the lut output is written as half floats, not quantized to 8 bit
+		jobs = [{'source': SEQUENCE, 'output': str(Path(self.folder.name, "graded.exr")), 'range': [196, 196], 'lut': LUT, 'downsample': "quarter"}]
+		jobs_path = Path(self.folder.name, "jobs.json")
+		jobs_path.write_text(json.dumps(jobs))
+		result = run_batch(str(jobs_path), "--workers", "1", env=self.env)
+		self.assertEqual(result.returncode, 0, result.stderr)
+		image = oiio.ImageBuf(str(Path(self.folder.name, "graded00196.exr")))
+		self.assertEqual(image.spec().format, oiio.HALF)
+		pixels = image.get_pixels(oiio.FLOAT)
+		eight_bit = np.rint(pixels*255)/255
+		self.assertGreater(np.abs(pixels-eight_bit).max(), 1/1024)
+
+	def test_failed_job(self):
+		jobs = [
+			{'source': SEQUENCE, 'output': str(Path(self.folder.name, "ok.jpg")), 'range': [196, 197]},
+			{'source': str(Path(self.folder.name, "missing.mp4")), 'output': str(Path(self.folder.name, "missing.jpg"))},
+			{'source': SEQUENCE, 'output': str(Path(self.folder.name, "typo.jpg")), 'lutt': LUT},
+		]
+		jobs_path = Path(self.folder.name, "jobs.json")
+		jobs_path.write_text(json.dumps(jobs))
+		result = run_batch(str(jobs_path), env=self.env)
+		self.assertEqual(result.returncode, 1)
+		summary = json.loads(result.stdout)
+		self.assertEqual([job['status'] for job in summary['jobs']], ["done", "failed", "failed"])
+		self.assertIn("lutt", summary['jobs'][2]['error'])
+
+	def test_without_qt(self):
+		code = "import sys, batch, export, frame_server_core; print('PySide6' in sys.modules)"
+		result = subprocess.run([sys.executable, "-c", code], cwd=VIDEOPLAYER, capture_output=True, text=True)
+		self.assertEqual(result.stdout.strip(), "False", result.stderr)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,262 @@
+import unittest
+import os
+import sys
+import time
+import threading
+import tempfile
+from pathlib import Path
+from dataclasses import dataclass
+from unittest import mock
+import numpy as np
+import OpenImageIO as oiio
+sys.path.append('../')
+
+from VideoPlayer import export
+from VideoPlayer.export import (run, run_segments, split_segments, open_writer, ffmpeg_command, find_ffmpeg,
+	default_dtype, MovieWriter, FFmpegWriter)
+
+@dataclass(frozen=True)
+class Key:
+	frame: int
+
+def evaluate(key):
+	"""a flat frame with the frame number as value, done out of order"""
+	time.sleep(np.random.default_rng(key.frame).random()*0.01)
+	return np.full((8, 16, 3), key.frame, dtype=np.uint8)
+
+class FailOnce:
+	"""evaluate, that fails the first time each segment evaluates frame 0 of it.
+	Picklable, the attempts are marker files."""
+	def __init__(self, folder, frames):
+		self.folder = folder
+		self.frames = frames
+
+	def __call__(self, key):
+		marker = Path(self.folder, "failed%05d" % key.frame)
+		if key.frame in self.frames and not marker.exists():
+			marker.touch()
+			raise RuntimeError("first attempt")
+		return evaluate(key)
+
+class FailFirst:
+	"""evaluate, that fails on frame 0 and takes `seconds` over the other frames"""
+	def __init__(self, seconds):
+		self.seconds = seconds
+
+	def __call__(self, key):
+		if key.frame == 0:
+			raise RuntimeError("broken frame")
+		time.sleep(self.seconds)
+		return evaluate(key)
+
+class TestExport(unittest.TestCase):
+	def setUp(self):
+		self.folder = tempfile.TemporaryDirectory()
+		self.filename = str(Path(self.folder.name, "out.png"))
+
+	def tearDown(self):
+		self.folder.cleanup()
+
+	def read(self, frame):
+		return oiio.ImageBuf(str(Path(self.folder.name, "out%05d.png" % frame))).get_pixels(oiio.UINT8)
+
+	def test_writes_every_frame(self):
+		keys = [Key(frame) for frame in range(10, 40)]
+		stats = run(evaluate, keys, self.filename, workers=4, buffer=3)
+		self.assertEqual(stats['frames'], 30)
+		self.assertFalse(stats['cancelled'])
+		for key in keys:
+			self.assertTrue(np.all(self.read(key.frame) == key.frame))
+
+	def test_written_in_order(self):
+		written = []
+		def progress(stats):
+			written.append(stats['frame'])
+		keys = [Key(frame) for frame in range(30)]
+		run(evaluate, keys, self.filename, workers=4, progress=progress)
+		self.assertEqual(written, sorted(written))
+		self.assertEqual(written[-1], 29)
+
+	def test_bounded_buffer(self):
+		# the workers are never more than buffer frames ahead of the last frame written,
+		# the frames being written by the writer threads included
+		interval, export.PROGRESS_INTERVAL = export.PROGRESS_INTERVAL, 0
+		self.addCleanup(setattr, export, "PROGRESS_INTERVAL", interval)
+		evaluated = []
+		written = [-1]
+		ahead = []
+		def slow_writer_evaluate(key):
+			evaluated.append(key.frame)
+			ahead.append(key.frame-written[-1])
+			return evaluate(key)
+		def progress(stats):
+			written.append(stats['frame'])
+			time.sleep(0.005)
+		run(slow_writer_evaluate, [Key(frame) for frame in range(40)], self.filename, workers=2, buffer=4, progress=progress)
+		self.assertEqual(len(evaluated), 40)
+		self.assertLessEqual(max(ahead), 4)
+
+	def test_cancel(self):
+		cancel = threading.Event()
+		def cancelling_evaluate(key):
+			if key.frame == 5:
+				cancel.set()
+			return evaluate(key)
+		stats = run(cancelling_evaluate, [Key(frame) for frame in range(100)], self.filename, workers=2, buffer=2, cancel=cancel)
+		self.assertTrue(stats['cancelled'])
+		self.assertLess(stats['frames'], 100)
+
+	def test_error(self):
+		def failing_evaluate(key):
+			if key.frame == 3:
+				raise RuntimeError("broken frame")
+			return evaluate(key)
+		with self.assertRaises(RuntimeError):
+			run(failing_evaluate, [Key(frame) for frame in range(10)], self.filename, workers=2)
+
+	def test_unsupported_format(self):
+		with self.assertRaises(ValueError):
+			run(evaluate, [Key(0)], str(Path(self.folder.name, "out.xyz")), workers=1)
+
+	def test_write_error(self):
+		# raised from the writer threads
+		with self.assertRaises(RuntimeError):
+			run(evaluate, [Key(frame) for frame in range(10)], str(Path(self.folder.name, "missing", "out.png")), workers=2)
+
+	def test_high_bit_depth(self):
+		ramp = np.linspace(0, 1, 8*16*3, dtype=np.float32).reshape(8, 16, 3)
+		frames = {
+			'png': (np.rint(ramp*65535).astype(np.uint16), oiio.UINT16, 0),
+			'tif': (np.rint(ramp*65535).astype(np.uint16), oiio.UINT16, 0),
+			'exr': (ramp.astype(np.float16), oiio.HALF, 0),
+			'dpx': (np.rint(ramp*65535).astype(np.uint16), oiio.UINT16, 65535/1023), # a 10 bit step
+		}
+		for ext, (rgb, oiio_type, tolerance) in frames.items():
+			filename = str(Path(self.folder.name, "deep."+ext))
+			run(lambda key: rgb, [Key(frame) for frame in range(3)], filename, workers=2)
+			image = oiio.ImageBuf(str(Path(self.folder.name, "deep00002."+ext)))
+			self.assertEqual(image.spec().format, oiio_type, ext)
+			pixels = image.get_pixels(oiio_type)
+			self.assertEqual(pixels.dtype, rgb.dtype, ext)
+			self.assertLessEqual(np.abs(pixels.astype(np.float64)-rgb).max(), tolerance, ext)
+		spec = oiio.ImageInput.open(str(Path(self.folder.name, "deep00000.dpx"))).spec()
+		self.assertEqual(spec.get_int_attribute("oiio:BitsPerSample"), 10)
+
+	def test_default_dtype(self):
+		self.assertEqual(default_dtype("out.jpg"), "uint8")
+		self.assertEqual(default_dtype("out.exr"), "half")
+		self.assertEqual(default_dtype("out.dpx"), "uint16")
+		with self.assertRaises(ValueError):
+			default_dtype("out.xyz")
+
+class TestMovieExport(unittest.TestCase):
+	def setUp(self):
+		self.folder = tempfile.TemporaryDirectory()
+
+	def tearDown(self):
+		self.folder.cleanup()
+
+	def test_ffmpeg_command(self):
+		command = ffmpeg_command("ffmpeg", "out.mov", 25, 1920, 1080, codec="prores", preset="4444", pix_fmt="yuv444p10le")
+		self.assertEqual(command[command.index("-c:v")+1], "prores_ks")
+		self.assertEqual(command[command.index("-profile:v")+1], "4444")
+		self.assertEqual(command[command.index("-s")+1], "1920x1080")
+		self.assertEqual(command[-1], "out.mov")
+		# the output pixel format, after the rgb24 input
+		self.assertEqual(command[len(command)-1-command[::-1].index("-pix_fmt")+1], "yuv444p10le")
+
+	def test_hvc1_tag_for_quicktime_containers(self):
+		for filename in ["out.mp4", "out.mov"]:
+			command = ffmpeg_command("ffmpeg", filename, 24, 64, 32, codec="h265")
+			self.assertEqual(command[command.index("-tag:v")+1], "hvc1")
+		# matroska has no sample entry tags
+		self.assertNotIn("-tag:v", ffmpeg_command("ffmpeg", "out.mkv", 24, 64, 32, codec="h265"))
+
+	def test_ffmpeg_log_closed_on_failure(self):
+		writer = FFmpegWriter(str(Path(self.folder.name, "out.mp4")), 24, 64, 32, sys.executable)
+		with self.assertRaises(RuntimeError):
+			writer.close() # python rejects the ffmpeg options, a failing encoder
+		self.assertTrue(writer._log.closed)
+
+	def test_ffmpeg_command_16_bit(self):
+		command = ffmpeg_command("ffmpeg", "out.mov", 25, 64, 32, codec="prores", input_pix_fmt="rgb48le")
+		self.assertEqual(command[command.index("-pix_fmt")+1], "rgb48le")
+
+	def test_ffmpeg_command_defaults(self):
+		command = ffmpeg_command("ffmpeg", "out.mp4", 24, 64, 32)
+		self.assertEqual(command[command.index("-c:v")+1], "libx264")
+		self.assertEqual(command[command.index("-preset")+1], "medium")
+		with self.assertRaises(ValueError):
+			ffmpeg_command("ffmpeg", "out.mp4", 24, 64, 32, codec="mpeg1")
+
+	def test_fallback_without_ffmpeg(self):
+		with mock.patch.dict(os.environ, {"FFMPEG_BINARY": "no-such-ffmpeg"}):
+			writer = open_writer(str(Path(self.folder.name, "out.mp4")), 24, 64, 32)
+		self.assertIsInstance(writer, MovieWriter)
+		writer.write(0, np.zeros((32, 64, 3), dtype=np.uint8))
+		writer.write(1, np.zeros((32, 64, 3), dtype=np.uint16))
+		writer.close()
+
+	@unittest.skipUnless(find_ffmpeg(), "ffmpeg not installed")
+	def test_ffmpeg_encode(self):
+		filename = str(Path(self.folder.name, "out.mp4"))
+		stats = run(lambda key: np.full((32, 64, 3), key.frame*8, dtype=np.uint8)[:, ::-1], # not contiguous
+			[Key(frame) for frame in range(24)], filename, workers=2, codec="h264", preset="ultrafast")
+		self.assertEqual(stats['frames'], 24)
+		self.assertGreater(Path(filename).stat().st_size, 0)
+
+class TestSegmentExport(unittest.TestCase):
+	def setUp(self):
+		self.folder = tempfile.TemporaryDirectory()
+		self.filename = str(Path(self.folder.name, "out.png"))
+
+	def tearDown(self):
+		self.folder.cleanup()
+
+	def test_split_segments(self):
+		self.assertEqual(split_segments(10, 3), [(0, 3), (3, 6), (6, 10)])
+		self.assertEqual(split_segments(100, 4, gop=12), [(0, 24), (24, 48), (48, 72), (72, 100)])
+		self.assertEqual(split_segments(10, 4, gop=8), [(0, 8), (8, 10)]) # at most a segment per gop
+		self.assertEqual(split_segments(5, 1), [(0, 5)])
+
+	def test_segments(self):
+		frames = []
+		keys = [Key(frame) for frame in range(10, 30)]
+		stats = run_segments(evaluate, keys, self.filename, segments=2,
+			progress=lambda stats: frames.append(stats['frames']))
+		self.assertEqual(stats['frames'], 20)
+		self.assertEqual(frames[-1], 20)
+		self.assertEqual(frames, sorted(frames))
+		for key in keys:
+			self.assertTrue(np.all(oiio.ImageBuf(str(Path(self.folder.name, "out%05d.png" % key.frame))).get_pixels(oiio.UINT8) == key.frame))
+
+	def test_failed_segment_is_retried(self):
+		keys = [Key(frame) for frame in range(20)]
+		stats = run_segments(FailOnce(self.folder.name, {0, 10}), keys, self.filename, segments=2, retries=1)
+		self.assertEqual(stats['frames'], 20)
+
+	@unittest.skipUnless(find_ffmpeg(), "ffmpeg not installed")
+	def test_segmented_movie(self):
+		filename = str(Path(self.folder.name, "out.mp4"))
+		stats = run_segments(evaluate, [Key(frame) for frame in range(60)], filename, segments=3, gop=12, preset="ultrafast")
+		self.assertEqual(stats['frames'], 60)
+		self.assertFalse(Path(self.folder.name, "out.segments").exists())
+		import cv2
+		self.assertEqual(int(cv2.VideoCapture(filename).get(cv2.CAP_PROP_FRAME_COUNT)), 60)
+
+	def test_failing_segment(self):
+		keys = [Key(frame) for frame in range(20)]
+		with self.assertRaises(RuntimeError):
+			run_segments(FailOnce(self.folder.name, {0}), keys, self.filename, segments=2, retries=0)
+
+	def test_failing_segment_stops_the_others(self):
+		# the error is raised without waiting for the other segment, about 10s of frames
+		keys = [Key(frame) for frame in range(40)]
+		begin = time.perf_counter()
+		with self.assertRaises(RuntimeError):
+			run_segments(FailFirst(0.5), keys, self.filename, segments=2, retries=0)
+		self.assertLess(time.perf_counter()-begin, 5)
+		self.assertLess(len(list(Path(self.folder.name).glob("out*.png"))), 10)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+import sys
+from dataclasses import dataclass
+import numpy as np
+sys.path.append('../')
+
+from VideoPlayer.frame_cache import FrameCache
+
+@dataclass(frozen=True)
+class Key:
+	frame: int
+	path: str = "clip.mp4"
+	downsample: str = "full"
+	lut: str = None
+
+def pixels(nbytes=100):
+	return np.zeros(nbytes, dtype=np.uint8)
+
+class TestFrameCache(unittest.TestCase):
+	def test_running_byte_total(self):
+		cache = FrameCache()
+		cache.put(Key(1), pixels(100))
+		cache.put(Key(2), pixels(50))
+		cache.put(Key(1), pixels(10)) # replace
+		self.assertEqual(cache.nbytes, 60)
+
+		cache.pop(Key(2))
+		self.assertEqual(cache.nbytes, 10)
+		self.assertEqual(len(cache), 1)
+
+	def test_evict_least_recently_used(self):
+		cache = FrameCache()
+		for frame in range(4):
+			cache.put(Key(frame), pixels())
+		cache.get(Key(0)) # a hit moves the frame to the back
+
+		evicted = cache.evict(200)
+		self.assertEqual(evicted, [Key(1), Key(2)])
+		self.assertEqual(list(cache), [Key(3), Key(0)])
+		self.assertEqual(cache.nbytes, 200)
+
+	def test_evict_to_max_frames(self):
+		cache = FrameCache()
+		for frame in range(4):
+			cache.put(Key(frame), pixels())
+		self.assertEqual(cache.evict(10000, max_frames=1), [Key(0), Key(1), Key(2)])
+		self.assertEqual(list(cache), [Key(3)])
+
+	def test_peek_keeps_the_order(self):
+		cache = FrameCache()
+		for frame in range(3):
+			cache.put(Key(frame), pixels())
+		self.assertIsNotNone(cache.peek(Key(0)))
+		self.assertIsNone(cache.peek(Key(5)))
+		self.assertEqual(cache.evict(200), [Key(0)])
+
+	def test_frames_per_source(self):
+		cache = FrameCache()
+		cache.put(Key(3), pixels())
+		cache.put(Key(1), pixels())
+		cache.put(Key(2, downsample="half"), pixels())
+		cache.put(Key(1, lut="rec709.cube"), pixels())
+
+		self.assertEqual(cache.frames("clip.mp4", "full", None), [1, 3])
+		self.assertEqual(cache.frames("clip.mp4", "half", None), [2])
+
+		cache.evict(0)
+		self.assertEqual(cache.frames("clip.mp4", "full", None), [])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,392 @@
+import unittest
+import os
+import sys
+import tempfile
+import time
+import threading
+from unittest import mock
+from pathlib import Path
+from dataclasses import replace
+import numpy as np
+sys.path.append('../VideoPlayer') # the frame server imports its siblings top level, like the app
+
+import frame_server_core
+from frame_server_core import FrameServerCore, ProcessDesc
+from request_queue import LOOKAHEAD, BACKGROUND, EXPORT
+
+SEQUENCE = str(Path("./resources/MASA_sequence/MASA_sequence_00196.jpg").resolve())
+VIDEO = str(Path("./resources/Masa - becsukjuk, nem latszik.mp4").resolve())
+LUT = str(Path("./resources/AlexaV3_K1S1_LogC2Video_Rec709_EE_aftereffects3d.cube").resolve())
+
+def wait_until(condition, timeout=10):
+	deadline = time.perf_counter()+timeout
+	while not condition():
+		if time.perf_counter() > deadline:
+			return False
+		time.sleep(0.01)
+	return True
+
+class UserCacheTestCase(unittest.TestCase):
+	"""keeps the keyframe indexes and the folded luts out of the user cache"""
+	def setUp(self):
+		cache_dir = tempfile.TemporaryDirectory()
+		self.addCleanup(cache_dir.cleanup)
+		environ = mock.patch.dict(os.environ, {"LOCALAPPDATA": cache_dir.name, "XDG_CACHE_HOME": cache_dir.name})
+		environ.start()
+		self.addCleanup(environ.stop)
+
+class GatedCore(FrameServerCore):
+	"""evaluates flat frames, once gate is set. Records the evaluated keys, the
+	cancelled evaluations and the notified frames."""
+	def __init__(self, **kwargs):
+		self.gate = threading.Event()
+		self.evaluated = []
+		self.cancelled = []
+		self.done = []
+		super().__init__(**kwargs)
+
+	def evaluate(self, key, rect=None, cancel=None, store=True):
+		self.evaluated.append(key)
+		while not self.gate.wait(0.01):
+			if cancel and cancel.cancelled:
+				self.cancelled.append(key)
+				return None
+		if key.frame < 0:
+			raise ValueError("broken frame")
+		return np.full((4, 4, 3), key.frame%256, dtype=np.uint8)
+
+	def on_frame_done(self, key):
+		self.done.append(key)
+
+def flat_key(frame):
+	return ProcessDesc(frame=frame, path=SEQUENCE, downsample="quarter")
+
+class TestSubmit(UserCacheTestCase):
+	def frame_server(self, workers=1):
+		frame_server = GatedCore(workers=workers)
+		self.addCleanup(frame_server.stop)
+		self.addCleanup(frame_server.gate.set)
+		return frame_server
+
+	def test_future_of_the_frame(self):
+		frame_server = self.frame_server()
+		frame_server.gate.set()
+		future = frame_server.submit(flat_key(7))
+		self.assertTrue(np.all(future.result(5) == 7))
+
+	def test_cached_frame_resolves_at_once(self):
+		frame_server = self.frame_server()
+		frame_server.gate.set()
+		for frame in range(3):
+			frame_server.submit(flat_key(frame), priority=BACKGROUND).result(5)
+		order = list(frame_server)
+
+		future = frame_server.submit(flat_key(0))
+		self.assertTrue(future.done())
+		self.assertEqual(list(frame_server), order) # a peek, the eviction order stays
+		self.assertEqual(frame_server.evaluated.count(flat_key(0)), 1)
+
+	def test_export_frames_cached_only_with_room(self):
+		frame_server = self.frame_server()
+		frame_server.memory_limit = 4*48/1024/1024 # four 4x4 rgb frames
+		frame_server.gate.set()
+		reviewed = [flat_key(frame) for frame in [100, 101]]
+		for key in reviewed:
+			frame_server.submit(key, priority=BACKGROUND).result(5)
+
+		for frame in range(10):
+			self.assertTrue(np.all(frame_server.submit(flat_key(frame)).result(5) == frame))
+		self.assertTrue(all(key in frame_server for key in reviewed)) # the export evicted none
+		self.assertLessEqual(len(frame_server._cache), 4)
+
+	def test_export_jobs_dont_store_stage_results(self):
+		frame_server = FrameServerCore(workers=1)
+		self.addCleanup(frame_server.stop)
+		key = ProcessDesc(frame=200, path=SEQUENCE, downsample="quarter", lut=LUT)
+		frame_server.submit(key, priority=EXPORT).result(30)
+		self.assertEqual(sum(len(cache) for cache in frame_server._stage_cache.values()), 0)
+
+		frame_server.submit(replace(key, frame=201), priority=BACKGROUND).result(30)
+		self.assertEqual(len(frame_server._stage_cache['read']), 1)
+
+	def test_cancelled_job_is_dropped(self):
+		frame_server = self.frame_server()
+		busy = frame_server.submit(flat_key(0))
+		self.assertTrue(wait_until(lambda: frame_server.evaluated == [flat_key(0)]))
+		dropped = frame_server.submit(flat_key(1))
+		kept = frame_server.submit(flat_key(2))
+		dropped.cancel()
+		frame_server.gate.set()
+		kept.result(5)
+		self.assertNotIn(flat_key(1), frame_server.evaluated)
+
+	def test_visible_frame_preempts_export_jobs(self):
+		frame_server = self.frame_server()
+		exports = [frame_server.submit(flat_key(frame)) for frame in [200, 201]]
+		self.assertTrue(wait_until(lambda: frame_server.evaluated == [flat_key(200)]))
+
+		visible = flat_key(250)
+		frame_server.request_frame(visible)
+		self.assertTrue(wait_until(lambda: frame_server.cancelled == [flat_key(200)])) # the worker is freed
+		self.assertTrue(wait_until(lambda: len(frame_server._window) > 1)) # the prefetch window is queued
+		frame_server.gate.set()
+
+		# the preempted export job is requeued, its future still resolves
+		self.assertTrue(np.all(exports[0].result(5) == 200))
+		self.assertTrue(np.all(exports[1].result(5) == 201))
+		evaluated = frame_server.evaluated
+		self.assertEqual(evaluated[1], visible)
+		window = set(frame_server._window)
+		self.assertTrue(all(key in window for key in evaluated[1:evaluated.index(flat_key(201))]))
+
+	def test_visible_frame_of_an_export_job_in_flight(self):
+		# the visible frame is stored and notified, though the export job evaluates it in a full cache
+		frame_server = self.frame_server()
+		frame_server.memory_limit = 48/1024/1024 # a 4x4 rgb frame
+		frame_server.gate.set()
+		frame_server.submit(flat_key(250), priority=BACKGROUND).result(5)
+		frame_server.gate.clear()
+
+		export = frame_server.submit(flat_key(200))
+		self.assertTrue(wait_until(lambda: frame_server.evaluated[-1] == flat_key(200)))
+		frame_server.request_frame(flat_key(200))
+		frame_server.gate.set()
+		self.assertTrue(np.all(export.result(5) == 200))
+		self.assertTrue(wait_until(lambda: flat_key(200) in frame_server.done))
+		self.assertIn(flat_key(200), frame_server)
+		self.assertEqual(frame_server.evaluated.count(flat_key(200)), 1)
+
+	def test_raised_memory_limit_resumes_the_background_fill(self):
+		frame_server = self.frame_server()
+		frame_server.memory_limit = 48/1024/1024 # a 4x4 rgb frame
+		frame_server.gate.set()
+		keys = [flat_key(frame) for frame in range(250, 254)]
+		for key in keys:
+			frame_server.request(key)
+		self.assertTrue(wait_until(lambda: not frame_server._requests))
+		self.assertEqual(len(frame_server._cache), 1) # the others were dropped, the cache is full
+
+		frame_server.memory_limit = 10*48/1024/1024
+		self.assertTrue(wait_until(lambda: all(key in frame_server for key in keys)))
+
+	def test_error_is_set_on_the_future(self):
+		frame_server = self.frame_server()
+		frame_server.gate.set()
+		with self.assertRaises(ValueError):
+			frame_server.submit(flat_key(-1)).result(5)
+
+	def test_stop_cancels_the_futures(self):
+		frame_server = FrameServerCore(workers=0)
+		future = frame_server.submit(flat_key(0))
+		frame_server.stop()
+		self.assertTrue(future.cancelled())
+		self.assertTrue(frame_server.submit(flat_key(1)).cancelled())
+
+class UnevenCore(GatedCore):
+	"""GatedCore, that takes longer over every third frame. Records the order
+	the evaluations finish in."""
+	def __init__(self, **kwargs):
+		self.finished = []
+		super().__init__(**kwargs)
+
+	def evaluate(self, key, rect=None, cancel=None, store=True):
+		pixels = super().evaluate(key, rect, cancel, store)
+		time.sleep(0.1 if key.frame%3 == 0 else 0.01)
+		self.finished.append(key)
+		return pixels
+
+class HeldCore(GatedCore):
+	"""GatedCore, that holds the evaluations of the frames before 250 until held is set"""
+	def __init__(self, **kwargs):
+		self.held = threading.Event()
+		super().__init__(**kwargs)
+
+	def evaluate(self, key, rect=None, cancel=None, store=True):
+		pixels = super().evaluate(key, rect, cancel, store)
+		if pixels is not None and key.frame < 250:
+			self.held.wait(10)
+		return pixels
+
+class TestRequestFrame(UserCacheTestCase):
+	def frame_server(self, core=GatedCore, workers=1):
+		frame_server = core(workers=workers)
+		frame_server.set_hints(playback="forward")
+		self.addCleanup(frame_server.stop)
+		self.addCleanup(frame_server.gate.set)
+		return frame_server
+
+	def request_window(self, frame_server, frame):
+		frame_server.request_frame(flat_key(frame))
+		self.assertTrue(wait_until(lambda: len(frame_server._window) > 1)) # the reader is open
+		return list(frame_server._window)
+
+	def test_window_notified_in_request_order(self):
+		frame_server = self.frame_server(UnevenCore, workers=3)
+		window = self.request_window(frame_server, 200)
+		frame_server.gate.set()
+		self.assertTrue(wait_until(lambda: len(frame_server.done) == len(window)))
+		self.assertEqual(frame_server.done, window)
+		self.assertNotEqual(frame_server.finished, window) # though they finished out of order
+
+	def test_scrub_cancels_the_window(self):
+		frame_server = self.frame_server()
+		old_window = self.request_window(frame_server, 200)
+		self.assertTrue(wait_until(lambda: frame_server.evaluated == [flat_key(200)]))
+
+		window = self.request_window(frame_server, 280)
+		self.assertTrue(wait_until(lambda: frame_server.cancelled == [flat_key(200)])) # it left the window
+		self.assertTrue(wait_until(lambda: frame_server.evaluated[-1] == flat_key(280)))
+
+		# the old window is kept for the background, behind the new one
+		for key in old_window:
+			self.assertEqual(frame_server._requests.priority(key), BACKGROUND)
+		for key in window[1:]:
+			self.assertEqual(frame_server._requests.priority(key), LOOKAHEAD)
+		frame_server.gate.set()
+		self.assertTrue(wait_until(lambda: all(key in frame_server for key in old_window+window)))
+		self.assertEqual(frame_server.evaluated[1:len(window)+1], window)
+
+	def test_window_notified_after_a_scrub(self):
+		# the demoted frames of the old window dont hold back the notifications of the new one
+		frame_server = self.frame_server(HeldCore, workers=2)
+		self.addCleanup(frame_server.held.set)
+		self.request_window(frame_server, 200)
+		self.assertTrue(wait_until(lambda: len(frame_server.evaluated) == 2))
+		window = self.request_window(frame_server, 280)
+		self.assertTrue(wait_until(lambda: len(frame_server.cancelled) == 2)) # both left the window
+		frame_server.gate.set()
+		self.assertTrue(wait_until(lambda: all(key in frame_server.done for key in window)))
+		notified = [key for key in frame_server.done if key in window]
+		self.assertEqual(notified, window)
+
+class TestSchedule(UserCacheTestCase):
+	def setUp(self):
+		super().setUp()
+		frame_server_core._create_reader.cache_clear()
+		self.frame_server = FrameServerCore(workers=0) # nothing is evaluated, the requests stay queued
+		self.addCleanup(self.frame_server.stop)
+
+	def test_request_does_not_wait_for_the_reader(self):
+		opened = threading.Event()
+		create_reader = frame_server_core.create_reader_cached
+		def slow_create_reader(*args):
+			opened.wait(5)
+			return create_reader(*args)
+
+		key = ProcessDesc(frame=200, path=SEQUENCE, downsample="quarter")
+		with mock.patch.object(frame_server_core, "create_reader_cached", slow_create_reader):
+			begin = time.perf_counter()
+			self.frame_server.request_frame(key)
+			self.assertLess(time.perf_counter()-begin, 1)
+			self.assertEqual(list(self.frame_server._window), [key]) # the visible frame only, for now
+
+			opened.set()
+			# the window follows once the reader is open
+			self.assertTrue(wait_until(lambda: len(self.frame_server._window) > 1))
+		self.assertEqual(list(self.frame_server._window)[0], key)
+
+	def test_reader_opened_once(self):
+		# the workers and the frame range thread ask for the reader at once
+		opened = []
+		def slow_reader(*args, **kwargs):
+			opened.append(args)
+			time.sleep(0.1)
+			return object()
+		with mock.patch.object(frame_server_core, "Reader", slow_reader):
+			readers = []
+			threads = [threading.Thread(target=lambda: readers.append(frame_server_core.create_reader_cached(SEQUENCE, 4))) for i in range(4)]
+			for thread in threads:
+				thread.start()
+			for thread in threads:
+				thread.join()
+		frame_server_core._create_reader.cache_clear()
+		self.assertEqual(len(opened), 1)
+		self.assertTrue(all(reader is readers[0] for reader in readers))
+
+	def test_window_within_the_source(self):
+		self.frame_server.request_frame(ProcessDesc(frame=196, path=SEQUENCE, downsample="quarter"))
+		self.assertTrue(wait_until(lambda: len(self.frame_server._window) > 1))
+		frames = [key.frame for key in self.frame_server._window]
+		self.assertEqual(frames[0], 196)
+		self.assertTrue(all(196 <= frame <= 300 for frame in frames))
+
+class TestReducedLevels(UserCacheTestCase):
+	def assert_same_quarter(self, path):
+		# 'quarter' after 'full' is cached, the same as without
+		frame_server = FrameServerCore(workers=0)
+		other = FrameServerCore(workers=0)
+		self.addCleanup(frame_server.stop)
+		self.addCleanup(other.stop)
+		key = ProcessDesc(frame=frame_server_core.create_reader_cached(path).first_frame+1, path=path, downsample="full", lut=LUT)
+		frame_server.evaluate(key)
+		quarter = replace(key, downsample="quarter")
+		self.assertTrue(np.array_equal(frame_server.evaluate(quarter), other.evaluate(quarter)))
+
+	def test_video(self):
+		self.assert_same_quarter(VIDEO)
+
+	def test_jpeg_sequence(self):
+		# the reduced reads are DCT scaled, not a shrink of the full frame
+		self.assert_same_quarter(SEQUENCE)
+
+class TestBakedLut(UserCacheTestCase):
+	def frame_server(self, **attributes):
+		frame_server = FrameServerCore(workers=0)
+		frame_server.bake_in_background = False
+		for name, value in attributes.items():
+			setattr(frame_server, name, value)
+		self.addCleanup(frame_server.stop)
+		return frame_server
+
+	def test_same_pixels_as_the_float_kernel(self):
+		# both round and clip to 8 bit, whether the table is baked yet or not
+		key = ProcessDesc(frame=200, path=SEQUENCE, downsample="quarter", lut=LUT)
+		baked = self.frame_server().evaluate(key)
+		floats = self.frame_server(lut_table_bytes=0).evaluate(key)
+		self.assertLessEqual(np.abs(baked.astype(int)-floats).max(), 1)
+		self.assertLess(np.mean(baked != floats), 0.001)
+
+	def test_tables_count_against_the_memory_limit(self):
+		key = ProcessDesc(frame=200, path=SEQUENCE, downsample="quarter", lut=LUT)
+		frame_server = self.frame_server()
+		frame_server.evaluate(key, store=False)
+		self.assertGreaterEqual(frame_server.used_memory(), 48) # a full table, within the lut share of 1000MB
+
+		# a table within its share of a small limit
+		frame_server = self.frame_server(memory_limit=20)
+		frame_server.evaluate(key, store=False)
+		self.assertLessEqual(frame_server.used_memory(), 20*frame_server.lut_share)
+		self.assertGreater(frame_server.used_memory(), 0)
+
+class TestStageCache(UserCacheTestCase):
+	def setUp(self):
+		super().setUp()
+		self.frame_server = FrameServerCore(workers=1)
+		self.addCleanup(self.frame_server.stop)
+
+	def keys(self, frames, **options):
+		return [ProcessDesc(frame=frame, path=SEQUENCE, downsample="full", lut=LUT, **options) for frame in frames]
+
+	def test_frames_per_stage(self):
+		# at the default limit, the read and lut stages keep their frames
+		for key in self.keys(range(196, 208)):
+			self.frame_server.submit(key, priority=BACKGROUND).result()
+		for stage in ['read', 'lut']:
+			self.assertEqual(len(self.frame_server._stage_cache[stage]), self.frame_server.stage_budget[stage])
+
+		# toggling the interpolation reuses the reads of the recent frames
+		self.frame_server.times.clear()
+		for key in self.keys(range(204, 208), interpolation="tetrahedral"):
+			self.frame_server.submit(key, priority=BACKGROUND).result()
+		self.assertNotIn('read', self.frame_server.times)
+
+	def test_stages_within_their_share(self):
+		self.frame_server.memory_limit = 20 # MB, about 7 full 8 bit frames
+		for key in self.keys(range(196, 206)):
+			self.frame_server.submit(key, priority=BACKGROUND).result()
+		stage_bytes = sum(cache.nbytes for cache in self.frame_server._stage_cache.values())
+		self.assertLessEqual(stage_bytes, 20*1024*1024*self.frame_server.stage_share)
+		self.assertLessEqual(self.frame_server.used_memory(), 20)
+
+if __name__ == '__main__':
+	unittest.main()
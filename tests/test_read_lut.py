@@ -0,0 +1,90 @@
+import unittest
+import sys
+import tempfile
+from pathlib import Path
+import numpy as np
+sys.path.append('../')
+
+from VideoPlayer.LUT import read_lut, apply_lut
+
+ALEXA = "./resources/AlexaV3_K1S1_LogC2Video_Rec709_EE_aftereffects3d.cube"
+
+def write_cube(folder, name, lines):
+	path = Path(folder, name)
+	path.write_text("\n".join(lines)+"\n")
+	return path
+
+def table_lines(table):
+	return [" ".join("{:.6f}".format(value) for value in row) for row in np.reshape(table, (-1, 3))]
+
+def identity(size):
+	b, g, r = np.meshgrid(*[np.linspace(0, 1, size, dtype=np.float32)]*3, indexing="ij")
+	return np.stack([r, g, b], axis=-1)
+
+class TestReadLut(unittest.TestCase):
+	def setUp(self):
+		self.folder = tempfile.TemporaryDirectory()
+		self.cache_dir = Path(self.folder.name, "cache")
+
+	def tearDown(self):
+		self.folder.cleanup()
+
+	def test_matches_line_by_line_parse(self):
+		rows = [line.split() for line in Path(ALEXA).read_text().splitlines()]
+		values = [[float(x) for x in row] for row in rows if len(row) == 3 and not row[0][0].isalpha()]
+		lut = read_lut(ALEXA)
+		self.assertEqual(lut.shape, (32, 32, 32, 3))
+		self.assertEqual(lut.dtype, np.float32)
+		self.assertTrue(np.array_equal(lut.reshape(-1, 3), np.array(values, dtype=np.float32)))
+
+	def test_comments_and_title(self):
+		path = write_cube(self.folder.name, "commented.cube", ["# a comment", 'TITLE "identity"', "LUT_3D_SIZE 2", ""]
+			+ table_lines(identity(2))[:4] + ["# in the table"] + table_lines(identity(2))[4:])
+		self.assertTrue(np.allclose(read_lut(path), identity(2)))
+
+	def test_byte_order_mark(self):
+		path = Path(self.folder.name, "bom.cube")
+		path.write_bytes(b"\xef\xbb\xbf"+"\n".join(["LUT_3D_SIZE 2"]+table_lines(identity(2))).encode())
+		self.assertTrue(np.allclose(read_lut(path), identity(2)))
+
+	def test_without_a_trailing_newline(self):
+		path = Path(self.folder.name, "last.cube")
+		path.write_text("\n".join(["LUT_3D_SIZE 2"]+table_lines(identity(2))))
+		self.assertTrue(np.allclose(read_lut(path), identity(2)))
+
+	def test_wrong_count(self):
+		path = write_cube(self.folder.name, "short.cube", ["LUT_3D_SIZE 2"] + table_lines(identity(2))[:-1])
+		with self.assertRaises(ValueError):
+			read_lut(path)
+
+	def test_not_a_number(self):
+		lines = table_lines(identity(2))
+		lines[3] = "0.5 x 0.5"
+		path = write_cube(self.folder.name, "typo.cube", ["LUT_3D_SIZE 2"] + lines)
+		with self.assertRaises(ValueError):
+			read_lut(path)
+
+	def test_1d(self):
+		curve = np.linspace(0, 1, 1024, dtype=np.float32)**2
+		path = write_cube(self.folder.name, "square.cube", ["LUT_1D_SIZE 1024"] + table_lines(np.repeat(curve[:,None], 3, axis=1)))
+		lut = read_lut(path)
+		self.assertEqual(lut.shape, (65, 65, 65, 3))
+		pixels = np.array([[[0.5, 0.25, 1.0]]], dtype=np.float32)
+		self.assertTrue(np.allclose(apply_lut(pixels, lut), pixels**2, atol=1e-3))
+
+	def test_domain(self):
+		# a 3D identity over 0-2 halves the input
+		path = write_cube(self.folder.name, "domain.cube", ["LUT_3D_SIZE 3", "DOMAIN_MIN 0 0 0", "DOMAIN_MAX 2 2 2"] + table_lines(identity(3)))
+		lut = read_lut(path)
+		pixels = np.array([[[0.5, 0.25, 1.0]]], dtype=np.float32)
+		self.assertTrue(np.allclose(apply_lut(pixels, lut), pixels/2, atol=1e-5))
+
+	def test_cache(self):
+		lut = read_lut(ALEXA, cache_dir=self.cache_dir)
+		self.assertEqual(len(list(self.cache_dir.glob("*.npy"))), 1)
+		cached = read_lut(ALEXA, cache_dir=self.cache_dir)
+		self.assertIsInstance(cached, np.memmap)
+		self.assertTrue(np.array_equal(lut, cached))
+
+if __name__ == '__main__':
+	unittest.main()
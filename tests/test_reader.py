@@ -1,13 +1,22 @@
 import unittest
+import os
 import sys
+import shutil
+import tempfile
+import threading
+from unittest import mock
 import numpy as np
+import OpenImageIO as oiio
+from pathlib import Path
 sys.path.append('../')
 
-from VideoPlayer.reader import Reader, parse_sequence
+from VideoPlayer.read.reader import Reader, parse_sequence, convert_pixels
+from VideoPlayer.read import keyframe_index, sequence_index
+from VideoPlayer.read.keyframe_index import KeyframeIndex
 
 class TestReader(unittest.TestCase):
 	def test_read_from_mp4(self):
-		reader = Reader("./resources/Mása - becsukjuk, nem latszik.mp4")
+		reader = Reader("./resources/Masa - becsukjuk, nem latszik.mp4", keyframe_index=False)
 		img = reader.read(0)
 
 		self.assertEqual(img.dtype, np.uint8)
@@ -20,6 +29,169 @@ class TestReader(unittest.TestCase):
 		self.assertEqual(img.dtype, np.uint8)
 		self.assertEqual(img.shape[2], 3) # RGB
 
+	def test_read_native_dtype_from_sequence(self):
+		reader = Reader("./resources/MASA_sequence/MASA_sequence_00196.jpg")
+		rgb8 = reader.read(196)
+		rgb16 = reader.read(196, dtype=np.uint16)
+		half = reader.read(196, dtype=np.float16)
+
+		self.assertEqual(rgb16.dtype, np.uint16)
+		self.assertEqual(half.dtype, np.float16)
+		self.assertTrue(np.array_equal(rgb16//257, rgb8))
+		self.assertTrue(np.allclose(half, rgb8/255, atol=1e-3))
+
+	def test_read_into_from_sequence(self):
+		reader = Reader("./resources/MASA_sequence/MASA_sequence_00196.jpg")
+		out = np.zeros((reader.height, reader.width, 3), dtype=np.uint8)
+
+		self.assertTrue(reader.read_into(197, out))
+		self.assertTrue(np.array_equal(out, reader.read(197)))
+
+	def test_read_into_from_mp4(self):
+		reader = Reader("./resources/Masa - becsukjuk, nem latszik.mp4", keyframe_index=False)
+		out = np.zeros((reader.height, reader.width, 3), dtype=np.uint8)
+		self.assertTrue(reader.read_into(3, out))
+
+		other = Reader("./resources/Masa - becsukjuk, nem latszik.mp4", keyframe_index=False)
+		self.assertTrue(np.array_equal(out, other.read(3)))
+
+		out = np.zeros((reader.height, reader.width, 3), dtype=np.float32)
+		self.assertTrue(reader.read_into(3, out))
+		self.assertTrue(np.allclose(out, other.read(3, dtype=np.float32)))
+
+	def test_read_uint16_from_mp4(self):
+		reader = Reader("./resources/Masa - becsukjuk, nem latszik.mp4", keyframe_index=False)
+		rgb8 = reader.read(3)
+		rgb16 = reader.read(3, dtype=np.uint16)
+		self.assertEqual(rgb16.dtype, np.uint16)
+		self.assertTrue(np.array_equal(rgb16, rgb8.astype(np.uint16)*257))
+
+		out = np.zeros((reader.height, reader.width, 3), dtype=np.uint16)
+		self.assertTrue(reader.read_into(3, out))
+		self.assertTrue(np.array_equal(out, rgb16))
+
+	def test_cancelled_read(self):
+		cancel = np.ones(1, dtype=np.uint8)
+		reader = Reader("./resources/MASA_sequence/MASA_sequence_00196.jpg")
+		self.assertIsNone(reader.read(196, cancel=cancel))
+		out = np.zeros((reader.height, reader.width, 3), dtype=np.uint8)
+		self.assertFalse(reader.read_into(196, out, cancel=cancel))
+
+		reader = Reader("./resources/Masa - becsukjuk, nem latszik.mp4", keyframe_index=False)
+		self.assertIsNone(reader.read(10, cancel=cancel))
+		cancel[0] = 0
+		other = Reader("./resources/Masa - becsukjuk, nem latszik.mp4", keyframe_index=False)
+		self.assertTrue(np.array_equal(reader.read(10, cancel=cancel), other.read(10)))
+
+	def test_convert_pixels(self):
+		rgb8 = np.arange(256, dtype=np.uint8).reshape(16, 16, 1)
+		rgb16 = convert_pixels(rgb8, np.uint16)
+		self.assertTrue(np.array_equal(convert_pixels(rgb16, np.uint8), rgb8))
+		self.assertTrue(np.allclose(convert_pixels(rgb16, np.float32), rgb8/255))
+		self.assertIs(convert_pixels(rgb8, np.uint8), rgb8)
+
+		floats = np.array([-0.5, 0.5, 1.5], dtype=np.float32)
+		self.assertEqual(convert_pixels(floats, np.uint8).tolist(), [0, 128, 255])
+
+	def test_read_downsampled_from_sequence(self):
+		reader = Reader("./resources/MASA_sequence/MASA_sequence_00196.jpg")
+		full = reader.read(196)
+		for factor in [2, 4]:
+			reduced = reader.read(196, downsample=factor) # JPEG DCT scaling
+			self.assertEqual(reduced.shape, (720//factor, 1280//factor, 3))
+			self.assertLess(np.abs(reduced.mean()-full.mean()), 2)
+
+	def test_read_downsampled_from_mp4(self):
+		reader = Reader("./resources/Masa - becsukjuk, nem latszik.mp4", keyframe_index=False)
+		full = reader.read(0)
+		quarter = reader.read(0, dtype=np.float32, downsample=4)
+		self.assertEqual(quarter.shape, (180, 320, 3))
+		self.assertTrue(np.allclose(quarter, full[::4, ::4]/255))
+
+	def test_reduces_by_shrink(self):
+		self.assertTrue(Reader("./resources/Masa - becsukjuk, nem latszik.mp4", keyframe_index=False).reduces_by_shrink)
+		self.assertFalse(Reader("./resources/MASA_sequence/MASA_sequence_00196.jpg").reduces_by_shrink) # DCT scaling
+
+		with tempfile.TemporaryDirectory() as folder:
+			pixels = np.random.default_rng(0).integers(0, 256, (64, 96, 3), dtype=np.uint8)
+			path = str(Path(folder, "plate_0001.png"))
+			output = oiio.ImageOutput.create(path)
+			output.open(path, oiio.ImageSpec(96, 64, 3, oiio.UINT8))
+			output.write_image(pixels)
+			output.close()
+			reader = Reader(path)
+			self.assertTrue(reader.reduces_by_shrink)
+			self.assertTrue(np.array_equal(reader.read(1, downsample=4), pixels[::4, ::4]))
+
+	def test_sequence_still_rendering(self):
+		# frames written after the reader opened are picked up
+		pixels = np.zeros((8, 8, 3), dtype=np.uint8)
+		with tempfile.TemporaryDirectory() as folder, mock.patch.object(sequence_index, "UPDATE_INTERVAL", 0):
+			def render(frame):
+				path = str(Path(folder, "render_%04d.png" % frame))
+				output = oiio.ImageOutput.create(path)
+				output.open(path, oiio.ImageSpec(8, 8, 3, oiio.UINT8))
+				output.write_image(pixels+frame)
+				output.close()
+				os.utime(folder, ns=(0, os.stat(folder).st_mtime_ns+1)) # coarse mtime filesystems
+				return path
+			reader = Reader(render(1))
+			render(2)
+			self.assertEqual(reader.last_frame, 2)
+			self.assertTrue(np.all(reader.read(2) == 2))
+
+	def test_read_tiled_exr(self):
+		# edge tiles are partial, 100x70 in 32x32 tiles
+		pixels = np.random.default_rng(0).random((70, 100, 3)).astype(np.float16)
+		with tempfile.TemporaryDirectory() as folder:
+			path = str(Path(folder, "plate_0001.exr"))
+			spec = oiio.ImageSpec(100, 70, 3, oiio.HALF)
+			spec.tile_width, spec.tile_height = 32, 32
+			output = oiio.ImageOutput.create(path)
+			output.open(path, spec)
+			output.write_image(pixels)
+			output.close()
+			reader = Reader(path)
+			self.assertTrue(np.array_equal(reader.read(1, dtype=np.float16), pixels))
+			out = np.zeros((70, 100, 3), dtype=np.float32)
+			self.assertTrue(reader.read_into(1, out))
+			self.assertTrue(np.array_equal(out, pixels.astype(np.float32)))
+
+	def test_read_downsampled_from_mipmap(self):
+		# the reduced reads are the MIP levels of the texture
+		y, x = np.mgrid[0:128, 0:256].astype(np.float32)
+		pixels = np.stack([x/256, y/128, (x+y)/384], axis=-1)
+		with tempfile.TemporaryDirectory() as folder:
+			path = str(Path(folder, "plate_0001.exr"))
+			source = oiio.ImageBuf(oiio.ImageSpec(256, 128, 3, oiio.HALF))
+			source.set_pixels(oiio.ROI(), pixels)
+			self.assertTrue(oiio.ImageBufAlgo.make_texture(oiio.MakeTxTexture, source, path))
+			reader = Reader(path)
+			self.assertFalse(reader.reduces_by_shrink)
+			for factor in [1, 2, 4]:
+				reduced = reader.read(1, dtype=np.float32, downsample=factor)
+				self.assertEqual(reduced.shape, (128//factor, 256//factor, 3))
+				blocks = pixels.reshape(128//factor, factor, 256//factor, factor, 3).mean(axis=(1, 3))
+				self.assertTrue(np.allclose(reduced, blocks, atol=0.01))
+
+	def test_read_offset_data_window(self):
+		# the pixels of the data window, wherever it starts
+		pixels = np.random.default_rng(0).random((40, 60, 3)).astype(np.float16)
+		with tempfile.TemporaryDirectory() as folder:
+			path = str(Path(folder, "plate_0001.exr"))
+			spec = oiio.ImageSpec(60, 40, 3, oiio.HALF)
+			spec.x, spec.y = 10, 20
+			spec.full_width, spec.full_height = 100, 80
+			output = oiio.ImageOutput.create(path)
+			output.open(path, spec)
+			output.write_image(pixels)
+			output.close()
+			reader = Reader(path)
+			self.assertTrue(np.array_equal(reader.read(1, dtype=np.float16), pixels))
+			out = np.zeros((40, 60, 3), dtype=np.float16)
+			self.assertTrue(reader.read_into(1, out))
+			self.assertTrue(np.array_equal(out, pixels))
+
 	def test_read_from_large_dpx_sequence(self):
 		reader = Reader("./resources/EF_VFX_04/EF_VFX_04_0094900.dpx")
 		img = reader.read(93230)
@@ -28,8 +200,111 @@ class TestReader(unittest.TestCase):
 		self.assertEqual(img.shape[2], 3) # RGB
 
 
+	def test_forward_reads_from_mp4_do_not_seek(self):
+		reader = Reader("./resources/Masa - becsukjuk, nem latszik.mp4", keyframe_index=False)
+		for frame in range(5):
+			reader.read(frame)
+		reader.read(10) # skip ahead
+
+		self.assertEqual(reader.stats['seek'], 0)
+		self.assertEqual(reader.stats['sequential'], 6)
+		self.assertEqual(reader.stats['grab'], 5)
+
+		reader.read(2) # backwards
+		self.assertEqual(reader.stats['seek'], 1)
+
+	def test_skip_ahead_matches_seek_on_mp4(self):
+		reader = Reader("./resources/Masa - becsukjuk, nem latszik.mp4", keyframe_index=False)
+		reader.read(0)
+		skipped = reader.read(20)
+
+		other = Reader("./resources/Masa - becsukjuk, nem latszik.mp4", max_skip=0, keyframe_index=False)
+		seeked = other.read(20)
+
+		self.assertEqual(other.stats['seek'], 1)
+		self.assertTrue(np.array_equal(skipped, seeked))
+
+	def test_keyframe_index_from_mp4(self):
+		with tempfile.TemporaryDirectory() as cache_dir:
+			index = KeyframeIndex("./resources/Masa - becsukjuk, nem latszik.mp4", cache_dir=cache_dir)
+			self.assertFalse(index.load())
+			self.assertTrue(index.build())
+
+			self.assertEqual(index.frame_count, 147)
+			self.assertEqual(index.keyframes, [0, 125])
+			self.assertEqual(index.keyframe_before(130), 125)
+
+			# the second open reads the sidecar cache
+			cached = KeyframeIndex("./resources/Masa - becsukjuk, nem latszik.mp4", cache_dir=cache_dir)
+			self.assertTrue(cached.load())
+			self.assertEqual(cached.keyframes, index.keyframes)
+
+	def test_concurrent_builds_demux_once(self):
+		with tempfile.TemporaryDirectory() as cache_dir:
+			index = KeyframeIndex("./resources/Masa - becsukjuk, nem latszik.mp4", cache_dir=cache_dir)
+			with mock.patch.object(keyframe_index.cv2, "VideoCapture", wraps=keyframe_index.cv2.VideoCapture) as capture:
+				threads = [threading.Thread(target=index.build) for i in range(3)]
+				for thread in threads:
+					thread.start()
+				for thread in threads:
+					thread.join()
+			self.assertEqual(capture.call_count, 1)
+			self.assertEqual(index.frame_count, 147)
+
+	def test_readers_share_the_keyframe_index(self):
+		with tempfile.TemporaryDirectory() as folder, mock.patch.dict(os.environ, {"LOCALAPPDATA": folder, "XDG_CACHE_HOME": folder}):
+			path = shutil.copy("./resources/Masa - becsukjuk, nem latszik.mp4", Path(folder, "clip.mp4"))
+			readers = [Reader(str(path)) for i in range(3)]
+			self.assertTrue(all(reader._index is readers[0]._index for reader in readers))
+			self.assertTrue(readers[0].wait_for_index(10))
+			self.assertEqual(readers[2].last_frame, 146)
+			self.assertEqual(len(list(Path(folder, "PyVideoPlayer", "keyframes").glob("*.json"))), 1)
+			# without the index, the reader does not take the shared one
+			self.assertFalse(Reader(str(path), keyframe_index=False)._index.ready.is_set())
+
+	def test_malformed_keyframe_index(self):
+		with tempfile.TemporaryDirectory() as cache_dir:
+			index = KeyframeIndex("./resources/Masa - becsukjuk, nem latszik.mp4", cache_dir=cache_dir)
+			index.cache_path.parent.mkdir(parents=True, exist_ok=True)
+			for text in ['{"size": 1}', '[]', '{"size": null, "mtime": 0}', 'not json']:
+				index.cache_path.write_text(text)
+				self.assertFalse(index.load(), text)
+				self.assertFalse(index.ready.is_set())
+
+	def test_seek_to_keyframe_on_mp4(self):
+		reader = Reader("./resources/Masa - becsukjuk, nem latszik.mp4", keyframe_index=False)
+		reader._index.build()
+		self.assertEqual(reader.last_frame, 146)
+
+		reader.read(130)
+		self.assertEqual(reader.stats['seek'], 1)
+		self.assertEqual(reader.stats['grab'], 5) # decoded forward from keyframe 125
+
+		reader.read(124) # no keyframe in between, decode forward from 0
+		self.assertEqual(reader.stats['seek'], 2)
+		self.assertEqual(reader.stats['grab'], 5+124)
+
+	def test_decoder_pool_on_mp4(self):
+		reader = Reader("./resources/Masa - becsukjuk, nem latszik.mp4", keyframe_index=False, decoders=2)
+		reader.read(0)
+		reader.read(100) # a second decoder seeks
+		reader.read(1)
+		reader.read(101) # both decoders stay parked in their region
+
+		self.assertEqual(reader.stats['seek'], 1)
+		self.assertEqual(reader.stats['sequential'], 3)
+
+	def test_read_many_from_mp4(self):
+		reader = Reader("./resources/Masa - becsukjuk, nem latszik.mp4", keyframe_index=False, decoders=3)
+		frames = [frame for frame, rgb in reader.read_many(range(10, 40))]
+		self.assertEqual(frames, list(range(10, 40)))
+
+		single = Reader("./resources/Masa - becsukjuk, nem latszik.mp4", keyframe_index=False)
+		for frame, rgb in reader.read_many([15, 35]):
+			self.assertTrue(np.array_equal(rgb, single.read(frame)))
+
 	def test_metadata_from_mp4(self):
-		reader = Reader("./resources/Mása - becsukjuk, nem latszik.mp4")
+		reader = Reader("./resources/Masa - becsukjuk, nem latszik.mp4", keyframe_index=False)
 
 		self.assertEqual(reader.fps, 25.0)
 		self.assertEqual(reader.first_frame, 0)
@@ -63,7 +338,7 @@ class TestReader(unittest.TestCase):
 
 	# def test_metadata(self):
 	# 	# width, and height from video
-	# 	reader = Reader("./resources/Mása - becsukjuk, nem latszik.mp4")
+	# 	reader = Reader("./resources/Masa - becsukjuk, nem latszik.mp4")
 	# 	width, height = reader.width, reader.height
 
 	# 	self.assertEqual( (width, height), (1280, 720))
@@ -0,0 +1,48 @@
+import unittest
+import sys
+sys.path.append('../')
+
+from VideoPlayer.request_queue import RequestQueue, VISIBLE, LOOKAHEAD, BACKGROUND, EXPORT
+
+class TestRequestQueue(unittest.TestCase):
+	def test_priority_then_request_order(self):
+		queue = RequestQueue()
+		queue.push("export", EXPORT)
+		queue.push("b", LOOKAHEAD)
+		queue.push("a", LOOKAHEAD)
+		queue.push("visible", VISIBLE)
+		self.assertEqual([queue.pop()[0] for i in range(4)], ["visible", "b", "a", "export"])
+		self.assertFalse(queue)
+		with self.assertRaises(IndexError):
+			queue.pop()
+
+	def test_push_again_changes_priority(self):
+		queue = RequestQueue()
+		for key in ["a", "b", "c"]:
+			queue.push(key, LOOKAHEAD)
+		queue.push("a", BACKGROUND) # demote
+		queue.push("c", VISIBLE) # promote
+		self.assertEqual(len(queue), 3)
+		self.assertEqual(queue.priority("a"), BACKGROUND)
+		self.assertEqual(queue.keys(), ["c", "b", "a"])
+		self.assertEqual(queue.keys(LOOKAHEAD), ["b"])
+		self.assertEqual(queue.pop(), ("c", VISIBLE))
+
+	def test_remove(self):
+		queue = RequestQueue()
+		queue.push("a", LOOKAHEAD)
+		queue.push("b", LOOKAHEAD)
+		queue.remove("a")
+		self.assertNotIn("a", queue)
+		self.assertEqual(queue.pop(), ("b", LOOKAHEAD))
+		self.assertEqual(len(queue), 0)
+
+	def test_stale_entries_are_dropped(self):
+		queue = RequestQueue()
+		for i in range(1000):
+			queue.push("a", i%2)
+		self.assertLess(len(queue._heap), 100)
+		self.assertEqual(queue.pop(), ("a", 1))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+import sys
+sys.path.append('../')
+
+from VideoPlayer.scheduler import PrefetchScheduler
+
+class TestPrefetchScheduler(unittest.TestCase):
+	def setUp(self):
+		self.scheduler = PrefetchScheduler(lookahead=0.5, scrub_radius=2)
+
+	def test_forward(self):
+		self.assertEqual(self.scheduler.window(10, "forward", fps=8), [10, 11, 12, 13, 14])
+
+	def test_reverse(self):
+		self.assertEqual(self.scheduler.window(10, "reverse", fps=8), [10, 9, 8, 7, 6])
+
+	def test_paused(self):
+		# both sides, the nearest first
+		self.assertEqual(self.scheduler.window(10), [10, 11, 9, 12, 8])
+
+	def test_wraps_at_the_outpoint(self):
+		self.assertEqual(self.scheduler.window(19, "forward", fps=8, inpoint=10, outpoint=20), [19, 20, 10, 11, 12])
+
+	def test_wraps_at_the_inpoint(self):
+		self.assertEqual(self.scheduler.window(11, "reverse", fps=8, inpoint=10, outpoint=20), [11, 10, 20, 19, 18])
+		self.assertEqual(self.scheduler.window(10, inpoint=10, outpoint=20), [10, 11, 20, 12, 19])
+
+	def test_outside_the_loop(self):
+		# the playhead outside the in/out points does not wrap
+		self.assertEqual(self.scheduler.window(30, "forward", fps=8, inpoint=10, outpoint=20), [30, 31, 32, 33, 34])
+
+	def test_short_loop(self):
+		# a loop shorter than the window holds each frame once
+		self.assertEqual(self.scheduler.window(10, "forward", fps=8, inpoint=10, outpoint=12), [10, 11, 12])
+
+	def test_max_frames(self):
+		self.assertEqual(self.scheduler.window(10, "forward", fps=8, max_frames=2), [10, 11])
+		self.assertEqual(self.scheduler.window(10, "reverse", fps=8, max_frames=3), [10, 9, 8])
+		self.assertEqual(self.scheduler.window(10, max_frames=3), [10, 11, 9])
+		# the playhead is always in the window
+		self.assertEqual(self.scheduler.window(10, "forward", fps=8, max_frames=0), [10])
+
+	def test_default_fps(self):
+		self.assertEqual(len(self.scheduler.window(0, "forward")), 13) # 0.5s at 24fps, and the playhead
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+import sys
+import os
+import tempfile
+from pathlib import Path
+sys.path.append('../')
+
+from VideoPlayer.read.sequence_index import SequenceIndex, sequence_index
+
+def touch(folder, *names):
+	for name in names:
+		Path(folder, name).touch()
+
+class TestSequenceIndex(unittest.TestCase):
+	def test_frames_and_gaps(self):
+		with tempfile.TemporaryDirectory() as folder:
+			touch(folder, "shot_0998.exr", "shot_1001.exr", "shot_1002.exr", "shot_1005.exr")
+			touch(folder, "shot_1003.jpg", "shot_001.exr", "other_1004.exr") # not part of the sequence
+
+			index = SequenceIndex(folder, "shot_", 4, ".exr")
+			self.assertTrue(index.update())
+
+			self.assertEqual(index.frames, [998, 1001, 1002, 1005])
+			self.assertEqual((index.first_frame, index.last_frame), (998, 1005))
+			self.assertEqual(index.gaps, [(999, 1001), (1003, 1005)])
+			self.assertIn(1002, index)
+			self.assertNotIn(1003, index)
+			self.assertEqual(index.nearest(1004), 1002)
+			self.assertEqual(index.path(1001), f"{folder}/shot_1001.exr")
+
+	def test_incremental_update(self):
+		with tempfile.TemporaryDirectory() as folder:
+			touch(folder, "shot_0001.exr", "shot_0002.exr")
+			index = sequence_index(os.path.join(folder, "shot_0001.exr"))
+			self.assertEqual(index.frames, [1, 2])
+			self.assertFalse(index.update()) # folder did not change
+
+			touch(folder, "shot_0003.exr", "shot_0000.exr")
+			os.remove(os.path.join(folder, "shot_0002.exr"))
+			os.utime(folder, ns=(0, os.stat(folder).st_mtime_ns+1)) # coarse mtime filesystems
+
+			self.assertIs(sequence_index(os.path.join(folder, "shot_0003.exr")), index) # cached per folder
+			self.assertEqual(index.frames, [0, 1, 3])
+
+	def test_throttled_update(self):
+		with tempfile.TemporaryDirectory() as folder:
+			touch(folder, "shot_0001.exr")
+			index = SequenceIndex(folder, "shot_", 4, ".exr")
+			self.assertTrue(index.update_throttled())
+			touch(folder, "shot_0002.exr")
+			os.utime(folder, ns=(0, os.stat(folder).st_mtime_ns+1))
+
+			self.assertFalse(index.update_throttled(interval=60)) # checked just now
+			self.assertEqual(index.frames, [1])
+			self.assertTrue(index.update_throttled(interval=0))
+			self.assertEqual(index.frames, [1, 2])
+
+
+if __name__ == '__main__':
+	unittest.main()